@@ -0,0 +1,216 @@
+"""Throughput of the SQS consumer draining a FIFO queue
+
+Fills a queue with synthetic articles spread over a number of message
+groups, then drains it with sqs_consumer.Consumer into a memory sink for
+each worker count. Messages per second of each case are written to a JSON
+report, and --compare prints the change against an earlier report.
+
+By default the queue is an in-memory FIFO stub that hands each group to
+one receiver at a time, like SQS, and waits --latency-ms per call to stand
+in for the network. With --sqs moto it is a moto queue, which is exact but
+spends most of its time in moto itself.
+
+Usage: python -m benchmark.consumer [--sqs stub|moto] [--latency-ms N]
+    [--messages N] [--groups N] [--workers N ...] [--output FILE]
+    [--compare FILE]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from benchmark.throughput import report
+
+WORKERS = [1, 4, 8]
+BODY_TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 20
+
+
+class StubFIFOQueue:
+    """In-memory FIFO queue with SQS's receive and batch delete calls
+
+    A group with messages in flight is not handed to another receiver until
+    they are deleted, and every call waits latency seconds.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.groups = {}
+        self.in_flight = {}
+        self._handles = itertools.count()
+        self._lock = threading.Lock()
+
+    def send_message_batch(self, QueueUrl, Entries):
+        with self._lock:
+            for entry in Entries:
+                self.groups.setdefault(entry["MessageGroupId"], deque()).append(
+                    entry["MessageBody"]
+                )
+        return {"Successful": [{"Id": e["Id"]} for e in Entries]}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, **kwargs):
+        time.sleep(self.latency)
+        messages = []
+        with self._lock:
+            for group, bodies in self.groups.items():
+                if group in self.in_flight.values() or not bodies:
+                    continue
+                while bodies and len(messages) < MaxNumberOfMessages:
+                    handle = str(next(self._handles))
+                    self.in_flight[handle] = group
+                    messages.append(
+                        {
+                            "MessageId": handle,
+                            "ReceiptHandle": handle,
+                            "Body": bodies.popleft(),
+                            "Attributes": {"MessageGroupId": group},
+                        }
+                    )
+                if len(messages) == MaxNumberOfMessages:
+                    break
+        return {"Messages": messages} if messages else {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        time.sleep(self.latency)
+        with self._lock:
+            for entry in Entries:
+                self.in_flight.pop(entry["ReceiptHandle"], None)
+        return {"Successful": [{"Id": e["Id"]} for e in Entries]}
+
+
+def fill(sqs, queue_url: str, messages: int, groups: int) -> None:
+    from src.lambda_function import json_dumps
+
+    for start in range(0, messages, 10):
+        sqs.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {
+                    "Id": str(i),
+                    "MessageBody": json_dumps(
+                        {
+                            "webTitle": f"Synthetic article {i}",
+                            "webUrl": f"https://www.theguardian.com/benchmark/{i}",
+                            "webPublicationDate": "2025-04-01T00:00:00Z",
+                            "reference": "benchmark",
+                            "content_preview": BODY_TEXT,
+                        }
+                    ),
+                    "MessageGroupId": f"benchmark#{i % groups}",
+                }
+                for i in range(start, min(start + 10, messages))
+            ],
+        )
+
+
+def run_case(
+    messages: int, groups: int, workers: int, sqs: str = "stub", latency: float = 0.0
+) -> dict:
+    """Drain a freshly filled queue and measure it"""
+    from src.sqs_consumer import Consumer, MemorySink
+
+    sink = MemorySink()
+    if sqs == "stub":
+        queue = StubFIFOQueue(latency)
+        fill(queue, "stub", messages, groups)
+        stats = Consumer("stub", sink, queue, workers=workers, wait_seconds=0).run(
+            drain=True
+        )
+    else:
+        stats = _run_moto_case(messages, groups, workers, sink)
+    if len(sink.articles) != messages:
+        raise RuntimeError(f"Expected {messages} articles, got {len(sink.articles)}")
+    return {
+        "messages": messages,
+        "groups": groups,
+        "workers": workers,
+        "sqs": sqs,
+        "latency_ms": round(latency * 1000),
+        "wall_seconds": stats["seconds"],
+        "messages_per_second": stats["messagesPerSecond"],
+    }
+
+
+def _run_moto_case(messages: int, groups: int, workers: int, sink) -> dict:
+    import boto3
+    from moto import mock_aws
+
+    from src.sqs_consumer import Consumer
+
+    os.environ.update(
+        {
+            "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "eu-west-2"),
+            "AWS_ACCESS_KEY_ID": "testing",
+            "AWS_SECRET_ACCESS_KEY": "testing",
+        }
+    )
+    with mock_aws():
+        sqs = boto3.client("sqs")
+        queue_url = sqs.create_queue(
+            QueueName="benchmark.fifo",
+            Attributes={"FifoQueue": "true", "ContentBasedDeduplication": "true"},
+        )["QueueUrl"]
+        fill(sqs, queue_url, messages, groups)
+        return Consumer(queue_url, sink, sqs, workers=workers, wait_seconds=0).run(
+            drain=True
+        )
+
+
+def compare(old: dict, new: dict) -> None:
+    """Print the change in throughput for cases in both reports"""
+
+    def key(case):
+        return (
+            case["messages"],
+            case["groups"],
+            case["workers"],
+            case["sqs"],
+            case["latency_ms"],
+        )
+
+    previous = {key(case): case for case in old["cases"]}
+    print(f"Compared with {old.get('commit')} ({old.get('timestamp')}):")
+    for case in new["cases"]:
+        before = previous.get(key(case))
+        if before:
+            speed = case["messages_per_second"] / before["messages_per_second"] - 1
+            print(f"workers={case['workers']:<3} {speed:>+8.1%} msg/s")
+
+
+def main(arg_list: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sqs", choices=["stub", "moto"], default="stub")
+    parser.add_argument(
+        "--latency-ms", type=float, default=20, help="per call, stub queue only"
+    )
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--groups", type=int, default=8, help="FIFO message groups")
+    parser.add_argument("--workers", type=int, nargs="+", default=WORKERS)
+    parser.add_argument("--output", default="benchmark-consumer.json")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args(arg_list)
+
+    cases = []
+    for workers in args.workers:
+        case = run_case(
+            args.messages, args.groups, workers, args.sqs, args.latency_ms / 1000
+        )
+        print(
+            f"workers={workers:<3} {case['wall_seconds']:>8.3f}s "
+            f"{case['messages_per_second']:>9.1f} msg/s"
+        )
+        cases.append(case)
+    new = report(cases)
+    with open(args.output, "w") as f:
+        json.dump(new, f, indent=2)
+    print(f"Report written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), new)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,66 @@
+"""Cold-import time of the Lambda handler and the local invoke CLI
+
+Each module is imported in a fresh interpreter with -X importtime and the
+median cumulative time over several runs is reported, together with the
+heaviest modules it imports directly.
+
+Usage: python -m benchmark.import_time [--runs 5] [--top 5]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+MODULES = ("src.lambda_function", "src.local_invoke")
+
+
+def import_times(module: str) -> tuple[int, dict[str, int]]:
+    """Cumulative import time of module and of each module it imports directly
+
+    Returns:
+        tuple: total microseconds, {direct import: cumulative microseconds}
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Nesting is shown as two spaces of indentation per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == module:
+                return int(cumulative), children
+            children = {}
+    raise RuntimeError(f"{module} missing from -X importtime output")
+
+
+def main(arg_list: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args(arg_list)
+
+    for module in MODULES:
+        runs = [import_times(module) for _ in range(args.runs)]
+        total = statistics.median(total for total, _ in runs)
+        print(f"{module}: {total / 1000:.1f} ms")
+        children = {
+            name: statistics.median(imports.get(name, 0) for _, imports in runs)
+            for name in runs[0][1]
+        }
+        heaviest = sorted(children.items(), key=lambda item: -item[1])
+        for name, cumulative in heaviest[: args.top]:
+            print(f"    {name:<24} {cumulative / 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
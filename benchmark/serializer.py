@@ -0,0 +1,55 @@
+"""Micro-benchmark of the JSON backends used for SQS message bodies
+
+Usage: python -m benchmark.serializer [--messages 1000] [--repeat 5]
+"""
+
+import argparse
+import timeit
+
+from src.lambda_function import JSON_BACKENDS, _load_json_backend, _parse_results
+
+
+def sample_messages(count: int, preview_chars: int) -> list[dict]:
+    results = [
+        {
+            "webPublicationDate": f"2025-04-{i % 28 + 1:02}T12:00:00Z",
+            "webTitle": f"Sample article {i} – “quoted” headline",
+            "webUrl": f"https://www.theguardian.com/world/2025/apr/{i}/sample",
+            "fields": {"trailText": ("Lorem ipsum dolor sit amet é ") * 400},
+        }
+        for i in range(count)
+    ]
+    return _parse_results(results, "benchmark", "trailText", preview_chars)
+
+
+def main(arg_list: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--preview-chars", type=int, default=300)
+    args = parser.parse_args(arg_list)
+
+    messages = sample_messages(args.messages, args.preview_chars)
+    print(f"{'backend':<8} {'ms per 1k dumps':>16} {'ms per 1k loads':>16}")
+    for backend in JSON_BACKENDS:
+        name, dumps, loads = _load_json_backend(backend)
+        if name != backend:
+            print(f"{backend:<8} {'not installed':>16}")
+            continue
+        bodies = [dumps(m) for m in messages]
+        dump_time = min(
+            timeit.repeat(
+                lambda: [dumps(m) for m in messages], number=1, repeat=args.repeat
+            )
+        )
+        load_time = min(
+            timeit.repeat(
+                lambda: [loads(b) for b in bodies], number=1, repeat=args.repeat
+            )
+        )
+        scale = 1000 * 1000 / len(messages)
+        print(f"{name:<8} {dump_time * scale:>16.3f} {load_time * scale:>16.3f}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
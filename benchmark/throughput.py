@@ -0,0 +1,302 @@
+"""End-to-end throughput of lambda_handler against a local Guardian stub
+
+Every case in the parameter grid runs in a fresh process. The handler
+fetches from a local HTTP stub of the search endpoint and publishes to a
+moto SQS FIFO queue. Wall time, messages per second and peak RSS of each
+case are written to a JSON report, and --compare prints the change
+against an earlier report.
+
+moto's FIFO queue slows down as it fills, so large grids are best run
+with --sqs null, which accepts every batch without storing it. With
+--latency-ms the stub waits that long before each page, and the null
+queue before each batch, to show how much fetching overlaps publishing.
+
+Usage: python -m benchmark.throughput [--quick] [--sqs moto|null]
+    [--latency-ms N] [--results N ...] [--queries N ...] [--output FILE]
+    [--compare FILE]
+"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+GRID = {
+    "results": [10, 50, 200],
+    "queries": [1, 4],
+    "preview": [False, True],
+}
+QUICK_GRID = {"results": [10, 100], "queries": [1, 2], "preview": [False, True]}
+PAGE_SIZE = 200
+BODY_TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 100
+
+
+class GuardianStub(ThreadingHTTPServer):
+    """Serves synthetic /search result sets of `total` results per query"""
+
+    daemon_threads = True
+
+    def __init__(self, total: int = 10, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), _SearchHandler)
+        self.total = total
+        self.latency = latency
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/search?"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class _SearchHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = dict(parse_qsl(urlsplit(self.path).query))
+        total = self.server.total
+        time.sleep(self.server.latency)
+        page_size = int(params.get("page-size", 10))
+        page = int(params.get("page", 1))
+        pages = max(1, math.ceil(total / page_size))
+        start = (page - 1) * page_size
+        results = [
+            _result(params.get("q", ""), i, params.get("show-fields"))
+            for i in range(start, min(start + page_size, total))
+        ]
+        body = json.dumps(
+            {
+                "response": {
+                    "status": "ok",
+                    "total": total,
+                    "currentPage": page,
+                    "pages": pages,
+                    "results": results,
+                }
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _result(query: str, i: int, show_fields: str | None) -> dict:
+    result = {
+        "id": f"{query}/{i}",
+        "webPublicationDate": f"2025-04-{i % 28 + 1:02}T{i % 24:02}:00:00Z",
+        "webTitle": f"Synthetic article {i} about {query}",
+        "webUrl": f"https://www.theguardian.com/{query}/{i}",
+    }
+    if show_fields:
+        result["fields"] = {field: BODY_TEXT for field in show_fields.split(",")}
+    return result
+
+
+class NullSQS:
+    """SQS client stand-in that accepts every message batch after latency seconds"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def send_message_batch(self, QueueUrl, Entries):
+        time.sleep(self.latency)
+        return {"Successful": [{"Id": e["Id"], "MessageId": e["Id"]} for e in Entries]}
+
+
+def run_case(
+    stub_url: str,
+    results: int,
+    queries: int,
+    preview: bool,
+    sqs: str = "moto",
+    latency: float = 0.0,
+) -> dict:
+    """Run one grid case in the current process and measure it"""
+    import boto3
+    from moto import mock_aws
+
+    from src import lambda_function
+
+    lambda_function.BASE_URL = stub_url
+    os.environ.update(
+        {
+            "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "eu-west-2"),
+            "AWS_ACCESS_KEY_ID": "testing",
+            "AWS_SECRET_ACCESS_KEY": "testing",
+            "api_key": "benchmark",
+            "GUARDIAN_RATE_PER_SECOND": "100000",
+            "GUARDIAN_RATE_PER_DAY": "100000000",
+            "METRICS_EMF": "0",
+        }
+    )
+    event = {
+        "jobs": [{"q": f"query{i}", "ref": f"ref{i}"} for i in range(queries)],
+        "paginate": True,
+        "page_size": PAGE_SIZE,
+    }
+    if preview:
+        event["preview"] = "bodyText"
+    with mock_aws():
+        queue = boto3.client("sqs").create_queue(
+            QueueName="benchmark.fifo",
+            Attributes={"FifoQueue": "true", "ContentBasedDeduplication": "true"},
+        )
+        os.environ["sqs_queue_url"] = queue["QueueUrl"]
+        if sqs == "null":
+            lambda_function.set_sqs_client(NullSQS(latency))
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(event, {})
+        wall = time.perf_counter() - start
+    sent = response["messagesSent"]
+    if sent != results * queries:
+        raise RuntimeError(f"Expected {results * queries} messages, sent {sent}")
+    return {
+        "wall_seconds": round(wall, 4),
+        "messages": sent,
+        "messages_per_second": round(sent / wall, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "stages_ms": response["metrics"]["durationsMs"],
+    }
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_grid(
+    grid: dict, repeat: int = 1, sqs: str = "moto", latency: float = 0.0
+) -> list[dict]:
+    cases = []
+    # Spawned rather than forked, so each run's peak RSS is its own
+    context = multiprocessing.get_context("spawn")
+    for results, queries, preview in itertools.product(*grid.values()):
+        with GuardianStub(results, latency) as stub:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    runs.append(
+                        pool.submit(
+                            run_case,
+                            stub.url,
+                            results,
+                            queries,
+                            preview,
+                            sqs,
+                            latency,
+                        ).result()
+                    )
+        best = min(runs, key=lambda run: run["wall_seconds"])
+        case = {
+            "results": results,
+            "queries": queries,
+            "preview": preview,
+            "sqs": sqs,
+            "latency_ms": round(latency * 1000),
+            **best,
+        }
+        print(
+            f"results={results:<5} queries={queries:<2} preview={preview!s:<5} "
+            f"{case['wall_seconds']:>8.3f}s {case['messages_per_second']:>9.1f} msg/s "
+            f"{case['peak_rss_mb']:>7.1f} MB"
+        )
+        cases.append(case)
+    return cases
+
+
+def report(cases: list[dict]) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cases": cases,
+    }
+
+
+def compare(old: dict, new: dict) -> None:
+    """Print the change in throughput and peak RSS for cases in both reports"""
+
+    def key(case):
+        return (
+            case["results"],
+            case["queries"],
+            case["preview"],
+            case["sqs"],
+            case.get("latency_ms", 0),
+        )
+
+    previous = {key(case): case for case in old["cases"]}
+    print(f"Compared with {old.get('commit')} ({old.get('timestamp')}):")
+    for case in new["cases"]:
+        before = previous.get(key(case))
+        if not before:
+            continue
+        speed = case["messages_per_second"] / before["messages_per_second"] - 1
+        rss = case["peak_rss_mb"] - before["peak_rss_mb"]
+        print(
+            f"results={case['results']:<5} queries={case['queries']:<2} "
+            f"preview={case['preview']!s:<5} {speed:>+8.1%} msg/s {rss:>+7.1f} MB"
+        )
+
+
+def main(arg_list: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller grid")
+    parser.add_argument("--results", type=int, nargs="+", help="results per query")
+    parser.add_argument("--queries", type=int, nargs="+", help="queries per event")
+    parser.add_argument("--sqs", choices=["moto", "null"], default="moto")
+    parser.add_argument(
+        "--latency-ms", type=float, default=0, help="per page and per SQS batch"
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="keep best of N")
+    parser.add_argument("--output", default="benchmark-report.json")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args(arg_list)
+
+    grid = dict(QUICK_GRID if args.quick else GRID)
+    if args.results:
+        grid["results"] = args.results
+    if args.queries:
+        grid["queries"] = args.queries
+    new = report(run_grid(grid, args.repeat, args.sqs, args.latency_ms / 1000))
+    with open(args.output, "w") as f:
+        json.dump(new, f, indent=2)
+    print(f"Report written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), new)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
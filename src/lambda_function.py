@@ -1,23 +1,182 @@
-from botocore.exceptions import ClientError
+from __future__ import annotations
+
 import os
 import logging
-import requests
-import boto3
 import json
+import time
+import base64
+import codecs
+import gzip
+import hashlib
+import importlib
+import math
+import queue
+import random
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from collections.abc import Callable, Iterable, Iterator
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+from typing import TYPE_CHECKING
+
+# boto3, botocore and requests are imported on first use, so that a cold
+# start that fails validation does not pay for loading them
+if TYPE_CHECKING:
+    import boto3
+    import requests
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 BASE_URL = "https://content.guardianapis.com/search?"
+MAX_PAGE_SIZE = 200
+PREVIEW_FIELDS = ["bodyText", "trailText"]
+DEFAULT_PREVIEW_CHARS = 1000
+# Worst case 6 bytes per character once JSON-escaped, well under SQS's 256 KiB
+MAX_PREVIEW_CHARS = 40_000
+SQS_BATCH_SIZE = 10
+SQS_MAX_MESSAGE_BYTES = 256 * 1024
+SQS_MAX_BATCH_BYTES = 256 * 1024
+ENVELOPE_VERSION = 1
+RESPONSE_MODES = ["full", "summary", "sample", "ids"]
+DEFAULT_RELEVANCE_THRESHOLD = 0.05
+# Title terms count this many times over preview terms
+TITLE_WEIGHT = 2
+# Query and keyword weights cached across warm invocations
+MAX_RELEVANCE_PROFILES = 256
+TERM_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its not of on or that the "
+    "this to was were will with".split()
+)
+SHARD_MODES = ["hash", "day"]
+DEFAULT_SHARDS = 8
+MAX_SHARDS = 1000
+DEFAULT_SAMPLE_SIZE = 10
+SQS_BATCH_RETRIES = 3
+SQS_RETRY_DELAY = 0.1
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+API_MAX_RETRIES = 4
+API_BACKOFF_BASE = 0.5
+API_MAX_BACKOFF = 30
+PUBLISHED_INDEX_KEY = "published_urls"
+API_CALLS_KEY_PREFIX = "api_calls#"
+API_CALLS_TTL = 2 * 24 * 3600
+# URLs per stored shard of the published index, about 200 KB in set mode,
+# well under DynamoDB's 400 KB item limit
+PUBLISHED_INDEX_SHARD_CAPACITY = 10_000
+METRICS_NAMESPACE = "GuardianStreaming"
+PROFILE_TOP = 20
+INVOCATION_KEY_PREFIX = "invocation#"
+INVOCATION_RECORD_TTL = 7 * 24 * 3600
+CORRELATION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,128}")
+# Time left when a job stops taking new results, to publish what it holds
+TIME_BUDGET_MARGIN_MS = 2000
+# Results fetched ahead of publishing, on a thread of their own
+PIPELINE_DEPTH = 100
+MAX_JOB_WORKERS = 8
+HTTP_POOL_SIZE = 10
+HTTP_CHUNK_SIZE = 16 * 1024
+JSON_BACKENDS = ("orjson", "ujson", "json")
+SQS_CLIENT_OPTIONS = {
+    "connect_timeout": 2,
+    "read_timeout": 5,
+    "retries": {"max_attempts": 3, "mode": "standard"},
+    "max_pool_connections": HTTP_POOL_SIZE,
+}
+
+
+def _load_json_backend(name: str = "auto") -> tuple[str, Callable, Callable]:
+    """Pick a JSON backend by name, or the fastest one installed for "auto"
+
+    Every backend serialises to the same compact UTF-8 text as the stdlib
+    fallback, so message bodies do not depend on what is installed. Only
+    floats small or large enough for exponent notation may be spelled
+    differently.
+
+    Returns:
+        tuple: backend name, dumps(obj) -> str and loads(str | bytes)
+    """
+    if name not in ("auto", *JSON_BACKENDS):
+        logger.warning("Unknown JSON_BACKEND %s, choosing automatically", name)
+        name = "auto"
+    for candidate in JSON_BACKENDS if name == "auto" else (name,):
+        try:
+            module = importlib.import_module(candidate)
+        except ImportError:
+            if name != "auto":
+                logger.warning("JSON backend %s not installed, using json", name)
+            continue
+        if candidate == "orjson":
+            return candidate, lambda obj: module.dumps(obj).decode(), module.loads
+        if candidate == "ujson":
+            return (
+                candidate,
+                lambda obj: module.dumps(
+                    obj, ensure_ascii=False, escape_forward_slashes=False
+                ),
+                module.loads,
+            )
+        break
+    return (
+        "json",
+        lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")),
+        json.loads,
+    )
+
+
+JSON_BACKEND, json_dumps, json_loads = _load_json_backend(
+    os.environ.get("JSON_BACKEND", "auto")
+)
+
+# Reused across warm invocations, created on first use
+_http_session = None
+_sqs_client = None
+_config = None
+_response_cache = None
+_state_store = None
+_rate_limiter = None
+_profile_weights = OrderedDict()
+_profiles_lock = threading.Lock()
 
 
 def lambda_handler(event, context):
+    try:
+        correlation_id = _correlation_id(event)
+    except ValueError:
+        correlation_id = None  # rejected with a 400 by _handle
+    try:
+        # Checked up front so that unprofiled invocations pay nothing for it
+        if os.environ.get("PROFILE") == "1" or (
+            isinstance(event, dict) and event.get("profile")
+        ):
+            output = _profiled(_handle, event, context)
+        else:
+            output = _handle(event, context)
+    except Exception as e:
+        # Recorded all the same, so that a caller polling for it stops waiting
+        if correlation_id:
+            failure = {"statusCode": 500, "message": f"{e.__class__.__name__}: {e}"}
+            _record_invocation(correlation_id, failure, status="failed")
+        raise
+    if correlation_id:
+        output["correlationId"] = correlation_id
+        _record_invocation(correlation_id, output)
+    return output
+
+
+def _handle(event, context):
     logger.info("Invoked with event: %s", event)
+    _metrics.reset()
     # Handle event
     try:
-        query = event["q"]
-        date = event.get("d", None)
-        reference = event["ref"]
+        with _metrics.timer("validate"):
+            jobs = _parse_jobs(event)
+            options = _parse_options(event)
     except KeyError as e:
         missing_key = e.args[0]
         logger.error("Missing required event key: %s", missing_key)
@@ -26,10 +185,20 @@ def lambda_handler(event, context):
             "error": "Bad request",
             "message": f"Missing required event key: {missing_key} - 'q' and 'ref' required",
         }
+    except ValueError as e:
+        logger.error("Invalid event value: %s", str(e))
+        return {"statusCode": 400, "error": "Bad request", "message": str(e)}
     # Get ENV vars
     logger.info("Attempting to retrieve environment variables")
     try:
-        api_key, sqs_queue_url = _env_variables()
+        api_key, sqs_queue_url = _get_config()
+        cache = _get_response_cache()
+        limiter = _get_rate_limiter()
+        if options["incremental"] or options["dedup"]:
+            store = _get_state_store()
+        if options["dedup"]:
+            options["published"] = _load_published_index(store)
+        options["time_left"] = _time_budget(context)
         logger.info("Environment variables retrieved")
     except KeyError as e:
         missing_key = e.args[0]
@@ -39,28 +208,724 @@ def lambda_handler(event, context):
             "error": "Internal server error",
             "message": f"Missing required environment variable: {missing_key}",
         }
+    except ValueError as e:
+        logger.error("Invalid environment variable: %s", str(e))
+        return {
+            "statusCode": 500,
+            "error": "Internal server error",
+            "message": f"Invalid environment variable: {e}",
+        }
 
-    # Build URL
-    url = _build_url(query, api_key, date)
-    logger.info("URL built, attempting API call")
-    # Collect response from Guardian API
-    data = _fetch_data(url)
-    # Process results into required format
-    message_list = _parse_results(data, reference)
-    # Send messages to SQS queue
-    sqs_client = _get_sqs_client()
-    output = {"statusCode": 200, "messagesSent": 0, "messagesFailed": 0}
-    for message in message_list:
-        response = _send_to_SQS(message, reference, sqs_client, sqs_queue_url)
-        if response:
-            output["messagesSent"] += 1
+    if cache:
+        cache.reset_stats()
+    limiter.reset_stats()
+    try:
+        if "jobs" not in event:
+            summary = _run_job(jobs[0], api_key, sqs_queue_url, options)
+            output = {
+                "statusCode": 200,
+                "messagesSent": summary["messagesSent"],
+                "messagesFailed": summary["messagesFailed"],
+            }
+            # Messages, ids or a sample of them, unless the caller wants counts only
+            for key in ("messages", "messagesOmitted", "continuation"):
+                if key in summary:
+                    output[key] = summary[key]
+            if options["incremental"]:
+                output["watermark"] = summary["watermark"]
+            if options["dedup"]:
+                output["messagesSkipped"] = summary["messagesSkipped"]
+            if options["relevance"]:
+                output["messagesDiscarded"] = summary["messagesDiscarded"]
+            if options["envelope"]:
+                output["envelopesSent"] = summary["envelopesSent"]
         else:
-            output["messagesFailed"] += 1
+            summaries = _run_jobs(jobs, api_key, sqs_queue_url, options)
+            output = {
+                "statusCode": 200,
+                "messagesSent": sum(s["messagesSent"] for s in summaries),
+                "messagesFailed": sum(s["messagesFailed"] for s in summaries),
+                "jobs": summaries,
+            }
+            if options["dedup"]:
+                output["messagesSkipped"] = sum(
+                    s.get("messagesSkipped", 0) for s in summaries
+                )
+            if options["relevance"]:
+                output["messagesDiscarded"] = sum(
+                    s.get("messagesDiscarded", 0) for s in summaries
+                )
+            if options["envelope"]:
+                output["envelopesSent"] = sum(
+                    s.get("envelopesSent", 0) for s in summaries
+                )
+    finally:
+        # Also records what a job published before raising, so it is not
+        # published again once the SQS deduplication window has passed
+        if options["dedup"]:
+            _save_published_index(store, options["published"])
+    if cache:
+        output["cache"] = {"hits": cache.hits, "misses": cache.misses}
+    output["throttle"] = {
+        "throttledSeconds": round(limiter.throttled_seconds, 3),
+        "retries": limiter.retries,
+    }
+    output["metrics"] = _metrics.snapshot(apiRetries=limiter.retries)
+    _emit_metrics(output)
+    return output
+
+
+def _profiled(handler, event, context) -> dict:
+    """Run handler under cProfile and tracemalloc and report where time went
+
+    The top PROFILE_TOP (default 20) functions by cumulative time and the
+    largest allocation sites are logged, written to PROFILE_DIR (default
+    /tmp) as <id>.txt next to the raw <id>.prof stats, and returned in the
+    response under "profile".
+    """
+    import cProfile
+    import io
+    import pstats
+    import tracemalloc
+
+    top = _env_int("PROFILE_TOP", PROFILE_TOP)
+    profiler = cProfile.Profile()
+    was_tracing = tracemalloc.is_tracing()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        profiler.enable()
+        try:
+            output = handler(event, context)
+        finally:
+            profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
 
-    output["messages"] = message_list
+    stats = pstats.Stats(profiler)
+    hotspots = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:top]
+    allocations = snapshot.statistics("lineno")[:top]
+    profile = {
+        "peakMemoryBytes": peak,
+        "hotspots": [
+            {
+                "function": pstats.func_std_string(func),
+                "calls": calls,
+                "totalMs": round(total * 1000, 3),
+                "cumulativeMs": round(cumulative * 1000, 3),
+            }
+            for func, (_, calls, total, cumulative, _) in hotspots
+        ],
+        "allocations": [
+            {
+                "location": str(stat.traceback[0]),
+                "sizeBytes": stat.size,
+                "count": stat.count,
+            }
+            for stat in allocations
+        ],
+    }
+
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(top)
+    text.write(f"Peak traced memory: {peak} bytes\n")
+    for stat in allocations:
+        text.write(f"{stat}\n")
+    logger.info("Profile:\n%s", text.getvalue())
+    name = getattr(context, "aws_request_id", None) or time.strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(os.environ.get("PROFILE_DIR", "/tmp"), f"profile-{name}")
+    try:
+        stats.dump_stats(f"{path}.prof")
+        with open(f"{path}.txt", "w") as f:
+            f.write(text.getvalue())
+        profile["file"] = f"{path}.txt"
+    except OSError as e:
+        logger.error("Failed to write profile: %s", str(e))
+    if isinstance(output, dict):
+        output["profile"] = profile
     return output
 
 
+class _Metrics:
+    """Stage durations and byte/retry counters for one invocation
+
+    Durations are summed over all jobs, so with several concurrent jobs a
+    stage can add up to more than the invocation's wall time.
+    """
+
+    STAGES = ("validate", "fetch", "parse", "filter", "publish")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.perf_counter()
+        self.durations = dict.fromkeys(self.STAGES, 0.0)
+        self.counters = {
+            "bytesFetched": 0,
+            "bytesPublished": 0,
+            "apiRequests": 0,
+            "sqsRetries": 0,
+        }
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.durations[stage] += seconds
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += amount
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed(self, items: Iterable, stage: str) -> Iterator:
+        """Yield from items, adding the time spent waiting for each to stage"""
+        iterator = iter(items)
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            self.add_time(stage, elapsed)
+
+    def snapshot(self, **counters) -> dict:
+        """Durations in milliseconds, including the total so far, and counters"""
+        durations = {**self.durations, "total": time.perf_counter() - self.started}
+        return {
+            "durationsMs": {k: round(v * 1000, 3) for k, v in durations.items()},
+            **self.counters,
+            **counters,
+        }
+
+
+_metrics = _Metrics()
+
+
+def _emit_metrics(output: dict) -> None:
+    """Print the invocation's metrics as a CloudWatch Embedded Metric Format line
+
+    Printed rather than logged, as EMF needs the JSON alone on its line.
+    Disabled with METRICS_EMF=0, namespace from METRICS_NAMESPACE.
+    """
+    if os.environ.get("METRICS_EMF", "1") == "0":
+        return
+    metrics = output["metrics"]
+    values = {
+        f"{stage.capitalize()}Duration": (ms, "Milliseconds")
+        for stage, ms in metrics["durationsMs"].items()
+    }
+    values.update(
+        {
+            "BytesFetched": (metrics["bytesFetched"], "Bytes"),
+            "BytesPublished": (metrics["bytesPublished"], "Bytes"),
+            "ApiRequests": (metrics["apiRequests"], "Count"),
+            "ApiRetries": (metrics["apiRetries"], "Count"),
+            "SqsRetries": (metrics["sqsRetries"], "Count"),
+            "MessagesSent": (output["messagesSent"], "Count"),
+            "MessagesFailed": (output["messagesFailed"], "Count"),
+        }
+    )
+    if "messagesDiscarded" in output:
+        values["MessagesDiscarded"] = (output["messagesDiscarded"], "Count")
+    line = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": os.environ.get("METRICS_NAMESPACE", METRICS_NAMESPACE),
+                    "Dimensions": [["FunctionName"]],
+                    "Metrics": [
+                        {"Name": name, "Unit": unit}
+                        for name, (_, unit) in values.items()
+                    ],
+                }
+            ],
+        },
+        "FunctionName": os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local"),
+        **{name: value for name, (value, _) in values.items()},
+    }
+    print(json_dumps(line), flush=True)
+
+
+def _parse_jobs(event: dict) -> list[dict]:
+    """Read one {q, d, ref} job from the event, or a list of them under "jobs"
+
+    A job resuming an earlier invocation carries its "continuation" token.
+
+    Raises:
+        KeyError: event or job missing "q" or "ref"
+        ValueError: continuation token invalid or issued for another job
+
+    Returns:
+        list[dict]: [{"q": query, "d": date | None, "ref": reference,
+            "resume": continuation | None}]
+    """
+    if "jobs" not in event:
+        return [_job(event)]
+    if not isinstance(event["jobs"], list) or not event["jobs"]:
+        raise KeyError("jobs")
+    jobs = []
+    for i, job in enumerate(event["jobs"]):
+        for key in ["q", "ref"]:
+            if not isinstance(job, dict) or key not in job:
+                raise KeyError(f"jobs[{i}].{key}")
+        jobs.append(_job(job))
+    return jobs
+
+
+def _job(entry: dict) -> dict:
+    job = {"q": entry["q"], "d": entry.get("d", None), "ref": entry["ref"]}
+    job["keywords"] = _keywords(f"keywords of {job['ref']}", entry.get("keywords"))
+    job["resume"] = None
+    if entry.get("continuation") is not None:
+        job["resume"] = _decode_continuation(entry["continuation"], job)
+    return job
+
+
+def _encode_continuation(state: dict) -> str:
+    """Opaque token from which a job can pick up where it stopped"""
+    return base64.urlsafe_b64encode(json_dumps(state).encode()).decode()
+
+
+def _decode_continuation(token, job: dict) -> dict:
+    """Read a continuation token back, checking it was issued for this job
+
+    Raises:
+        ValueError: token malformed, or for another ref or query
+    """
+    try:
+        state = json_loads(base64.urlsafe_b64decode(token.encode()))
+        valid = isinstance(state["page"], int) and isinstance(state["offset"], int)
+    except Exception:
+        valid = False
+    if not valid:
+        raise ValueError("continuation is not a valid continuation token")
+    if (state.get("ref"), state.get("q")) != (job["ref"], job["q"]):
+        raise ValueError(f"continuation was issued for another job than {job['ref']}")
+    return state
+
+
+def _time_budget(context) -> Callable[[], float]:
+    """Seconds the invocation has left to work before it should stop
+
+    Jobs stop taking new results, and do not wait on the rate limiter or a
+    retry, past TIME_BUDGET_MARGIN_MS (default 2000) before the timeout. A
+    context without get_remaining_time_in_millis, like the {} used in
+    tests, never runs out.
+    """
+    remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if remaining is None:
+        return lambda: math.inf
+    margin = _env_int("TIME_BUDGET_MARGIN_MS", TIME_BUDGET_MARGIN_MS)
+    return lambda: (remaining() - margin) / 1000
+
+
+def _parse_options(event: dict) -> dict:
+    """Read optional fetch settings shared by every job in the event
+
+    Raises:
+        ValueError: invalid option value
+
+    Returns:
+        dict: page_size, max_pages, incremental, dedup, preview, relevance,
+            envelope, response and shard settings
+    """
+    options = {
+        "page_size": _positive_int("page_size", event.get("page_size"), MAX_PAGE_SIZE),
+        "max_pages": _positive_int("max_pages", event.get("max_pages")),
+        "incremental": bool(event.get("incremental")),
+        "dedup": bool(event.get("dedup")),
+        "preview": _preview_field(event.get("preview")),
+        "preview_chars": _positive_int(
+            "preview_chars", event.get("preview_chars"), MAX_PREVIEW_CHARS
+        )
+        or DEFAULT_PREVIEW_CHARS,
+        "relevance": _relevance_threshold(event.get("relevance")),
+        "keywords": _keywords("keywords", event.get("keywords")),
+        "envelope": bool(event.get("envelope")),
+        "compress": bool(event.get("compress")),
+        "envelope_max_bytes": _positive_int(
+            "envelope_max_bytes", event.get("envelope_max_bytes"), SQS_MAX_MESSAGE_BYTES
+        )
+        or SQS_MAX_MESSAGE_BYTES,
+        "correlation_id": _correlation_id(event),
+        "response": _response_mode(event.get("response")),
+        "sample_size": _positive_int("sample_size", event.get("sample_size"))
+        or DEFAULT_SAMPLE_SIZE,
+        "shard": _shard_mode(event.get("shard")),
+        "shards": _positive_int("shards", event.get("shards"), MAX_SHARDS)
+        or DEFAULT_SHARDS,
+    }
+    if options["shard"] and options["envelope"]:
+        # An envelope's articles could belong to several shards
+        raise ValueError("shard cannot be combined with envelope")
+    if not event.get("paginate"):
+        options["max_pages"] = 1
+    return options
+
+
+def _correlation_id(event) -> str | None:
+    """Caller's id for tracking an asynchronous invocation, if it sent one
+
+    Raises:
+        ValueError: not 1-128 letters, digits, "-" or "_"
+    """
+    value = event.get("correlation_id") if isinstance(event, dict) else None
+    if value is None:
+        return None
+    if not isinstance(value, str) or not CORRELATION_ID_PATTERN.fullmatch(value):
+        raise ValueError("correlation_id must be 1-128 letters, digits, '-' or '_'")
+    return value
+
+
+def _record_invocation(
+    correlation_id: str, output: dict, status: str = "complete"
+) -> None:
+    """Store the outcome of an invocation under invocation#<correlation_id>
+
+    Lets a caller that invoked asynchronously poll the state store for
+    completion. status is "failed" for an invocation that raised. Failing
+    to record is logged, never raised.
+    """
+    record = {
+        "status": status,
+        "statusCode": output["statusCode"],
+        "messagesSent": output.get("messagesSent", 0),
+        "messagesFailed": output.get("messagesFailed", 0),
+        "finishedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    if output["statusCode"] != 200:
+        record["error"] = output.get("message", output.get("error"))
+    try:
+        _get_state_store().put(
+            f"{INVOCATION_KEY_PREFIX}{correlation_id}",
+            json_dumps(record),
+            ttl=INVOCATION_RECORD_TTL,
+        )
+    except Exception as e:
+        logger.error(
+            "Failed to record invocation %s: %s", correlation_id, f"{e.__class__}: {e}"
+        )
+
+
+def _response_mode(value) -> str:
+    """How much of what was sent to echo back in the response
+
+    "full" (default) returns every message, "ids" only their webUrls,
+    "sample" the first sample_size messages and "summary" counts alone.
+    """
+    if value is None:
+        return RESPONSE_MODES[0]
+    if value not in RESPONSE_MODES:
+        raise ValueError(f"response must be one of {RESPONSE_MODES}")
+    return value
+
+
+def _relevance_threshold(value) -> float | None:
+    """Lowest relevance score an article needs to be published
+
+    true for DEFAULT_RELEVANCE_THRESHOLD, or a number between 0 and 1.
+    """
+    if value is None or value is False:
+        return None
+    if value is True:
+        return DEFAULT_RELEVANCE_THRESHOLD
+    if isinstance(value, (int, float)) and 0 < value <= 1:
+        return float(value)
+    raise ValueError("relevance must be true or a number between 0 and 1")
+
+
+def _keywords(name: str, value) -> tuple[str, ...]:
+    """Extra terms for a relevance profile, as a list of strings"""
+    if value is None:
+        return ()
+    if not isinstance(value, list) or not all(isinstance(k, str) for k in value):
+        raise ValueError(f"{name} must be a list of strings")
+    return tuple(value)
+
+
+def _shard_mode(value) -> str | None:
+    """How to split a reference's messages over several FIFO message groups
+
+    None (default) sends them all in one group named after the reference.
+    "hash" spreads them over reference#0 to reference#<shards - 1> by a hash
+    of their webUrl, and "day" groups them as reference#<publication date>.
+    """
+    if not value:
+        return None
+    if value not in SHARD_MODES:
+        raise ValueError(f"shard must be one of {SHARD_MODES}")
+    return value
+
+
+def _preview_field(value) -> str | None:
+    """Field to preview: true for bodyText, or a name from PREVIEW_FIELDS"""
+    if not value:
+        return None
+    if value is True:
+        return PREVIEW_FIELDS[0]
+    if value not in PREVIEW_FIELDS:
+        raise ValueError(f"preview must be true or one of {PREVIEW_FIELDS}")
+    return value
+
+
+def _run_job(
+    job: dict, api_key: str, sqs_queue_url: str, options: dict, summary: dict = None
+) -> dict:
+    """Fetch, parse and publish the results of one query under its reference
+
+    Results stream through fetch, parse and publish one batch at a time,
+    with fetching on its own thread up to PIPELINE_DEPTH results ahead. A
+    job that runs short of time stops between results, publishes what it
+    has already taken and returns a continuation token for the rest. The
+    watermark only advances once the last continuation has finished.
+    Incremental jobs fetch oldest first, so that advancing the watermark to
+    the newest article fetched never skips one left on a later page.
+
+    Args:
+        summary (dict, optional): from _job_summary, filled in as batches
+            are published, so that a caller still has the counts of a job
+            that raised part way through
+
+    Returns:
+        dict: job summary with sent/failed counts and the messages sent, as
+            much of them as the response mode asks for
+    """
+    reference = job["ref"]
+    sqs_client = _get_sqs_client()
+    if summary is None:
+        summary = _job_summary(job)
+    mode = options.get("response", "full")
+    if mode == "summary":
+        del summary["messages"]
+    elif mode == "sample":
+        summary["messagesOmitted"] = 0
+    date = job["d"]
+    resume = job.get("resume") or {}
+    watermark = None
+    if options["incremental"]:
+        store = _get_state_store()
+        # A continuation keeps filtering by the watermark its job started from
+        if resume:
+            watermark = resume.get("watermark")
+        else:
+            watermark = store.get(f"watermark#{reference}")
+        if watermark:
+            # from-date is inclusive and day-granular, newer articles filtered below
+            date = max(date or "", watermark[:10])
+            logger.info("Fetching articles for %s newer than %s", reference, watermark)
+    newest = resume.get("newest", watermark)
+    page_size = resume.get("page_size", options["page_size"])
+    start_page = resume.get("page", 1)
+    time_left = options.get("time_left", lambda: math.inf)
+    stopped_at = None
+    published = options.get("published")
+    if published is not None:
+        summary["messagesSkipped"] = 0
+    threshold = options.get("relevance")
+    if threshold:
+        # IDF comes from this job's articles only, so it does not depend on
+        # what a warm container happened to score before
+        profile = _RelevanceProfile(
+            job["q"], job.get("keywords") or options["keywords"]
+        )
+        summary["messagesDiscarded"] = 0
+    # Collect response from Guardian API as it streams in, one batch at a time
+    pages = _fetch_pages(
+        job["q"],
+        api_key,
+        date,
+        page_size,
+        options["max_pages"],
+        options["preview"],
+        start_page,
+        time_left,
+        "oldest" if options["incremental"] else None,
+    )
+
+    def results_in_time():
+        nonlocal stopped_at
+        skip = resume.get("offset", 0)
+        for number, page in enumerate(pages, start=start_page):
+            # Checked before the page is requested as well as between results
+            if time_left() < 0:
+                stopped_at = {"page": number, "offset": skip}
+                return
+            taken = skip
+            try:
+                # Results the previous invocation already took from its last page
+                for offset, result in enumerate(page):
+                    if offset < skip:
+                        continue
+                    if time_left() < 0:
+                        stopped_at = {"page": number, "offset": offset}
+                        page.close()
+                        return
+                    yield result
+                    taken = offset + 1
+            except _OutOfTime as e:
+                logger.info("Stopping rather than waiting: %s", str(e))
+                stopped_at = {"page": number, "offset": taken}
+                return
+            skip = 0
+
+    # Fetching runs ahead of publishing by up to PIPELINE_DEPTH results, so
+    # the next page downloads while the current one is being published
+    results = _prefetched(
+        _metrics.timed(results_in_time(), "fetch"),
+        _env_int("PIPELINE_DEPTH", PIPELINE_DEPTH),
+    )
+    if watermark:
+        results = (r for r in results if r["webPublicationDate"] > watermark)
+
+    def parsed_messages():
+        for data in _chunked(results, SQS_BATCH_SIZE):
+            # Process results into required format
+            with _metrics.timer("parse"):
+                messages = _parse_results(
+                    data, reference, options["preview"], options["preview_chars"]
+                )
+            if published is not None:
+                # Keyed by reference too, as each reference gets its own copy
+                unseen = [
+                    m for m in messages if f"{reference}|{m['webUrl']}" not in published
+                ]
+                summary["messagesSkipped"] += len(messages) - len(unseen)
+                messages = unseen
+            if threshold and messages:
+                with _metrics.timer("filter"):
+                    scores = profile.score(messages)
+                relevant = [m for m, x in zip(messages, scores) if x >= threshold]
+                summary["messagesDiscarded"] += len(messages) - len(relevant)
+                messages = relevant
+            yield from messages
+
+    # Each outgoing SQS message with the articles it carries
+    if options["envelope"]:
+        outgoing = _pack_envelopes(
+            parsed_messages(), options["envelope_max_bytes"], options["compress"]
+        )
+        summary["envelopesSent"] = 0
+    else:
+        outgoing = ((m, [m]) for m in parsed_messages())
+    for batch in _chunked(outgoing, SQS_BATCH_SIZE):
+        carried = {id(message): articles for message, articles in batch}
+        delivered = []
+        # Send messages to SQS queue
+        with _metrics.timer("publish"):
+            _send_batch_to_SQS(
+                [message for message, _ in batch],
+                reference,
+                sqs_client,
+                sqs_queue_url,
+                on_sent=lambda message, _: delivered.append(carried[id(message)]),
+                shard_by=options.get("shard"),
+                shards=options.get("shards", DEFAULT_SHARDS),
+            )
+        articles = [a for _, batch_articles in batch for a in batch_articles]
+        sent = sum(len(a) for a in delivered)
+        summary["messagesSent"] += sent
+        summary["messagesFailed"] += len(articles) - sent
+        if options["envelope"]:
+            summary["envelopesSent"] += len(delivered)
+        if published is not None:
+            for message in (a for batch_articles in delivered for a in batch_articles):
+                published.add(f"{reference}|{message['webUrl']}")
+        _keep_messages(summary, articles, mode, options.get("sample_size"))
+        for message in articles:
+            newest = max(newest or "", message["webPublicationDate"])
+    failed = resume.get("failed", 0) + summary["messagesFailed"]
+    if stopped_at:
+        logger.info("Out of time, stopping %s at page %s", reference, stopped_at)
+        state = {"ref": reference, "q": job["q"], **stopped_at, "failed": failed}
+        state["page_size"] = page_size
+        if options["incremental"]:
+            state.update(watermark=watermark, newest=newest)
+        summary["continuation"] = _encode_continuation(state)
+    elif options["incremental"]:
+        # Only advance past articles once every one of them has been published
+        if newest != watermark and not failed:
+            store.put(f"watermark#{reference}", newest)
+            watermark = newest
+    if options["incremental"]:
+        summary["watermark"] = watermark
+    return summary
+
+
+def _keep_messages(summary: dict, articles: list[dict], mode: str, sample_size: int):
+    """Add a batch of articles to the job summary as the response mode asks
+
+    Only what is returned is kept, so large jobs in summary, ids or sample
+    mode do not hold every article until the invocation ends.
+    """
+    if mode == "full":
+        summary["messages"].extend(articles)
+    elif mode == "ids":
+        summary["messages"].extend(article["webUrl"] for article in articles)
+    elif mode == "sample":
+        room = max(sample_size - len(summary["messages"]), 0)
+        summary["messages"].extend(articles[:room])
+        summary["messagesOmitted"] += max(len(articles) - room, 0)
+
+
+def _job_summary(job: dict, **fields) -> dict:
+    summary = {
+        "ref": job["ref"],
+        "q": job["q"],
+        "statusCode": 200,
+        "messagesSent": 0,
+        "messagesFailed": 0,
+        "messages": [],
+    }
+    summary.update(fields)
+    return summary
+
+
+def _run_jobs(
+    jobs: list[dict], api_key: str, sqs_queue_url: str, options: dict
+) -> list[dict]:
+    """Run jobs concurrently on a bounded thread pool
+
+    A job that raises is reported with statusCode 502 instead of failing
+    the whole invocation, along with what it published before it raised.
+
+    Returns:
+        list[dict]: job summaries, in the same order as jobs
+    """
+
+    def run(job):
+        summary = _job_summary(job)
+        try:
+            return _run_job(job, api_key, sqs_queue_url, options, summary)
+        except Exception as e:
+            logger.error("Job %s failed: %s", job["ref"], f"{e.__class__}: {e}")
+            summary.update(statusCode=502, error=str(e))
+            return summary
+
+    # Create both shared clients up front rather than racing inside the pool
+    _get_http_session()
+    _get_sqs_client()
+    with ThreadPoolExecutor(max_workers=min(MAX_JOB_WORKERS, len(jobs))) as pool:
+        return list(pool.map(run, jobs))
+
+
 def _env_variables():
     required_vars = ["api_key", "sqs_queue_url"]
     env_vars = {}
@@ -74,37 +939,996 @@ def _env_variables():
     return env_vars["api_key"], env_vars["sqs_queue_url"]
 
 
-def _build_url(query: str, api_key: str, date: str = None) -> str:
+def _get_config() -> tuple[str, str]:
+    """Validated environment config, read once per container
+
+    Raises:
+        KeyError: required environment variable missing
+        ValueError: sqs_queue_url is not a FIFO queue
+
+    Returns:
+        tuple[str, str]: (api_key, sqs_queue_url)
+    """
+    global _config
+    if _config is None:
+        api_key, sqs_queue_url = _env_variables()
+        if not sqs_queue_url.endswith(".fifo"):
+            raise ValueError(f"sqs_queue_url is not a FIFO queue: {sqs_queue_url}")
+        _config = (api_key, sqs_queue_url)
+    return _config
+
+
+def _get_http_session() -> requests.Session:
+    """Keep-alive HTTP session with a connection pool, shared across invocations"""
+    global _http_session
+    if _http_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["Accept-Encoding"] = "gzip"
+        _http_session = session
+    return _http_session
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}")
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number, got {value!r}")
+
+
+def _get_response_cache():
+    """Response cache configured from CACHE_TTL, CACHE_MAX_ENTRIES and CACHE_DIR
+
+    Returns:
+        _ResponseCache | None: None when CACHE_TTL is unset or 0
+    """
+    global _response_cache
+    if _response_cache is None:
+        ttl = _env_int("CACHE_TTL", 0)
+        if ttl <= 0:
+            return None
+        _response_cache = _ResponseCache(
+            ttl,
+            _env_int("CACHE_MAX_ENTRIES", 128),
+            os.environ.get("CACHE_DIR") or None,
+        )
+    return _response_cache
+
+
+def _get_state_store():
+    """State store configured from STATE_BACKEND ("file" or "dynamodb")
+
+    "file" keeps state in STATE_FILE (default /tmp/guardian_state.json),
+    "dynamodb" in the table named by STATE_TABLE.
+
+    Raises:
+        KeyError: STATE_TABLE missing for the dynamodb backend
+        ValueError: unknown STATE_BACKEND
+
+    Returns:
+        FileStateStore | DynamoDBStateStore
+    """
+    global _state_store
+    if _state_store is None:
+        backend = os.environ.get("STATE_BACKEND") or "file"
+        if backend == "file":
+            path = os.environ.get("STATE_FILE") or "/tmp/guardian_state.json"
+            _state_store = FileStateStore(path)
+        elif backend == "dynamodb":
+            table_name = os.environ.get("STATE_TABLE")
+            if not table_name:
+                raise KeyError("Missing environment variable: STATE_TABLE")
+            _state_store = DynamoDBStateStore(table_name)
+        else:
+            raise ValueError(f"STATE_BACKEND must be file or dynamodb, got {backend!r}")
+    return _state_store
+
+
+def _get_rate_limiter():
+    """Guardian API rate limiter from GUARDIAN_RATE_PER_SECOND (default 1)
+    and GUARDIAN_RATE_PER_DAY (default 500), the developer key limits
+
+    With the dynamodb state backend the daily budget is counted in the
+    table, shared by every container. A state file in /tmp lasts no longer
+    than its container, so with the file backend it is counted in memory.
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        shared = os.environ.get("STATE_BACKEND") == "dynamodb"
+        _rate_limiter = _RateLimiter(
+            _env_float("GUARDIAN_RATE_PER_SECOND", 1),
+            _env_int("GUARDIAN_RATE_PER_DAY", 500),
+            _get_state_store() if shared else None,
+        )
+    return _rate_limiter
+
+
+def _reset_resources() -> None:
+    """Drop cached session, client and config so they are rebuilt on next use"""
+    global _http_session, _sqs_client, _config, _response_cache, _state_store
+    global _rate_limiter
+    if _http_session is not None:
+        _http_session.close()
+    _http_session = _sqs_client = _config = _response_cache = _state_store = None
+    _rate_limiter = None
+    _profile_weights.clear()
+
+
+def _positive_int(name: str, value, maximum: int = None) -> int | None:
+    """Validate an optional positive integer event value
+
+    Raises:
+        ValueError: value is not an integer between 1 and maximum
+
+    Returns:
+        int | None: value as int, or None if not given
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool) or not str(value).isdigit():
+        raise ValueError(f"{name} must be an integer, got {value!r}")
+    if int(value) < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    if maximum and int(value) > maximum:
+        raise ValueError(f"{name} must be between 1 and {maximum}")
+    return int(value)
+
+
+def _build_url(
+    query: str,
+    api_key: str,
+    date: str = None,
+    page: int = None,
+    page_size: int = None,
+    show_fields: str = None,
+    order_by: str = None,
+) -> str:
     url = f"{BASE_URL}q={query}"
     if date:
         url += f"&from-date={date}"
+    if order_by:
+        url += f"&order-by={order_by}"
+    if page:
+        url += f"&page={page}"
+    if page_size:
+        url += f"&page-size={page_size}"
+    if show_fields:
+        url += f"&show-fields={show_fields}"
     return url + f"&api-key={api_key}"
 
 
-def _fetch_data(url: str) -> list:
+def _fetch_pages(
+    query: str,
+    api_key: str,
+    date: str = None,
+    page_size: int = None,
+    max_pages: int = None,
+    show_fields: str = None,
+    start_page: int = 1,
+    time_left: Callable[[], float] = None,
+    order_by: str = None,
+) -> Iterator[Iterator[dict]]:
+    """Fetch search results one page at a time, following page/pages
+
+    Each page's results are decoded as they stream in, and must be consumed
+    before the next page is requested.
+
+    Args:
+        query (str)
+        api_key (str)
+        date (str, optional): from-date YYYY-MM-DD
+        page_size (int, optional): results per page, up to MAX_PAGE_SIZE
+        max_pages (int, optional): stop after this many pages
+        show_fields (str, optional): extra fields to return with each result
+        start_page (int, optional): first page to fetch, counted towards max_pages
+        time_left (Callable, optional): seconds left to wait in, see _time_budget
+        order_by (str, optional): "newest", "oldest" or "relevance", the
+            API's default when there is a query
+
+    Yields:
+        Iterator[dict]: results of one page
+    """
+    page = start_page
+    while True:
+        url = _build_url(
+            query,
+            api_key,
+            date,
+            page if page > 1 else None,
+            page_size,
+            show_fields,
+            order_by,
+        )
+        logger.info("URL built, attempting API call for page %s", page)
+        meta = {}
+        yield _fetch_results(url, meta, time_left)
+        if page >= meta.get("pages", 1) or (max_pages and page >= max_pages):
+            return
+        page += 1
+
+
+def _chunked(items: Iterable, size: int) -> Iterator[list]:
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def _prefetched(items: Iterable, depth: int) -> Iterator:
+    """Yield from items while a background thread reads up to depth ahead
+
+    The thread blocks once depth items are waiting, so memory stays bounded
+    however many items there are. An exception raised by items is raised
+    here in its place, and closing this generator stops the thread at its
+    next item. A depth of 0 or less reads items in the caller's thread.
+    """
+    if depth <= 0:
+        yield from items
+        return
+    buffer = queue.Queue(maxsize=depth)
+    stopping = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        while not stopping.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except BaseException as e:
+            put((end, e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+
+    threading.Thread(target=produce, name="prefetch", daemon=True).start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is end:
+                if error:
+                    raise error
+                return
+            yield item
+    finally:
+        stopping.set()
+
+
+def _fetch_results(
+    url: str, meta: dict, time_left: Callable[[], float] = None
+) -> Iterator[dict]:
+    """Yield one page of search results as they are decoded from the response
+
+    Scalar fields of the "response" object (pages, total...) are written to
+    meta. With the response cache enabled the page is collected and cached.
+
+    Raises:
+        _OutOfTime: the request would have to wait past time_left
+    """
+    cache = _get_response_cache()
+    if cache:
+        key = _cache_key(url)
+        body = cache.get(key)
+        if body is not None:
+            logger.info("%s result(s) collected from cache", str(len(body["results"])))
+            meta.update({k: v for k, v in body.items() if k != "results"})
+            yield from body["results"]
+            return
+    import requests
+
+    count = 0
+    results = [] if cache else None
     try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        data = response.json()["response"]["results"]
-        logger.info("%s result(s) collected", str(len(data)))
-        return data
+        response = _get_with_backoff(url, time_left)
+        with response:
+            response.raise_for_status()
+            chunks = _counted(response.iter_content(chunk_size=HTTP_CHUNK_SIZE))
+            for result in iter_json_array(chunks, ("response", "results"), meta):
+                count += 1
+                if cache:
+                    results.append(result)
+                yield result
+        logger.info("%s result(s) collected", str(count))
+        if cache:
+            cache.put(key, {**meta, "results": results})
     except requests.exceptions.HTTPError as e:
         logger.error("HTTP Error while fetching data: %s", str(e))
         raise
     except requests.exceptions.Timeout as e:
         logger.error("Timeout occurred while fetching data: %s", str(e))
         raise
+    except _OutOfTime:
+        raise
     except Exception as e:
         logger.error("Error while fetching data: %s", f"{e.__class__}: {e}")
         raise
 
 
-def _parse_results(results: list[dict], reference: str) -> list[dict]:
+def _counted(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Pass chunks through, adding their size to the bytesFetched metric"""
+    total = 0
+    try:
+        for chunk in chunks:
+            total += len(chunk)
+            yield chunk
+    finally:
+        _metrics.count("bytesFetched", total)
+
+
+def iter_json_array(
+    chunks: Iterable[bytes | str], path: tuple[str, ...], meta: dict = None
+) -> Iterator:
+    """Decode the array at path in a streamed JSON document, item by item
+
+    Only the current item and the unread part of one chunk are held in
+    memory. Members of the array's parent object that come before or after
+    it are written to meta. Items must be objects, arrays or strings.
+
+    If the array is missing, or the value at path is not an array, the
+    document has been read whole by the time KeyError is raised, and the
+    members of the deepest object found on path are written to meta, so a
+    caller can fall back to them.
+
+    Args:
+        chunks (Iterable[bytes | str]): the document in pieces, e.g. iter_content()
+        path (tuple[str, ...]): keys leading to the array, e.g. ("response", "results")
+        meta (dict, optional): receives the parent object's other members, or
+            all of them if the array is missing
+
+    Raises:
+        KeyError: the first key of path that is missing from the document,
+            or the last one if its value is not an array
+        json.JSONDecodeError: malformed document
+
+    Yields:
+        items of the array
+    """
+    chunks = iter(chunks)
+    decode = codecs.getincrementaldecoder("utf-8")().decode
+    decoder = json.JSONDecoder()
+    meta = {} if meta is None else meta
+
+    def read() -> bool:
+        """Add the next chunk that decodes to any text, False once none is left
+
+        A chunk holding only part of a multibyte character decodes to "".
+        """
+        nonlocal buf
+        for chunk in chunks:
+            text = decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                buf += text
+                return True
+        return False
+
+    # Scan for the opening bracket of the array, tracking the key path
+    buf, i, matched = "", 0, 0
+    in_string = escaped = False
+    string_start = key_start = 0
+    openers, keys = [], []
+    while True:
+        if i == len(buf) and not read():
+            # Every key matched when the value at path is not an array
+            found = min(matched, len(path) - 1)
+            _update_from_document(meta, buf, path[:found])
+            raise KeyError(path[found])
+        c = buf[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string, string_start = True, i
+        elif c == ":" and openers and openers[-1] == "{":
+            key_start = string_start
+            keys[-1] = json.loads(buf[string_start : buf.rindex('"', 0, i) + 1])
+            if openers == ["{"] * len(openers) and keys == list(path[: len(keys)]):
+                matched = max(matched, len(keys))
+        elif c == "[" and keys == list(path) and openers == ["{"] * len(path):
+            break
+        elif c in "{[":
+            openers.append(c)
+            keys.append(None)
+        elif c in "}]":
+            openers.pop()
+            keys.pop()
+        i += 1
+
+    # Everything before the array's key is complete JSON once closed again
+    head = buf[:key_start].rstrip().rstrip(",")
+    parent = json.loads(head + "}" * len(path))
+    for key in path[:-1]:
+        parent = parent[key]
+    meta.update(parent)
+
+    buf, i = buf[i + 1 :], 0
+    while True:
+        while i < len(buf) and buf[i] in " \t\r\n,":
+            i += 1
+        if i == len(buf):
+            if not read():
+                raise json.JSONDecodeError("Unterminated array", buf, i)
+            continue
+        if buf[i] == "]":
+            break
+        try:
+            item, end = decoder.raw_decode(buf, i)
+        except json.JSONDecodeError:
+            if not read():
+                raise
+            continue
+        yield item
+        buf, i = buf[end:], 0
+
+    # Members after the array, e.g. ',"pages": 3}}'
+    buf = buf[i + 1 :]
+    while read():
+        pass
+    tail = buf.lstrip().lstrip(",").lstrip()
+    if tail.startswith('"'):
+        try:
+            meta.update(decoder.raw_decode("{" + tail)[0])
+        except json.JSONDecodeError:
+            pass
+
+
+def _update_from_document(meta: dict, document: str, path: tuple[str, ...]) -> None:
+    """Write the members of the object at path in a JSON document to meta"""
+    try:
+        parent = json.loads(document)
+        for key in path:
+            parent = parent[key]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return
+    if isinstance(parent, dict):
+        meta.update(parent)
+
+
+def _get_with_backoff(
+    url: str, time_left: Callable[[], float] = None
+) -> requests.Response:
+    """GET through the rate limiter, retrying 429 and 5xx responses
+
+    Waits for Retry-After when the API sends it, otherwise for an exponential
+    backoff with full jitter. Gives up, returning the last response, after
+    API_MAX_RETRIES retries or when asked to wait longer than API_MAX_BACKOFF.
+
+    Raises:
+        _OutOfTime: the rate limit or a retry would wait past time_left
+    """
+    limiter = _get_rate_limiter()
+    for attempt in range(API_MAX_RETRIES + 1):
+        limiter.acquire(time_left)
+        _metrics.count("apiRequests")
+        response = _get_http_session().get(url, timeout=5, stream=True)
+        if response.status_code not in RETRY_STATUSES:
+            limiter.recover()
+            return response
+        if response.status_code == 429:
+            limiter.slow_down()
+        delay = _retry_after(response.headers.get("Retry-After"))
+        if delay is None:
+            delay = random.uniform(0, API_BACKOFF_BASE * 2**attempt)
+        if attempt == API_MAX_RETRIES or delay > API_MAX_BACKOFF:
+            break
+        logger.warning(
+            "API returned %s, retrying in %.2fs", response.status_code, delay
+        )
+        response.close()
+        limiter.backoff(delay, time_left)
+    return response
+
+
+def _retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)"""
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _OutOfTime(Exception):
+    """Waiting for the Guardian API would run past the invocation's time budget"""
+
+
+class _RateLimiter:
+    """Token bucket for the Guardian API with a per-second rate and daily budget
+
+    The rate halves on each 429 and creeps back to the configured rate on
+    success. The daily budget resets at 00:00 UTC. It is counted in store
+    under api_calls#<date> when given, so that every container shares it,
+    and otherwise per container.
+    """
+
+    def __init__(self, per_second: float, per_day: int, store=None):
+        self.max_rate = float(per_second)
+        self.rate = self.max_rate
+        self.per_day = per_day
+        self.store = store
+        self.tokens = max(1.0, self.rate)
+        self.updated = time.monotonic()
+        self.day = time.strftime("%Y-%m-%d", time.gmtime())
+        self.used_today = 0
+        self.throttled_seconds = 0.0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, time_left: Callable[[], float] = None) -> None:
+        """Take one token, sleeping until it is due
+
+        The token is reserved under the lock and waited for outside it, so
+        threads queue for their turn rather than for the lock.
+
+        Raises:
+            _OutOfTime: the token is due later than time_left() seconds
+            RuntimeError: daily budget used up
+        """
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if wait and time_left is not None and wait > time_left():
+                raise _OutOfTime(f"next API call due in {wait:.2f}s")
+            self.tokens -= 1
+            self.throttled_seconds += wait
+        self._count_call()
+        if wait:
+            time.sleep(wait)
+
+    def _count_call(self) -> None:
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        if self.store is not None:
+            used = self.store.increment(
+                f"{API_CALLS_KEY_PREFIX}{today}", ttl=API_CALLS_TTL
+            )
+        else:
+            with self._lock:
+                if today != self.day:
+                    self.day, self.used_today = today, 0
+                self.used_today += 1
+                used = self.used_today
+        if used > self.per_day:
+            raise RuntimeError(
+                f"Daily Guardian API budget of {self.per_day} calls used"
+            )
+
+    def backoff(self, seconds: float, time_left: Callable[[], float] = None) -> None:
+        """Sleep before a retry
+
+        Raises:
+            _OutOfTime: seconds is longer than time_left()
+        """
+        if time_left is not None and seconds > time_left():
+            raise _OutOfTime(f"retry due in {seconds:.2f}s")
+        time.sleep(seconds)
+        with self._lock:
+            self.throttled_seconds += seconds
+            self.retries += 1
+
+    def slow_down(self) -> None:
+        with self._lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def recover(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 8)
+
+    def reset_stats(self) -> None:
+        self.throttled_seconds = 0.0
+        self.retries = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+
+def _cache_key(url: str) -> str:
+    """Normalise a search URL for caching: api-key removed, parameters sorted"""
+    parts = urlsplit(url)
+    params = sorted(
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k != "api-key"
+    )
+    return f"{parts.scheme}://{parts.netloc}{parts.path}?{urlencode(params)}"
+
+
+class _ResponseCache:
+    """TTL cache of search API pages, bounded by LRU eviction
+
+    When a directory is given, entries are also written there as JSON files
+    so they outlive the in-memory cache (e.g. Lambda's /tmp).
+    """
+
+    def __init__(self, ttl: int, max_entries: int, directory: str = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.directory:
+                entry = self._read_disk(key)
+                if entry is not None:
+                    self._entries[key] = entry
+            if entry is None or entry[0] <= time.time():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, body: dict) -> None:
+        entry = (time.time() + self.ttl, body)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.directory:
+                self._write_disk(key, entry)
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = 0
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def _read_disk(self, key: str) -> tuple | None:
+        try:
+            with open(self._path(key)) as f:
+                stored = json.load(f)
+            return stored["expires"], stored["body"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key: str, entry: tuple) -> None:
+        path = self._path(key)
+        try:
+            with open(f"{path}.tmp", "w") as f:
+                json.dump({"expires": entry[0], "body": entry[1]}, f)
+            os.replace(f"{path}.tmp", path)
+            files = [
+                os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith(".json")
+            ]
+            files.sort(key=os.path.getmtime)
+            for old in files[: max(0, len(files) - self.max_entries)]:
+                os.remove(old)
+        except OSError as e:
+            logger.error("Failed to write cache file: %s", str(e))
+
+
+class FileStateStore:
+    """String key/value state kept in a local JSON file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            return self._load().get(key)
+
+    def put(self, key: str, value: str, ttl: int | None = None) -> None:
+        """Store value under key, ttl is ignored as /tmp does not outlive the container"""
+        with self._lock:
+            state = self._load()
+            state[key] = value
+            with open(f"{self.path}.tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(f"{self.path}.tmp", self.path)
+
+    def increment(self, key: str, amount: int = 1, ttl: int | None = None) -> int:
+        """Add amount to the count under key and return the new count"""
+        with self._lock:
+            state = self._load()
+            count = int(state.get(key) or 0) + amount
+            state[key] = str(count)
+            with open(f"{self.path}.tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(f"{self.path}.tmp", self.path)
+            return count
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+
+class DynamoDBStateStore:
+    """String key/value state kept in a DynamoDB table with a "key" hash key"""
+
+    def __init__(self, table_name: str, client=None):
+        self.table_name = table_name
+        if client is None:
+            import boto3
+
+            client = boto3.client("dynamodb")
+        self.client = client
+
+    def get(self, key: str) -> str | None:
+        response = self.client.get_item(
+            TableName=self.table_name, Key={"key": {"S": key}}, ConsistentRead=True
+        )
+        item = response.get("Item")
+        return item["value"]["S"] if item else None
+
+    def put(self, key: str, value: str, ttl: int | None = None) -> None:
+        """Store value under key, expiring through the table's "expires" TTL"""
+        item = {"key": {"S": key}, "value": {"S": value}}
+        if ttl:
+            item["expires"] = {"N": str(int(time.time()) + ttl)}
+        self.client.put_item(TableName=self.table_name, Item=item)
+
+    def increment(self, key: str, amount: int = 1, ttl: int | None = None) -> int:
+        """Atomically add amount to the "count" under key and return the new count"""
+        update = "ADD #count :amount"
+        values = {":amount": {"N": str(amount)}}
+        if ttl:
+            update += " SET expires = :expires"
+            values[":expires"] = {"N": str(int(time.time()) + ttl)}
+        response = self.client.update_item(
+            TableName=self.table_name,
+            Key={"key": {"S": key}},
+            UpdateExpression=update,
+            ExpressionAttributeNames={"#count": "count"},
+            ExpressionAttributeValues=values,
+            ReturnValues="UPDATED_NEW",
+        )
+        return int(response["Attributes"]["count"]["N"])
+
+
+def _url_hash(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+class _PublishedIndex:
+    """Hashes of published reference|webUrl keys, kept exactly or in a Bloom filter
+
+    "set" mode keeps the 64-bit prefix of each URL hash, oldest dropped past
+    capacity. "bloom" mode has a fixed size for the given capacity and
+    error rate, and may report an unseen URL as published at that rate.
+    """
+
+    def __init__(self, mode="set", capacity=100_000, error_rate=0.01):
+        self.mode = mode
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        if mode == "bloom":
+            self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+            self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+            self.bits = bytearray((self.size + 7) // 8)
+        elif mode == "set":
+            self.hashes = {}
+        else:
+            raise ValueError(f"DEDUP_MODE must be set or bloom, got {mode!r}")
+
+    def __contains__(self, url: str) -> bool:
+        digest = _url_hash(url)
+        if self.mode == "set":
+            return digest[:16] in self.hashes
+        return all(self.bits[p // 8] & (1 << p % 8) for p in self._positions(digest))
+
+    def add(self, url: str) -> None:
+        digest = _url_hash(url)
+        with self._lock:
+            if self.mode == "set":
+                self.hashes[digest[:16]] = None
+                while len(self.hashes) > self.capacity:
+                    del self.hashes[next(iter(self.hashes))]
+            else:
+                for p in self._positions(digest):
+                    self.bits[p // 8] |= 1 << p % 8
+
+    def update(self, other: _PublishedIndex) -> None:
+        """Merge in URLs recorded by another index of the same mode and size"""
+        with self._lock:
+            if self.mode == "set":
+                self.hashes = {**other.hashes, **self.hashes}
+                while len(self.hashes) > self.capacity:
+                    del self.hashes[next(iter(self.hashes))]
+            elif len(other.bits) == len(self.bits):
+                self.bits = bytearray(a | b for a, b in zip(self.bits, other.bits))
+
+    def dumps(self, **fields) -> str:
+        """JSON of the index, with any extra fields alongside"""
+        if self.mode == "set":
+            return json.dumps(
+                {
+                    "mode": "set",
+                    "capacity": self.capacity,
+                    "hashes": list(self.hashes),
+                    **fields,
+                }
+            )
+        return json.dumps(
+            {
+                "mode": "bloom",
+                "size": self.size,
+                "hash_count": self.hash_count,
+                "bits": base64.b64encode(zlib.compress(bytes(self.bits))).decode(),
+                **fields,
+            }
+        )
+
+    @classmethod
+    def loads(cls, data: str | dict) -> _PublishedIndex:
+        stored = json.loads(data) if isinstance(data, str) else data
+        if stored["mode"] == "set":
+            index = cls("set", stored["capacity"])
+            index.hashes = dict.fromkeys(stored["hashes"])
+            return index
+        index = cls("bloom", 1)
+        index.size = stored["size"]
+        index.hash_count = stored["hash_count"]
+        index.bits = bytearray(zlib.decompress(base64.b64decode(stored["bits"])))
+        return index
+
+    def _positions(self, digest: str) -> list[int]:
+        h1, h2 = int(digest[:16], 16), int(digest[16:32], 16)
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+
+class _ShardedPublishedIndex:
+    """Published index split by URL hash into shards of up to
+    PUBLISHED_INDEX_SHARD_CAPACITY URLs, each stored as its own item
+
+    Only shards that recorded a URL since loading are written back.
+    """
+
+    def __init__(self, shards: list[_PublishedIndex]):
+        self.shards = shards
+        self.changed = set()
+
+    @classmethod
+    def create(
+        cls, mode="set", capacity=100_000, error_rate=0.01
+    ) -> _ShardedPublishedIndex:
+        count = max(1, math.ceil(capacity / PUBLISHED_INDEX_SHARD_CAPACITY))
+        index = cls(
+            [
+                _PublishedIndex(mode, math.ceil(capacity / count), error_rate)
+                for _ in range(count)
+            ]
+        )
+        # Written out in full, so the shard count is found in the first one
+        index.changed.update(range(count))
+        return index
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.shards[self._shard(url)]
+
+    def add(self, url: str) -> None:
+        shard = self._shard(url)
+        self.shards[shard].add(url)
+        self.changed.add(shard)
+
+    def _shard(self, url: str) -> int:
+        return int(_url_hash(url)[-8:], 16) % len(self.shards)
+
+
+def _published_index_key(shard: int) -> str:
+    return f"{PUBLISHED_INDEX_KEY}#{shard}"
+
+
+def _load_published_index(store) -> _ShardedPublishedIndex:
+    """Published index from the state store, or an empty one from DEDUP_MODE,
+    DEDUP_CAPACITY and DEDUP_ERROR_RATE"""
+    settings = (
+        os.environ.get("DEDUP_MODE") or "set",
+        _env_int("DEDUP_CAPACITY", 100_000),
+        float(os.environ.get("DEDUP_ERROR_RATE") or 0.01),
+    )
+    first = store.get(_published_index_key(0))
+    if not first:
+        return _ShardedPublishedIndex.create(*settings)
+    first = json.loads(first)
+    count = first.get("shards", 1)
+    shards = [_PublishedIndex.loads(first)]
+    for shard in range(1, count):
+        stored = store.get(_published_index_key(shard))
+        if stored:
+            shards.append(_PublishedIndex.loads(stored))
+        else:
+            # Lost to a failed save, start it again
+            mode, capacity, error_rate = settings
+            shards.append(
+                _PublishedIndex(mode, math.ceil(capacity / count), error_rate)
+            )
+    return _ShardedPublishedIndex(shards)
+
+
+def _save_published_index(store, index: _ShardedPublishedIndex) -> None:
+    """Merge each changed shard with whatever was stored since loading, then
+    write it back
+
+    Articles are already published by the time the index is saved, so a
+    shard that fails to save is logged rather than raised. Its new URLs
+    may then be published again.
+    """
+    for shard in sorted(index.changed):
+        key = _published_index_key(shard)
+        try:
+            stored = store.get(key)
+            if stored:
+                index.shards[shard].update(_PublishedIndex.loads(stored))
+            store.put(key, index.shards[shard].dumps(shards=len(index.shards)))
+        except Exception as e:
+            logger.error(
+                "Failed to save published index shard %s: %s",
+                shard,
+                f"{e.__class__}: {e}",
+            )
+    index.changed.clear()
+
+
+def _parse_results(
+    results: list[dict],
+    reference: str,
+    preview_field: str = None,
+    preview_chars: int = DEFAULT_PREVIEW_CHARS,
+) -> list[dict]:
     """Parse results into format for SQS
 
     Args:
         results (list[dict])
         reference (str)
+        preview_field (str, optional): result field to copy into content_preview
+        preview_chars (int, optional): content_preview length limit
 
     Returns:
         list[dict]: List of formatted messages with reference included
@@ -116,39 +1940,335 @@ def _parse_results(results: list[dict], reference: str) -> list[dict]:
         for key in keys:
             parsed[key] = result[key]
         parsed["reference"] = reference
+        if preview_field:
+            text = result.get("fields", {}).get(preview_field, "")
+            parsed["content_preview"] = _truncate(text, preview_chars)
         output.append(parsed)
     return output
 
 
+def _terms(text: str) -> list[str]:
+    """Lowercase word terms of text, without stopwords and plural "s" """
+    terms = []
+    for term in TERM_PATTERN.findall(text.lower()):
+        if term in STOPWORDS:
+            continue
+        if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+
+class _RelevanceProfile:
+    """TF-IDF profile of a reference's query and keywords, for one job
+
+    Articles are scored in batches by the cosine similarity of their sparse
+    TF-IDF vector, title and preview, to the profile's. Document frequencies
+    accumulate over every batch the profile has scored, so IDF settles as
+    the job goes on. Only the query and keyword weights are cached across
+    warm invocations.
+    """
+
+    def __init__(self, query: str, keywords: Iterable[str] = ()):
+        self.weights = _get_profile_weights(query, tuple(keywords))
+        self.documents = 0
+        self.document_frequency = Counter()
+
+    def score(self, messages: list[dict]) -> list[float]:
+        """Relevance of each message between 0 and 1, or all 1 for an empty profile"""
+        if not self.weights:
+            return [1.0] * len(messages)
+        vectors = []
+        for message in messages:
+            vector = Counter(_terms(message["webTitle"]) * TITLE_WEIGHT)
+            vector.update(_terms(message.get("content_preview", "")))
+            vectors.append(vector)
+        self.documents += len(vectors)
+        for vector in vectors:
+            self.document_frequency.update(vector.keys())
+        n, frequency = self.documents, self.document_frequency
+        # Smoothed, so terms in every document still count for something
+        idf = {
+            term: math.log((1 + n) / (1 + frequency[term])) + 1
+            for vector in vectors + [self.weights]
+            for term in vector
+        }
+        profile = {term: w * idf[term] for term, w in self.weights.items()}
+        profile_norm = math.sqrt(sum(w * w for w in profile.values()))
+        scores = []
+        for vector in vectors:
+            norm = math.sqrt(sum((c * idf[t]) ** 2 for t, c in vector.items()))
+            dot = sum(
+                vector[term] * idf[term] * weight
+                for term, weight in profile.items()
+                if term in vector
+            )
+            scores.append(dot / (norm * profile_norm) if norm else 0.0)
+        return scores
+
+
+def _get_profile_weights(query: str, keywords: tuple[str, ...]) -> Counter:
+    """Cached term weights of a query and keywords, built on first use
+
+    Shared by every profile built from them, and never modified.
+    """
+    key = (query, keywords)
+    with _profiles_lock:
+        weights = _profile_weights.get(key)
+        if weights is None:
+            weights = Counter(_terms(unquote(query)))
+            for keyword in keywords:
+                weights.update(_terms(keyword))
+            _profile_weights[key] = weights
+            if len(_profile_weights) > MAX_RELEVANCE_PROFILES:
+                _profile_weights.popitem(last=False)
+        else:
+            _profile_weights.move_to_end(key)
+        return weights
+
+
+def _truncate(text: str, limit: int) -> str:
+    """Cut text to limit characters, at a word boundary where there is one"""
+    if len(text) <= limit:
+        return text
+    cut = text[: limit - 1]
+    space = cut.rfind(" ")
+    if space > limit // 2:
+        cut = cut[:space]
+    return cut.rstrip() + "…"
+
+
+def set_sqs_client(client) -> None:
+    """Publish through client, anything with SQS's send_message_batch, from now on"""
+    global _sqs_client
+    _sqs_client = client
+
+
 def _get_sqs_client():
-    return boto3.client("sqs")
+    global _sqs_client
+    if _sqs_client is None:
+        import boto3
+        from botocore.config import Config
+
+        _sqs_client = boto3.client("sqs", config=Config(**SQS_CLIENT_OPTIONS))
+    return _sqs_client
 
 
-def _send_to_SQS(
-    message: dict, reference: str, sqs_client: boto3.client, sqs_queue_url: str
-) -> bool:
-    """Sends message to SQS queue
+def _message_group(
+    message: dict, reference: str, shard_by: str | None, shards: int
+) -> tuple[str, str | None]:
+    """FIFO message group of a message, and the shard it was put in
+
+    Messages of one group are delivered in order, one at a time, so
+    sharding a reference lets consumers work on its groups in parallel while
+    keeping the order of messages with the same webUrl or publication day.
+
+    Returns:
+        tuple: (MessageGroupId, shard or None when not sharded)
+    """
+    if shard_by == "hash":
+        shard = str(int(_url_hash(message["webUrl"])[:8], 16) % shards)
+    elif shard_by == "day":
+        shard = message["webPublicationDate"][:10]
+    else:
+        return reference, None
+    return f"{reference}#{shard}", shard
+
+
+def _shard_attributes(shard: str | None) -> dict:
+    if shard is None:
+        return {}
+    return {
+        "MessageAttributes": {"shard": {"DataType": "String", "StringValue": shard}}
+    }
+
+
+def _send_batch_to_SQS(
+    messages: list[dict],
+    reference: str,
+    sqs_client: boto3.client,
+    sqs_queue_url: str,
+    on_sent=None,
+    shard_by: str = None,
+    shards: int = DEFAULT_SHARDS,
+) -> tuple[int, int]:
+    """Sends messages to SQS queue in batches of up to 10 entries and 256 KiB
+
+    Entries that fail with a receiver-side error are retried on their own,
+    up to SQS_BATCH_RETRIES attempts. Sender faults are not retried.
+    Each entry's MessageDeduplicationId is the hash of its MessageGroupId
+    and webUrl, as SQS deduplicates across the whole queue and the same
+    article may be published under several references. When sharded, its
+    MessageGroupId is reference#<shard> and the shard is sent as the
+    "shard" message attribute.
 
     Args:
-        message (Dict)
+        messages (list[dict])
         reference (Str)
         sqs_client (Boto3.client('SQS'))
         sqs_queue_url (Str)
+        on_sent (Callable[[dict, str], None], optional): called with each
+            message and its SQS MessageId once sent
+        shard_by (Str, optional): "hash" or "day", see _message_group
+        shards (Int, optional): number of hash shards
 
     Returns:
-        message_sent (Bool)
+        tuple[int, int]: (messages sent, messages failed)
     """
-    try:
-        response = sqs_client.send_message(
-            QueueUrl=sqs_queue_url,
-            MessageBody=json.dumps(message),
-            MessageGroupId=reference,
+    from botocore.exceptions import ClientError
+
+    entries = []
+    for i, message in enumerate(messages):
+        body = json_dumps(message)
+        group, shard = _message_group(message, reference, shard_by, shards)
+        entries.append(
+            {
+                "Id": str(i),
+                "MessageBody": body,
+                "MessageGroupId": group,
+                "MessageDeduplicationId": _url_hash(
+                    f"{group}|{message.get('webUrl', body)}"
+                ),
+                **_shard_attributes(shard),
+            }
         )
-        logger.info("Message sent. ID: %s", response["MessageId"])
-        return bool(response["MessageId"])
-    except ClientError as e:
-        logger.error("Failed to send message: %s", e.response["Error"]["Message"])
-        return False
-    except Exception:
-        logger.exception("Unexpected error when sending message")
-        return False
+    sent = failed = published_bytes = 0
+    for group in _size_batches(entries):
+        pending = {entry["Id"]: entry for entry in group}
+        for attempt in range(SQS_BATCH_RETRIES):
+            if attempt:
+                _metrics.count("sqsRetries")
+                time.sleep(SQS_RETRY_DELAY * 2 ** (attempt - 1))
+            try:
+                response = sqs_client.send_message_batch(
+                    QueueUrl=sqs_queue_url, Entries=list(pending.values())
+                )
+                for entry in response.get("Successful", []):
+                    if sent_entry := pending.pop(entry["Id"], None):
+                        sent += 1
+                        published_bytes += _entry_size(sent_entry)
+                        if on_sent:
+                            on_sent(messages[int(entry["Id"])], entry["MessageId"])
+                    logger.info("Message sent. ID: %s", entry["MessageId"])
+                for entry in response.get("Failed", []):
+                    logger.error(
+                        "Failed to send message: %s",
+                        entry.get("Message", entry["Code"]),
+                    )
+                    if entry.get("SenderFault") and pending.pop(entry["Id"], None):
+                        failed += 1
+            except ClientError as e:
+                logger.error(
+                    "Failed to send message batch: %s",
+                    e.response["Error"]["Message"],
+                )
+                continue
+            except Exception:
+                logger.exception("Unexpected error when sending message batch")
+                break
+            if not pending:
+                break
+        failed += len(pending)
+    _metrics.count("bytesPublished", published_bytes)
+    return sent, failed
+
+
+def _size_batches(entries: list[dict]) -> Iterator[list[dict]]:
+    """Group entries into SendMessageBatch calls within the count and size limits"""
+    batch, size = [], 0
+    for entry in entries:
+        entry_size = _entry_size(entry)
+        if batch and (
+            len(batch) == SQS_BATCH_SIZE or size + entry_size > SQS_MAX_BATCH_BYTES
+        ):
+            yield batch
+            batch, size = [], 0
+        batch.append(entry)
+        size += entry_size
+    if batch:
+        yield batch
+
+
+def _entry_size(entry: dict) -> int:
+    """Size of a batch entry as SQS counts it, body and message attributes"""
+    size = len(entry["MessageBody"].encode())
+    for name, attribute in entry.get("MessageAttributes", {}).items():
+        size += len(name) + len(attribute["DataType"])
+        size += len(attribute["StringValue"].encode())
+    return size
+
+
+def _build_envelope(articles: list[dict], compress: bool = False) -> dict:
+    """Wrap articles in a versioned envelope, optionally gzip+base64 encoded"""
+    if not compress:
+        return {
+            "envelope": ENVELOPE_VERSION,
+            "encoding": "json",
+            "count": len(articles),
+            "articles": articles,
+        }
+    raw = json_dumps(articles).encode()
+    return {
+        "envelope": ENVELOPE_VERSION,
+        "encoding": "gzip+base64",
+        "count": len(articles),
+        "articles": base64.b64encode(gzip.compress(raw, mtime=0)).decode(),
+    }
+
+
+def _pack_envelopes(
+    messages: Iterable[dict], max_bytes: int, compress: bool = False
+) -> Iterator[tuple[dict, list[dict]]]:
+    """Pack messages into as few envelopes of at most max_bytes as possible
+
+    Compressed envelopes are filled to three times max_bytes of raw JSON
+    first, then halved until they fit. A single article larger than
+    max_bytes still gets an envelope of its own.
+
+    Yields:
+        tuple[dict, list[dict]]: envelope and the articles it carries
+    """
+    budget = max_bytes * 3 if compress else max_bytes
+
+    def fit(articles):
+        envelope = _build_envelope(articles, compress)
+        if len(articles) == 1 or len(json_dumps(envelope).encode()) <= max_bytes:
+            yield envelope, articles
+            return
+        middle = len(articles) // 2
+        yield from fit(articles[:middle])
+        yield from fit(articles[middle:])
+
+    # Size of the envelope fields around the articles array
+    overhead = len(json_dumps(_build_envelope([], False)).encode()) + 8
+    articles, size = [], overhead
+    for message in messages:
+        message_size = len(json_dumps(message).encode()) + 1
+        if articles and size + message_size > budget:
+            yield from fit(articles)
+            articles, size = [], overhead
+        articles.append(message)
+        size += message_size
+    if articles:
+        yield from fit(articles)
+
+
+def unpack_envelope(body: str | dict) -> list[dict]:
+    """Articles in an SQS message body, whether enveloped or a single article
+
+    Raises:
+        ValueError: envelope version or encoding not supported
+
+    Returns:
+        list[dict]: the articles carried by the message
+    """
+    message = json_loads(body) if isinstance(body, (str, bytes)) else body
+    if "envelope" not in message:
+        return [message]
+    if message["envelope"] > ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported envelope version: {message['envelope']}")
+    if message["encoding"] == "json":
+        return message["articles"]
+    if message["encoding"] == "gzip+base64":
+        return json_loads(gzip.decompress(base64.b64decode(message["articles"])))
+    raise ValueError(f"Unsupported envelope encoding: {message['encoding']}")
@@ -1,12 +1,51 @@
+from __future__ import annotations
+
 from datetime import datetime
-import botocore.client
-from dotenv import load_dotenv
-import botocore
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import argparse
+import itertools
+import csv
+import io
+import math
+import threading
 import sys
-import json
 import os
-import boto3
+import time
+import uuid
+
+try:
+    from src.lambda_function import (
+        INVOCATION_KEY_PREFIX,
+        RESPONSE_MODES,
+        SHARD_MODES,
+        DynamoDBStateStore,
+        iter_json_array,
+        json_dumps,
+        json_loads,
+        lambda_handler,
+        set_sqs_client,
+    )
+except ImportError:  # run as a script from src/
+    from lambda_function import (
+        INVOCATION_KEY_PREFIX,
+        RESPONSE_MODES,
+        SHARD_MODES,
+        DynamoDBStateStore,
+        iter_json_array,
+        json_dumps,
+        json_loads,
+        lambda_handler,
+        set_sqs_client,
+    )
+
+PAYLOAD_CHUNK_SIZE = 64 * 1024
+MAX_CONTINUATIONS = 100
+
+# boto3 and dotenv are imported on first use, keeping --help and argument
+# errors fast
+if TYPE_CHECKING:
+    import botocore.client
 
 
 def parse_args(arg_list: list[str] | None = None) -> dict | None:
@@ -29,15 +68,42 @@ def parse_args(arg_list: list[str] | None = None) -> dict | None:
     parser.add_argument("-q", type=str, nargs="+", help="search query")
     parser.add_argument("-d", type=str, help="enter date from (YYYY-MM-DD)?")
     parser.add_argument("-ref", type=str, help="one word reference")
+    parser.add_argument("--profile", action="store_true", help="profile the invocation")
+    parser.add_argument(
+        "--response", choices=RESPONSE_MODES, help="how much to echo back"
+    )
+    parser.add_argument(
+        "--sample-size", type=int, help="messages echoed with --response sample"
+    )
+    parser.add_argument(
+        "--shard", choices=SHARD_MODES, help="split message groups by url hash or day"
+    )
+    parser.add_argument("--shards", type=int, help="message groups with --shard hash")
+    parser.add_argument(
+        "--relevance", type=float, help="drop articles scoring below this (0-1)"
+    )
+    parser.add_argument("--keywords", nargs="+", help="extra relevance terms")
     try:
         args = vars(parser.parse_args(arg_list))
         if args["q"] is None or args["ref"] is None:
             parser.error("-q Query and -ref Reference required")
         for k, v in args.items():
-            if isinstance(v, list):
+            if isinstance(v, list) and k != "keywords":
                 args[k] = "%20".join([s for s in v])
         if args["d"] is None or not is_valid_date(args["d"]):
             args.pop("d")
+        if not args["profile"]:
+            args.pop("profile")
+        for option in (
+            "response",
+            "sample_size",
+            "shard",
+            "shards",
+            "relevance",
+            "keywords",
+        ):
+            if args[option] is None:
+                args.pop(option)
         return args
     except Exception as e:
         print(e)
@@ -95,7 +161,10 @@ def spaces_replaced(string):
 
 
 def invoke_lambda(
-    lambda_client: botocore.client.BaseClient, lambda_id: str, args: dict
+    lambda_client: botocore.client.BaseClient,
+    lambda_id: str,
+    args: dict,
+    asynchronous: bool = False,
 ) -> dict:
     """Invoke lambda function and return response
 
@@ -103,17 +172,25 @@ def invoke_lambda(
         lambda_client (BaseClient): A Boto3 Lambda client
         lambda_id (str): Lambda name or ARN
         args (dict): Invocation payload e.g. {'q': query, ('d': date) 'ref': ref}
+        asynchronous (bool, optional): queue an Event invocation and return
+            without waiting for the result or log tail
 
     Returns:
         dict: response
     """
 
     try:
+        if asynchronous:
+            return lambda_client.invoke(
+                FunctionName=lambda_id,
+                InvocationType="Event",
+                Payload=json_dumps(args),
+            )
         response = lambda_client.invoke(
             FunctionName=lambda_id,
             InvocationType="RequestResponse",
             LogType="Tail",
-            Payload=json.dumps(args),
+            Payload=json_dumps(args),
         )
         return response
     except Exception as e:
@@ -122,6 +199,8 @@ def invoke_lambda(
 
 
 def lambda_name() -> str:
+    from dotenv import load_dotenv
+
     load_dotenv()
     name = os.environ.get("LAMBDA_NAME")
     if not name:
@@ -129,25 +208,324 @@ def lambda_name() -> str:
     return name
 
 
-def get_args():
-    args = parse_args()
+def get_args(arg_list: list[str] | None = None):
+    args = parse_args(arg_list)
     if not args:
         args = request_args()
     return args
 
 
-def handle_lambda_response(response: dict) -> None:
+def batch_options(
+    arg_list: list[str] | None = None,
+) -> tuple[argparse.Namespace, list[str]]:
+    """Split batch, async and local options from the single invocation args
+
+    Returns:
+        tuple: (namespace with batch, workers, asynchronous, wait, timeout,
+            local and sink, remaining args)
+    """
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    parser.add_argument("--batch", help="JSONL or CSV file of jobs to invoke")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent invokes")
+    parser.add_argument(
+        "--async", dest="asynchronous", action="store_true", help="don't wait"
+    )
+    parser.add_argument(
+        "--wait", action="store_true", help="poll async invocations until done"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=900, help="seconds to wait with --wait"
+    )
+    parser.add_argument(
+        "--local", action="store_true", help="run the handler in this process"
+    )
+    parser.add_argument(
+        "--sink",
+        default="memory",
+        help="where --local publishes: memory, moto or jsonl:PATH",
+    )
+    return parser.parse_known_args(sys.argv[1:] if arg_list is None else arg_list)
+
+
+def read_jobs(path: str) -> list[dict]:
+    """Read invocation payloads from a .csv file with a header row, or JSONL
+
+    CSV needs q and ref columns, and d is optional. Empty CSV cells are
+    dropped. JSONL lines are used as they are, so they may carry any other
+    event options.
+
+    Raises:
+        ValueError: a job without q or ref, or a line that is not a JSON object
+    """
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = [
+                {k: v for k, v in row.items() if v}
+                for row in csv.DictReader(f, skipinitialspace=True)
+            ]
+        else:
+            rows = [json_loads(line) for line in f if line.strip()]
+    for i, job in enumerate(rows, start=1):
+        if not isinstance(job, dict) or "q" not in job or "ref" not in job:
+            raise ValueError(f"Job {i} in {path} needs 'q' and 'ref'")
+    return rows
+
+
+def invoke_job(
+    lambda_client, lambda_id: str, job: dict, asynchronous: bool = False
+) -> dict:
+    """Invoke the Lambda for one job and time it
+
+    An asynchronous job is sent with a new correlation_id, under which the
+    handler records its outcome for wait_for_completion. Only counts are
+    reported, so a job that does not choose a response mode asks for the
+    summary alone rather than every message it sent. A job that stops short
+    of its timeout is re-invoked with its continuation token until it has
+    finished, and its counts summed over every invocation.
+
+    Returns:
+        dict: {"job", "seconds", and "payload", "correlation_id" or "error"}
+    """
+    start = time.perf_counter()
+    result = {"job": job}
+    try:
+        if asynchronous:
+            result["correlation_id"] = uuid.uuid4().hex
+            job = {**job, "correlation_id": result["correlation_id"]}
+            response = invoke_lambda(lambda_client, lambda_id, job, asynchronous)
+            if response.get("StatusCode") != 202:
+                raise RuntimeError(
+                    f"Invocation not accepted: {response.get('StatusCode')}"
+                )
+            return result
+        event = {"response": "summary", **job}
+        for _ in range(MAX_CONTINUATIONS + 1):
+            response = invoke_lambda(lambda_client, lambda_id, event)
+            if response.get("FunctionError"):
+                raise RuntimeError(f"{response['FunctionError']} Lambda Function Error")
+            payload = json_loads(response["Payload"].read())
+            if payload.get("statusCode") != 200:
+                raise RuntimeError(payload.get("message", payload.get("error")))
+            if "payload" in result:
+                for count in ("messagesSent", "messagesFailed"):
+                    payload[count] += result["payload"][count]
+            result["payload"] = payload
+            event, previous = continuation_event(event, payload), event
+            if event is None:
+                break
+            if event == previous:
+                raise RuntimeError("Stopped at its timeout without making progress")
+        else:
+            raise RuntimeError(f"Unfinished after {MAX_CONTINUATIONS} continuations")
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of values"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def run_batch(
+    path: str,
+    workers: int = 8,
+    asynchronous: bool = False,
+    wait: bool = False,
+    timeout: float = 900,
+    lambda_client=None,
+) -> list[dict]:
+    """Invoke the Lambda for every job in path, see run_jobs"""
+    jobs = read_jobs(path)
+    if not jobs:
+        print(f"No jobs in {path}")
+        return []
+    return run_jobs(jobs, workers, asynchronous, wait, timeout, lambda_client)
+
+
+def run_jobs(
+    jobs: list[dict],
+    workers: int = 8,
+    asynchronous: bool = False,
+    wait: bool = False,
+    timeout: float = 900,
+    lambda_client=None,
+) -> list[dict]:
+    """Invoke the Lambda for every job on a bounded thread pool
+
+    Each result is printed as it completes, followed by a summary of
+    throughput, failures and latency percentiles. Asynchronous invocations
+    are only submitted, unless wait is set to poll for their completion.
+    lambda_client defaults to a boto3 Lambda client for LAMBDA_NAME.
+
+    Returns:
+        list[dict]: invoke_job results in completion order
+    """
+    workers = max(1, min(workers, len(jobs)))
+    if lambda_client is None:
+        lambda_client = get_lambda_client(max_pool_connections=workers)
+        lambda_id = lambda_name()
+    else:
+        lambda_id = LocalLambdaClient.FUNCTION_NAME
+    results = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(invoke_job, lambda_client, lambda_id, job, asynchronous)
+            for job in jobs
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print_batch_result(result, len(results), len(jobs))
+    print_batch_summary(results, time.perf_counter() - start)
+    if asynchronous and wait:
+        submitted = [r for r in results if "error" not in r]
+        wait_for_completion(submitted, completion_store(), timeout)
+    return results
+
+
+def completion_store() -> DynamoDBStateStore:
+    """State table the handler records async outcomes in, from STATE_TABLE
+    or the Terraform default of <LAMBDA_NAME>_state"""
+    return DynamoDBStateStore(os.environ.get("STATE_TABLE") or f"{lambda_name()}_state")
+
+
+def wait_for_completion(
+    results: list[dict], store, timeout: float = 900, interval: float = 2.0
+) -> dict:
+    """Poll the state store until every async invocation has recorded its outcome
+
+    Completions are printed as they are seen. Gives up after timeout seconds.
+
+    Returns:
+        dict: {correlation_id: outcome record} for completed invocations
+    """
+    pending = {r["correlation_id"]: r["job"]["ref"] for r in results}
+    completed = {}
+    deadline = time.monotonic() + timeout
+    while pending:
+        for correlation_id, ref in list(pending.items()):
+            value = store.get(f"{INVOCATION_KEY_PREFIX}{correlation_id}")
+            if value is None:
+                continue
+            record = completed[correlation_id] = json_loads(value)
+            del pending[correlation_id]
+            if record["statusCode"] == 200:
+                print(
+                    f"Completed {ref}: {record['messagesSent']} sent, "
+                    f"{record['messagesFailed']} failed"
+                )
+            else:
+                print(f"Completed {ref} failed: {record.get('error')}")
+        if not pending or time.monotonic() >= deadline:
+            break
+        time.sleep(interval)
+    records = completed.values()
+    print(
+        f"{len(completed)} of {len(results)} invocation(s) completed, "
+        f"{sum(r['messagesSent'] for r in records)} message(s) sent, "
+        f"{sum(r['messagesFailed'] for r in records)} message(s) failed"
+    )
+    if pending:
+        print(f"{len(pending)} still running after {timeout:g}s")
+    return completed
+
+
+def print_batch_result(result: dict, done: int, total: int) -> None:
+    ref = result["job"]["ref"]
+    prefix = f"[{done}/{total}] {ref} ({result['seconds']:.2f}s)"
+    if "error" in result:
+        print(f"{prefix} failed: {result['error']}")
+        return
+    if "correlation_id" in result:
+        print(f"{prefix}: submitted as {result['correlation_id']}")
+        return
+    payload = result["payload"]
+    print(
+        f"{prefix}: {payload['messagesSent']} sent, {payload['messagesFailed']} failed"
+    )
+
+
+def print_batch_summary(results: list[dict], elapsed: float) -> None:
+    latencies = [r["seconds"] for r in results]
+    errors = sum("error" in r for r in results)
+    payloads = [r["payload"] for r in results if "payload" in r]
+    print(
+        f"{len(results)} job(s) in {elapsed:.2f}s "
+        f"({len(results) / elapsed:.2f} jobs/s), {errors} failed"
+    )
+    if not all("correlation_id" in r for r in results):
+        print(
+            f"{sum(p['messagesSent'] for p in payloads)} message(s) sent, "
+            f"{sum(p['messagesFailed'] for p in payloads)} message(s) failed"
+        )
+    print(
+        "Latency p50 {:.2f}s, p90 {:.2f}s, p99 {:.2f}s".format(
+            *(percentile(latencies, pct) for pct in (50, 90, 99))
+        )
+    )
+
+
+def continuation_event(event: dict, payload: dict | None) -> dict | None:
+    """Event resuming the jobs of event that stopped short of the timeout
+
+    Returns:
+        dict | None: event with each unfinished job's continuation token, or
+            None once every job has finished
+    """
+    if not payload:
+        return None
+    if payload.get("continuation"):
+        return {**event, "continuation": payload["continuation"]}
+    if "jobs" in payload and "jobs" in event:
+        # Job summaries come back in the same order as the event's jobs
+        unfinished = [
+            {**job, "continuation": summary["continuation"]}
+            for job, summary in zip(event["jobs"], payload["jobs"])
+            if summary.get("continuation")
+        ]
+        if unfinished:
+            return {**event, "jobs": unfinished}
+    return None
+
+
+def invoke_until_finished(lambda_client, lambda_id: str, event: dict) -> None:
+    """Invoke and print the response, then keep re-invoking with the
+    continuation tokens of any jobs that ran out of time until all finish"""
+    for _ in range(MAX_CONTINUATIONS + 1):
+        response = invoke_lambda(lambda_client, lambda_id, event)
+        payload = handle_lambda_response(response, jobs="jobs" in event)
+        next_event = continuation_event(event, payload)
+        if next_event is None:
+            return
+        if next_event == event:
+            print("Stopped at the timeout without making progress")
+            return
+        print("Out of time, continuing where the invocation stopped")
+        event = next_event
+    print(f"Unfinished after {MAX_CONTINUATIONS} continuations")
+
+
+def handle_lambda_response(response: dict, jobs: bool = False) -> dict | None:
+    """Print a Lambda response
+
+    Args:
+        response (dict): invoke() response
+        jobs (bool, optional): the event was a list of jobs, see print_payload
+
+    Returns:
+        dict | None: the payload's members other than its messages, or None
+            if it could not be read
+    """
     status_code = response.get("StatusCode")
+    payload = None
     if status_code == 200:
         try:
-            payload = json.loads(response["Payload"].read())
-            if payload["statusCode"] == 200:
-                print("Successful response")
-                print(f"{payload['messagesSent']} message(s) sent")
-                print(f"{payload['messagesFailed']} message(s) failed")
-                print("Messages sent:")
-                for m in payload["messages"]:
-                    print(m)
+            payload = print_payload(response["Payload"], jobs)
         except Exception as e:
             print(f"Error handling payload: {e}")
     else:
@@ -156,17 +534,261 @@ def handle_lambda_response(response: dict) -> None:
             print(f"Status Code: {status_code}")
     if response.get("FunctionError"):
         print(f"{response['FunctionError']} Lambda Function Error")
+    return payload
+
+
+def print_payload(stream, jobs: bool = False) -> dict:
+    """Print a successful handler response while it is still being decoded
+
+    Each message, or with jobs each job summary, is printed as soon as it is
+    read from the stream, so a large response is never held in memory
+    whole. A response without that array (summary mode, errors) is small
+    and read whole.
+
+    Returns:
+        dict: the payload's members other than its messages, and the job
+            summaries without theirs
+    """
+    payload = {}
+    chunks = iter(lambda: stream.read(PAYLOAD_CHUNK_SIZE), b"")
+    items = iter_json_array(chunks, ("jobs",) if jobs else ("messages",), payload)
+    try:
+        # The members before the array are decoded along with its first item
+        first = next(items, None)
+    except KeyError:
+        items = None
+    if payload.get("statusCode") != 200:
+        return payload
+    print("Successful response")
+    print(f"{payload['messagesSent']} message(s) sent")
+    print(f"{payload['messagesFailed']} message(s) failed")
+    if jobs and items is not None:
+        payload["jobs"] = []
+        for job in itertools.chain([first] if first else [], items):
+            print_job_summary(job)
+            job.pop("messages", None)
+            payload["jobs"].append(job)
+    elif "jobs" in payload:
+        for job in payload["jobs"]:
+            print_job_summary(job)
+    elif items is not None:
+        print("Messages sent:")
+        if first is not None:
+            print(first)
+            for m in items:
+                print(m)
+    print_omitted(payload)
+    if "profile" in payload:
+        print_profile(payload["profile"])
+    return payload
+
+
+def print_job_summary(job: dict) -> None:
+    if job["statusCode"] != 200:
+        print(f"Job {job['ref']} failed: {job.get('error')}")
+        return
+    print(
+        f"Job {job['ref']}: {job['messagesSent']} sent, {job['messagesFailed']} failed"
+    )
+    for m in job.get("messages", []):
+        print(m)
+    print_omitted(job)
+
+
+def print_omitted(summary: dict) -> None:
+    if summary.get("messagesOmitted"):
+        print(f"... and {summary['messagesOmitted']} more")
+
+
+def print_profile(profile: dict) -> None:
+    print(f"Peak memory: {profile['peakMemoryBytes'] / 1024:.1f} KiB")
+    if profile.get("file"):
+        print(f"Full profile: {profile['file']}")
+    print("Hotspots (cumulative ms, calls, function):")
+    for spot in profile["hotspots"]:
+        print(f"{spot['cumulativeMs']:>10.1f} {spot['calls']:>8} {spot['function']}")
+    print("Allocations (bytes, count, location):")
+    for alloc in profile["allocations"]:
+        print(f"{alloc['sizeBytes']:>10} {alloc['count']:>8} {alloc['location']}")
+
+
+def get_lambda_client(max_pool_connections: int | None = None):
+    import boto3
+
+    if max_pool_connections is None:
+        return boto3.client("lambda")
+    from botocore.config import Config
+
+    # Room for one connection per worker, over botocore's default of 10
+    config = Config(max_pool_connections=max(10, max_pool_connections))
+    return boto3.client("lambda", config=config)
+
+
+class MemorySink:
+    """Message sink keeping every SQS batch entry in a list"""
+
+    def __init__(self):
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def send_message_batch(self, QueueUrl: str, Entries: list[dict]) -> dict:
+        with self._lock:
+            self.entries.extend(Entries)
+        return {
+            "Successful": [
+                {"Id": e["Id"], "MessageId": uuid.uuid4().hex} for e in Entries
+            ]
+        }
+
+    def describe(self) -> str:
+        return f"{len(self.entries)} message(s) kept in memory"
+
+
+class JsonlSink(MemorySink):
+    """Message sink appending each message body as a line of a JSONL file"""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    def send_message_batch(self, QueueUrl: str, Entries: list[dict]) -> dict:
+        with self._lock, open(self.path, "a") as f:
+            for entry in Entries:
+                f.write(entry["MessageBody"] + "\n")
+            self.entries.extend(Entries)
+        return {
+            "Successful": [
+                {"Id": e["Id"], "MessageId": uuid.uuid4().hex} for e in Entries
+            ]
+        }
+
+    def describe(self) -> str:
+        return f"{len(self.entries)} message(s) written to {self.path}"
+
+
+class MotoSink:
+    """Message sink publishing to a FIFO queue in an in-process moto SQS"""
+
+    def __init__(self):
+        import boto3
+        from moto import mock_aws
+
+        self._mock = mock_aws()
+        self._mock.start()
+        self.client = boto3.client(
+            "sqs", region_name=os.environ.get("AWS_DEFAULT_REGION", "eu-west-2")
+        )
+        self.queue_url = self.client.create_queue(
+            QueueName="local.fifo",
+            Attributes={"FifoQueue": "true", "ContentBasedDeduplication": "true"},
+        )["QueueUrl"]
+
+    def send_message_batch(self, QueueUrl: str, Entries: list[dict]) -> dict:
+        return self.client.send_message_batch(QueueUrl=QueueUrl, Entries=Entries)
+
+    def describe(self) -> str:
+        attributes = self.client.get_queue_attributes(
+            QueueUrl=self.queue_url, AttributeNames=["ApproximateNumberOfMessages"]
+        )["Attributes"]
+        return f"{attributes['ApproximateNumberOfMessages']} message(s) in moto SQS"
 
+    def close(self) -> None:
+        self._mock.stop()
 
-def get_lambda_client():
-    return boto3.client("lambda")
 
+def make_sink(spec: str):
+    """Sink for --sink: memory, moto or jsonl:PATH"""
+    if spec == "memory":
+        return MemorySink()
+    if spec == "moto":
+        return MotoSink()
+    if spec.startswith("jsonl:") and spec[len("jsonl:") :]:
+        return JsonlSink(spec[len("jsonl:") :])
+    raise ValueError(f"Unknown sink {spec!r}, expected memory, moto or jsonl:PATH")
 
-def main():
-    args = get_args()
-    lambda_client = get_lambda_client()
-    response = invoke_lambda(lambda_client, lambda_name(), args)
-    handle_lambda_response(response)
+
+class LocalContext:
+    """The parts of the Lambda context object the handler uses"""
+
+    def __init__(self, timeout_seconds: float = 900):
+        self.aws_request_id = uuid.uuid4().hex
+        self.function_name = LocalLambdaClient.FUNCTION_NAME
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+class LocalLambdaClient:
+    """Stand-in for the boto3 Lambda client that runs lambda_handler in-process
+
+    Invocations run one at a time, as in a single Lambda container, and
+    publish to the given sink instead of SQS. Event invocations run to
+    completion before returning 202.
+    """
+
+    FUNCTION_NAME = "local"
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._lock = threading.Lock()
+        set_sqs_client(sink)
+        if hasattr(sink, "queue_url"):
+            os.environ["sqs_queue_url"] = sink.queue_url
+        else:
+            os.environ.setdefault("sqs_queue_url", "https://local/sink.fifo")
+
+    def invoke(self, FunctionName, InvocationType, Payload, LogType=None) -> dict:
+        with self._lock:
+            try:
+                output = lambda_handler(json_loads(Payload), LocalContext())
+                error = None
+            except Exception as e:
+                output = {"errorMessage": str(e), "errorType": type(e).__name__}
+                error = "Unhandled"
+        body = json_dumps(output).encode()
+        response = {"StatusCode": 202 if InvocationType == "Event" else 200}
+        response["Payload"] = io.BytesIO(body)
+        if error:
+            response["FunctionError"] = error
+        return response
+
+
+def main(arg_list: list[str] | None = None):
+    options, remaining = batch_options(arg_list)
+    local_client = None
+    if options.local:
+        if options.asynchronous:
+            print("--async needs a deployed Lambda, it cannot be used with --local")
+            return
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        local_client = LocalLambdaClient(make_sink(options.sink))
+    try:
+        if options.batch:
+            run_batch(
+                options.batch,
+                options.workers,
+                options.asynchronous,
+                options.wait,
+                options.timeout,
+                lambda_client=local_client,
+            )
+            return
+        args = get_args(remaining)
+        if options.asynchronous:
+            run_jobs([args], 1, True, options.wait, options.timeout)
+            return
+        if local_client:
+            invoke_until_finished(local_client, LocalLambdaClient.FUNCTION_NAME, args)
+        else:
+            invoke_until_finished(get_lambda_client(), lambda_name(), args)
+    finally:
+        if local_client:
+            print(f"Sink: {local_client.sink.describe()}")
+            if hasattr(local_client.sink, "close"):
+                local_client.sink.close()
 
 
 if __name__ == "__main__":  # pragma: no cover
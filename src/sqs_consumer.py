@@ -0,0 +1,487 @@
+"""Consume the articles the Lambda publishes, in batches, on several workers
+
+Each worker long-polls the queue for up to 10 messages at a time, writes
+the articles they carry to a sink and deletes them with one
+delete_message_batch call. A FIFO queue hands a message group to one
+receiver at a time, so workers end up on different groups and each group
+is still written in order. Messages are only deleted once written, so a
+failed write is retried when they become visible again. A message that
+cannot be decoded holds back the rest of its group until it has been
+received --max-receives times, when it goes to the dead-letter sink.
+
+Usage: python src/sqs_consumer.py [--queue-url URL] [--sink SPEC]
+    [--dead-letter SPEC] [--max-receives N] [--workers N] [--wait SECONDS]
+    [--drain]
+
+Sinks: memory, jsonl:PATH, rotate:DIRECTORY or parquet:DIRECTORY (needs
+pyarrow). The queue URL defaults to sqs_queue_url from the environment or
+src/.env.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+
+try:
+    from src.lambda_function import json_dumps, unpack_envelope
+except ImportError:  # run as a script from src/
+    from lambda_function import json_dumps, unpack_envelope
+
+# boto3 and botocore are imported on first use, like in the handler
+if TYPE_CHECKING:
+    import botocore.client
+
+logger = logging.getLogger(__name__)
+
+RECEIVE_BATCH_SIZE = 10
+WAIT_SECONDS = 20
+ROTATE_BYTES = 64 * 1024 * 1024
+PARQUET_ROWS_PER_FILE = 10_000
+RECEIVE_ERROR_DELAY = 1.0
+MAX_RECEIVES = 5
+
+
+class MemorySink:
+    """Article sink keeping every article in a list"""
+
+    def __init__(self):
+        self.articles = []
+        self._lock = threading.Lock()
+
+    def write(self, articles: list[dict]) -> None:
+        with self._lock:
+            self.articles.extend(articles)
+
+    def close(self) -> None:
+        pass
+
+    def describe(self) -> str:
+        return f"{len(self.articles)} article(s) kept in memory"
+
+
+class JsonlSink:
+    """Article sink appending each article as a line of a JSONL file
+
+    Every write is flushed before it returns, as its messages are deleted
+    from the queue straight after.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, articles: list[dict]) -> None:
+        lines = "".join(json_dumps(article) + "\n" for article in articles)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(lines)
+            self._file.flush()
+            self.count += len(articles)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def describe(self) -> str:
+        return f"{self.count} article(s) written to {self.path}"
+
+
+class RotatingFileSink(JsonlSink):
+    """JSONL sink starting a new articles-<n>.jsonl file in directory once
+    the current one reaches max_bytes"""
+
+    def __init__(self, directory: str, max_bytes: int = ROTATE_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.paths = []
+        super().__init__(self._next_path())
+
+    def _next_path(self) -> str:
+        path = os.path.join(self.directory, f"articles-{len(self.paths) + 1:05}.jsonl")
+        self.paths.append(path)
+        return path
+
+    def write(self, articles: list[dict]) -> None:
+        with self._lock:
+            if self._file is not None and self._file.tell() >= self.max_bytes:
+                self._file.close()
+                self._file = None
+                self.path = self._next_path()
+        super().write(articles)
+
+    def describe(self) -> str:
+        return (
+            f"{self.count} article(s) written to {len(self.paths)} file(s) "
+            f"in {self.directory}"
+        )
+
+
+class ParquetSink:
+    """Article sink writing articles-<n>.parquet files of rows_per_file rows
+
+    Raises:
+        ImportError: pyarrow is not installed
+    """
+
+    def __init__(self, directory: str, rows_per_file: int = PARQUET_ROWS_PER_FILE):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("The parquet sink needs pyarrow: pip install pyarrow")
+        self._pyarrow = pyarrow
+        self._parquet = pyarrow.parquet
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.rows_per_file = rows_per_file
+        self.paths = []
+        self.count = 0
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def write(self, articles: list[dict]) -> None:
+        with self._lock:
+            self._rows.extend(articles)
+            self.count += len(articles)
+            while len(self._rows) >= self.rows_per_file:
+                self._flush(self._rows[: self.rows_per_file])
+                del self._rows[: self.rows_per_file]
+
+    def _flush(self, rows: list[dict]) -> None:
+        path = os.path.join(
+            self.directory, f"articles-{len(self.paths) + 1:05}.parquet"
+        )
+        self._parquet.write_table(self._pyarrow.Table.from_pylist(rows), path)
+        self.paths.append(path)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._rows:
+                self._flush(self._rows)
+                self._rows = []
+
+    def describe(self) -> str:
+        return (
+            f"{self.count} article(s) written to {len(self.paths)} file(s) "
+            f"in {self.directory}"
+        )
+
+
+def make_sink(spec: str):
+    """Sink from memory, jsonl:PATH, rotate:DIRECTORY or parquet:DIRECTORY
+
+    Raises:
+        ValueError: unknown sink
+    """
+    kind, _, target = spec.partition(":")
+    if kind == "memory":
+        return MemorySink()
+    if kind == "jsonl" and target:
+        return JsonlSink(target)
+    if kind == "rotate" and target:
+        return RotatingFileSink(target)
+    if kind == "parquet" and target:
+        return ParquetSink(target)
+    raise ValueError(
+        f"Unknown sink {spec!r}: use memory, jsonl:PATH, rotate:DIR or parquet:DIR"
+    )
+
+
+class Consumer:
+    """Receives, writes and deletes messages from queue_url on worker threads
+
+    Args:
+        queue_url (str)
+        sink: anything with write(articles) and close()
+        sqs_client (botocore.client.SQS, optional): defaults to a boto3 client
+            with a connection per worker
+        workers (int, optional): concurrent receivers
+        wait_seconds (int, optional): long-poll wait, up to 20
+        visibility_timeout (int, optional): overrides the queue's for
+            received messages
+        dead_letter (optional): sink for messages that still cannot be
+            decoded after max_receives receives. Without one they are left
+            to the queue's redrive policy
+        max_receives (int, optional)
+    """
+
+    def __init__(
+        self,
+        queue_url: str,
+        sink,
+        sqs_client: botocore.client.SQS | None = None,
+        workers: int = 4,
+        wait_seconds: int = WAIT_SECONDS,
+        visibility_timeout: int | None = None,
+        dead_letter=None,
+        max_receives: int = MAX_RECEIVES,
+    ):
+        self.queue_url = queue_url
+        self.sink = sink
+        self.workers = max(1, workers)
+        self.sqs_client = sqs_client or get_sqs_client(self.workers)
+        self.wait_seconds = wait_seconds
+        self.visibility_timeout = visibility_timeout
+        self.dead_letter = dead_letter
+        self.max_receives = max_receives
+        self.stats = dict.fromkeys(
+            [
+                "received",
+                "articles",
+                "deleted",
+                "failed",
+                "heldBack",
+                "deadLettered",
+                "receiveErrors",
+            ],
+            0,
+        )
+        self._stats_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def run(self, drain: bool = False) -> dict:
+        """Consume until stop() is called, or until the queue is empty if drain
+
+        Returns:
+            dict: message and article counts, seconds and messagesPerSecond
+        """
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._work, args=(drain,), name=f"consumer-{i}")
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            logger.info("Stopping once current batches are done")
+            self.stop()
+            for thread in threads:
+                thread.join()
+        seconds = time.perf_counter() - start
+        return {
+            **self.stats,
+            "seconds": round(seconds, 3),
+            "messagesPerSecond": round(self.stats["deleted"] / seconds, 1),
+        }
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _work(self, drain: bool) -> None:
+        while not self._stopping.is_set():
+            messages = self._receive()
+            if messages:
+                self._process(messages)
+            elif drain:
+                # Groups still held by other workers are drained by them
+                return
+
+    def _receive(self) -> list[dict]:
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        request = {
+            "QueueUrl": self.queue_url,
+            "MaxNumberOfMessages": RECEIVE_BATCH_SIZE,
+            "WaitTimeSeconds": self.wait_seconds,
+            "MessageSystemAttributeNames": [
+                "MessageGroupId",
+                "ApproximateReceiveCount",
+            ],
+            "MessageAttributeNames": ["All"],
+        }
+        if self.visibility_timeout is not None:
+            request["VisibilityTimeout"] = self.visibility_timeout
+        try:
+            messages = self.sqs_client.receive_message(**request).get("Messages", [])
+        except (BotoCoreError, ClientError) as e:
+            logger.error("Failed to receive messages: %s", str(e))
+            self._count("receiveErrors")
+            self._stopping.wait(RECEIVE_ERROR_DELAY)
+            return []
+        self._count("received", len(messages))
+        return messages
+
+    def _process(self, messages: list[dict]) -> None:
+        """Write the articles of a batch in the order received, then delete it
+
+        A message that cannot be decoded is left on the queue to be received
+        again, and so are the later messages of its group in the batch, so
+        that the group is still written in order. Once it has been received
+        max_receives times it goes to the dead-letter sink, if there is one,
+        and is deleted so that its group can move on. A failed write leaves
+        the whole batch to be received again.
+        """
+        articles, done, blocked = [], [], set()
+        for message in messages:
+            group = message.get("Attributes", {}).get("MessageGroupId")
+            if group is not None and group in blocked:
+                self._count("heldBack")
+                continue
+            try:
+                articles.extend(unpack_envelope(message["Body"]))
+                done.append(message)
+            except (ValueError, KeyError, TypeError) as e:
+                if self._dead_letter(message, e):
+                    done.append(message)
+                    continue
+                logger.error("Failed to decode %s: %s", message["MessageId"], str(e))
+                self._count("failed")
+                if group is not None:
+                    blocked.add(group)
+        try:
+            self.sink.write(articles)
+        except Exception as e:
+            logger.error("Failed to write %s article(s): %s", len(articles), str(e))
+            self._count("failed", len(done))
+            return
+        self._count("articles", len(articles))
+        self._delete(done)
+
+    def _dead_letter(self, message: dict, error: Exception) -> bool:
+        """Write a message received max_receives times to the dead-letter sink
+
+        Returns:
+            bool: whether it was written, and can be deleted
+        """
+        attributes = message.get("Attributes", {})
+        receives = int(attributes.get("ApproximateReceiveCount", 1))
+        if self.dead_letter is None or receives < self.max_receives:
+            return False
+        record = {
+            "messageId": message["MessageId"],
+            "messageGroupId": attributes.get("MessageGroupId"),
+            "receiveCount": receives,
+            "error": str(error),
+            "body": message["Body"],
+        }
+        try:
+            self.dead_letter.write([record])
+        except Exception as e:
+            logger.error("Failed to dead-letter %s: %s", message["MessageId"], str(e))
+            return False
+        logger.warning(
+            "Dead-lettered %s after %s receives: %s",
+            message["MessageId"],
+            receives,
+            str(error),
+        )
+        self._count("deadLettered")
+        return True
+
+    def _delete(self, messages: list[dict]) -> None:
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        if not messages:
+            return
+        entries = [
+            {"Id": str(i), "ReceiptHandle": message["ReceiptHandle"]}
+            for i, message in enumerate(messages)
+        ]
+        try:
+            response = self.sqs_client.delete_message_batch(
+                QueueUrl=self.queue_url, Entries=entries
+            )
+        except (BotoCoreError, ClientError) as e:
+            logger.error("Failed to delete messages: %s", str(e))
+            self._count("failed", len(messages))
+            return
+        for entry in response.get("Failed", []):
+            logger.error(
+                "Failed to delete message: %s", entry.get("Message", entry["Code"])
+            )
+        self._count("deleted", len(response.get("Successful", [])))
+        self._count("failed", len(response.get("Failed", [])))
+
+
+def get_sqs_client(workers: int = 1):
+    import boto3
+    from botocore.config import Config
+
+    # A connection per worker, over botocore's default of 10, and a read
+    # timeout longer than the longest long-poll
+    config = Config(
+        max_pool_connections=max(10, workers), read_timeout=WAIT_SECONDS + 10
+    )
+    return boto3.client("sqs", config=config)
+
+
+def main(arg_list: list[str] | None = None) -> dict | None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queue-url", help="defaults to sqs_queue_url")
+    parser.add_argument("--sink", default="jsonl:articles.jsonl")
+    parser.add_argument(
+        "--dead-letter",
+        default="jsonl:dead-letter.jsonl",
+        help="sink for messages that cannot be decoded",
+    )
+    parser.add_argument(
+        "--max-receives",
+        type=int,
+        default=MAX_RECEIVES,
+        help="receives before a message is dead-lettered",
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--wait", type=int, default=WAIT_SECONDS, help="long-poll")
+    parser.add_argument("--visibility-timeout", type=int)
+    parser.add_argument(
+        "--drain", action="store_true", help="stop once the queue is empty"
+    )
+    args = parser.parse_args(arg_list)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    queue_url = args.queue_url or os.environ.get("sqs_queue_url")
+    if not queue_url:
+        print("No queue: pass --queue-url or set sqs_queue_url")
+        return None
+    try:
+        sink = make_sink(args.sink)
+        dead_letter = make_sink(args.dead_letter)
+    except (ValueError, ImportError) as e:
+        print(e)
+        return None
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    consumer = Consumer(
+        queue_url,
+        sink,
+        workers=args.workers,
+        wait_seconds=args.wait,
+        visibility_timeout=args.visibility_timeout,
+        dead_letter=dead_letter,
+        max_receives=args.max_receives,
+    )
+    try:
+        stats = consumer.run(drain=args.drain)
+    finally:
+        sink.close()
+        dead_letter.close()
+    print(
+        f"{stats['deleted']} message(s) consumed in {stats['seconds']}s "
+        f"({stats['messagesPerSecond']} msg/s), {stats['failed']} failed, "
+        f"{stats['deadLettered']} dead-lettered"
+    )
+    print(f"Sink: {sink.describe()}")
+    return stats
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
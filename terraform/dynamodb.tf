@@ -0,0 +1,16 @@
+resource "aws_dynamodb_table" "guardian_state" {
+  name         = "${var.lambda_name}_state"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "key"
+
+  attribute {
+    name = "key"
+    type = "S"
+  }
+
+  # Invocation records for asynchronous callers expire after a week
+  ttl {
+    attribute_name = "expires"
+    enabled        = true
+  }
+}
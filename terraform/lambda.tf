@@ -31,6 +31,16 @@ data "aws_iam_policy_document" "lambda_logging" {
     ]
     resources = [aws_sqs_queue.retrieved_guardian_articles.arn]
   }
+  statement {
+    effect = "Allow"
+
+    actions = [
+      "dynamodb:GetItem",
+      "dynamodb:PutItem",
+      "dynamodb:UpdateItem"
+    ]
+    resources = [aws_dynamodb_table.guardian_state.arn]
+  }
 }
 
 resource "aws_iam_policy" "lambda_logging" {
@@ -65,11 +75,14 @@ resource "aws_lambda_function" "guardian_api_lambda" {
   source_code_hash = data.archive_file.lambda.output_base64sha256
 
   runtime = "python3.12"
+  timeout = var.lambda_timeout
 
   environment {
     variables = {
       api_key       = var.guardian_api_key
       sqs_queue_url = aws_sqs_queue.retrieved_guardian_articles.url
+      STATE_BACKEND = "dynamodb"
+      STATE_TABLE   = aws_dynamodb_table.guardian_state.name
     }
   }
   depends_on = [aws_sqs_queue.retrieved_guardian_articles]
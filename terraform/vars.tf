@@ -13,4 +13,12 @@ variable "guardian_api_key" {
 
 variable "sqs_queue_name" {
   type = string
-}
\ No newline at end of file
+}
+
+# Seconds. Long backfills continue across invocations with continuation
+# tokens, and keeping this within botocore's default 60 s read timeout
+# means synchronous CLI invocations are not retried while still running.
+variable "lambda_timeout" {
+  type    = number
+  default = 60
+}
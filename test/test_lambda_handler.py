@@ -1,14 +1,46 @@
 from src.lambda_function import (
     lambda_handler,
     _env_variables,
+    _get_config,
+    _get_http_session,
+    _reset_resources,
+    _cache_key,
+    _ResponseCache,
+    _get_state_store,
+    FileStateStore,
+    DynamoDBStateStore,
+    _PublishedIndex,
+    _ShardedPublishedIndex,
+    _load_published_index,
+    _save_published_index,
+    _url_hash,
+    _RateLimiter,
+    _OutOfTime,
+    _get_rate_limiter,
+    _get_with_backoff,
+    _retry_after,
     _build_url,
     _parse_results,
-    _fetch_data,
+    _fetch_pages,
+    _fetch_results,
+    _truncate,
+    _prefetched,
+    iter_json_array,
     _get_sqs_client,
-    _send_to_SQS,
+    set_sqs_client,
+    _send_batch_to_SQS,
+    _message_group,
+    _terms,
+    _RelevanceProfile,
+    _get_profile_weights,
+    _load_json_backend,
+    json_dumps,
+    _pack_envelopes,
+    unpack_envelope,
     BASE_URL,
+    SQS_MAX_BATCH_BYTES,
 )
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, MagicMock
 from botocore.exceptions import ClientError
 from moto import mock_aws
 import pytest
@@ -18,11 +50,16 @@ import logging
 import json
 import boto3
 import os
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
 
 
 class TestHandler:
-    @patch("src.lambda_function.requests")
-    def test_returns_400_for_malformed_event(self, mock_requests):
+    @patch("src.lambda_function._get_http_session")
+    def test_returns_400_for_malformed_event(self, mock_session):
         output = lambda_handler({}, {})
         expected = {
             "statusCode": 400,
@@ -31,9 +68,9 @@ class TestHandler:
         }
         assert output == expected
 
-    @patch("src.lambda_function.requests")
+    @patch("src.lambda_function._get_http_session")
     def test_logs_error_for_missing_q_or_ref_event_keys_and_returns_error(
-        self, mock_requests, caplog
+        self, mock_session, caplog
     ):
         with caplog.at_level(logging.ERROR):
             response = lambda_handler({"ref": "test"}, {})
@@ -53,9 +90,25 @@ class TestHandler:
                 "message": "Missing required event key: ref - 'q' and 'ref' required",
             }
 
-    @patch("src.lambda_function.requests")
+    def test_bad_request_does_not_import_http_or_aws_libraries(self):
+        code = (
+            "import sys\n"
+            "from src.lambda_function import lambda_handler\n"
+            "assert lambda_handler({}, {})['statusCode'] == 400\n"
+            "print(sorted({'requests', 'boto3', 'botocore'} & set(sys.modules)))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.dirname(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert result.stdout.strip() == "[]"
+
+    @patch("src.lambda_function._get_http_session")
     def test_logs_event_at_info_level(
-        self, mock_requests, caplog, event_no_date, event_with_date
+        self, mock_session, caplog, event_no_date, event_with_date
     ):
         with caplog.at_level(logging.INFO):
             lambda_handler({}, {})
@@ -82,17 +135,17 @@ class TestHandler:
                 for m in caplog.messages
             )
 
-    @patch("src.lambda_function.requests.get")
+    @patch("src.lambda_function._get_http_session")
     def test_logs_progress_and_returns_dict_with_message_log(
         self,
-        mock_requests,
+        mock_session,
         event_with_date,
         monkeypatch,
         api_200_response,
         mock_sqs_moto_and_url_in_env,
         caplog,
     ):
-        mock_requests.return_value = api_200_response
+        mock_session.return_value.get.return_value = api_200_response
         monkeypatch.setenv("api_key", "test_key")
         assert (
             os.environ.get("sqs_queue_url")
@@ -109,6 +162,7 @@ class TestHandler:
                 or "Message sent. ID:" in m
                 for m in caplog.messages
             )
+        assert response.pop("metrics")["apiRequests"] == 1
         assert response == {
             "statusCode": 200,
             "messagesSent": 1,
@@ -121,27 +175,28 @@ class TestHandler:
                     "reference": "test_ref",
                 }
             ],
+            "throttle": {"throttledSeconds": 0.0, "retries": 0},
         }
 
-    @patch("src.lambda_function._send_to_SQS")
-    @patch("src.lambda_function.requests.get")
+    @patch("src.lambda_function._send_batch_to_SQS")
+    @patch("src.lambda_function._get_http_session")
     def test_returns_dict_with_failed_message_log(
         self,
-        mock_requests,
-        mock_send_to_SQS,
+        mock_session,
+        mock_send_batch_to_SQS,
         event_with_date,
         monkeypatch,
         api_200_response,
         mock_sqs_moto_and_url_in_env,
     ):
-        mock_requests.return_value = api_200_response
+        mock_session.return_value.get.return_value = api_200_response
         monkeypatch.setenv("api_key", "test_key")
         assert (
             os.environ.get("sqs_queue_url")
             == "https://sqs.eu-west-2.amazonaws.com/123456789012/test_queue.fifo"
         )
         assert os.environ.get("AWS_ACCESS_KEY_ID") == "FOOBARKEY"
-        mock_send_to_SQS.return_value = False
+        mock_send_batch_to_SQS.return_value = (0, 1)
         response = lambda_handler(event_with_date, {})
         assert response["messagesFailed"] == 1
 
@@ -181,6 +236,62 @@ class TestEnvVariablesUtil:
         assert "Missing environment variable: api_key" in str(e.value)
 
 
+class TestGetConfig:
+    def test_returns_api_key_and_queue_url(self, monkeypatch):
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("sqs_queue_url", "test_url.fifo")
+        assert _get_config() == ("test_key", "test_url.fifo")
+
+    @patch("src.lambda_function._env_variables")
+    def test_reads_environment_once(self, mock_env_variables):
+        mock_env_variables.return_value = ("test_key", "test_url.fifo")
+        _get_config()
+        _get_config()
+        assert mock_env_variables.call_count == 1
+
+    def test_raises_value_error_for_non_fifo_queue(self, monkeypatch):
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("sqs_queue_url", "test_url")
+        with pytest.raises(ValueError, match="not a FIFO queue"):
+            _get_config()
+
+    def test_handler_returns_500_for_invalid_config(self, monkeypatch, caplog):
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("sqs_queue_url", "test_url")
+        with caplog.at_level(logging.ERROR):
+            response = lambda_handler({"q": "test", "ref": "test_ref"}, {})
+            assert any("Invalid environment variable" in m for m in caplog.messages)
+        assert response["statusCode"] == 500
+
+    def test_reset_resources_clears_cached_config(self, monkeypatch):
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("sqs_queue_url", "test_url.fifo")
+        _get_config()
+        monkeypatch.setenv("api_key", "new_key")
+        assert _get_config()[0] == "test_key"
+        _reset_resources()
+        assert _get_config()[0] == "new_key"
+
+
+class TestGetHttpSession:
+    def test_returns_requests_session(self):
+        assert isinstance(_get_http_session(), requests.Session)
+
+    def test_session_reused_between_calls(self):
+        assert _get_http_session() is _get_http_session()
+
+    def test_session_has_connection_pool(self):
+        adapter = _get_http_session().get_adapter("https://content.guardianapis.com")
+        assert adapter._pool_maxsize >= 10
+
+    def test_reset_resources_closes_session(self):
+        session = _get_http_session()
+        with patch.object(session, "close") as mock_close:
+            _reset_resources()
+        mock_close.assert_called_once()
+        assert _get_http_session() is not session
+
+
 class TestBASEURL:
     def test_returns_200(self):
         response = requests.get(BASE_URL + "&api-key=test")
@@ -203,67 +314,179 @@ class TestBuildUrl:
         pattern = r"https:\/\/content.guardianapis.com\/search\?q=[a-z]+&api-key=test"
         assert re.match(pattern, url)
 
+    def test_url_includes_page_and_page_size(self):
+        url = _build_url("test", "test", page=2, page_size=200)
+        assert url == f"{BASE_URL}q=test&page=2&page-size=200&api-key=test"
 
-class TestParseResults:
-    def test_returns_list(self, response_body):
-        results = response_body["response"]["results"]
-        assert isinstance(_parse_results(results, "test_ref"), list)
+    def test_url_includes_order_by(self):
+        url = _build_url("test", "test", "1997-01-01", order_by="oldest")
+        assert (
+            url == f"{BASE_URL}q=test&from-date=1997-01-01&order-by=oldest&api-key=test"
+        )
 
-    def test_returns_mvp_keys_and_reference(self, response_body):
-        results = response_body["response"]["results"]
-        output = _parse_results(results, "test_ref")
-        expected_keys = ["webTitle", "webUrl", "webPublicationDate", "reference"]
-        assert len(output) > 0
-        for result in output:
-            for key in expected_keys:
-                assert key in list(result.keys())
 
-    def test_unwanted_keys_not_returned(self, response_body):
-        results = response_body["response"]["results"]
-        output = _parse_results(results, "test_ref")
-        unwanted_keys = [
-            "id",
-            "type",
-            "sectionId",
-            "sectionName",
-            "apiUrl",
-            "isHosted",
-            "pillarId",
-            "pillarName",
+class TestFetchPages:
+    def test_yields_results_for_each_page(self, mock_session, paged_responses):
+        mock_session.get.side_effect = paged_responses(3)
+        pages = [list(page) for page in _fetch_pages("test", "key", page_size=2)]
+        assert [[r["webUrl"][-3:] for r in page] for page in pages] == [
+            ["1/0", "1/1"],
+            ["2/0", "2/1"],
+            ["3/0", "3/1"],
         ]
-        assert len(output) > 0
-        for result in output:
-            for key in unwanted_keys:
-                assert key not in list(result.keys())
 
+    def test_requests_each_page_with_page_size(self, mock_session, paged_responses):
+        mock_session.get.side_effect = paged_responses(2)
+        for page in _fetch_pages("test", "key", "1997-01-01", page_size=2):
+            list(page)
+        urls = [c.args[0] for c in mock_session.get.call_args_list]
+        assert urls == [
+            f"{BASE_URL}q=test&from-date=1997-01-01&page-size=2&api-key=key",
+            f"{BASE_URL}q=test&from-date=1997-01-01&page=2&page-size=2&api-key=key",
+        ]
+
+    def test_stops_at_max_pages(self, mock_session, paged_responses):
+        mock_session.get.side_effect = paged_responses(5)
+        pages = [list(page) for page in _fetch_pages("test", "key", max_pages=2)]
+        assert len(pages) == 2
+        assert mock_session.get.call_count == 2
+
+    def test_fetches_next_page_only_when_requested(self, mock_session, paged_responses):
+        mock_session.get.side_effect = paged_responses(3)
+        pages = _fetch_pages("test", "key")
+        list(next(pages))
+        assert mock_session.get.call_count == 1
+
+
+class TestIterJsonArray:
+    @pytest.mark.parametrize("chunk_size", [1, 3, 64, 100_000])
+    def test_yields_items_for_any_chunking(self, chunk_size, response_body):
+        document = json.dumps(response_body).encode()
+        chunks = [
+            document[i : i + chunk_size] for i in range(0, len(document), chunk_size)
+        ]
+        items = list(iter_json_array(chunks, ("response", "results")))
+        assert items == response_body["response"]["results"]
+
+    def test_collects_sibling_members_into_meta(self):
+        document = '{"response": {"pages": 3, "results": [{"a": 1}], "total": 9}}'
+        meta = {}
+        list(iter_json_array([document], ("response", "results"), meta))
+        assert meta == {"pages": 3, "total": 9}
+
+    def test_handles_brackets_and_escapes_inside_strings(self):
+        item = {"webTitle": 'a "quoted" ] }, [title\\', "results": "["}
+        document = json.dumps({"response": {"note": "]", "results": [item, item]}})
+        items = list(iter_json_array([document], ("response", "results")))
+        assert items == [item, item]
+
+    def test_decodes_multibyte_characters_split_across_chunks(self):
+        document = json.dumps({"results": [{"t": "café ☃"}]}, ensure_ascii=False)
+        encoded = document.encode()
+        chunks = [encoded[i : i + 1] for i in range(len(encoded))]
+        assert list(iter_json_array(chunks, ("results",))) == [{"t": "café ☃"}]
+
+    def test_decodes_multibyte_characters_split_before_the_array(self):
+        document = json.dumps(
+            {"note": "It’s", "results": [{"t": "a"}]}, ensure_ascii=False
+        ).encode()
+        split = document.index("’".encode()) + 1
+        chunks = [document[:split], document[split : split + 1], document[split + 1 :]]
+        meta = {}
+        assert list(iter_json_array(chunks, ("results",), meta)) == [{"t": "a"}]
+        assert meta == {"note": "It’s"}
+
+    def test_ignores_same_key_at_other_depth(self):
+        document = '{"results": [{"x": 1}], "response": {"results": [{"y": 2}]}}'
+        items = list(iter_json_array([document], ("response", "results")))
+        assert items == [{"y": 2}]
+
+    @pytest.mark.parametrize(
+        "document,missing",
+        [
+            ('{"message": "test"}', "response"),
+            ('{"response": {}}', "results"),
+            ('{"response": {"results": null}}', "results"),
+            ('{"response": {"results": {"a": 1}}}', "results"),
+        ],
+    )
+    def test_raises_key_error_for_missing_path(self, document, missing):
+        with pytest.raises(KeyError, match=missing):
+            list(iter_json_array([document], ("response", "results")))
+
+    def test_missing_path_writes_whole_object_to_meta(self):
+        meta = {}
+        with pytest.raises(KeyError, match="results"):
+            list(
+                iter_json_array(
+                    ['{"response": {"pages": 3}}'], ("response", "results"), meta
+                )
+            )
+        assert meta == {"pages": 3}
+
+    def test_non_array_value_writes_parent_object_to_meta(self):
+        meta = {}
+        document = '{"response": {"pages": 3, "results": null}}'
+        with pytest.raises(KeyError, match="results"):
+            list(iter_json_array([document], ("response", "results"), meta))
+        assert meta == {"pages": 3, "results": None}
+
+    def test_yields_string_items(self):
+        chunks = ['{"ids": ["a', '", "b\\"c"]}']
+        assert list(iter_json_array(chunks, ("ids",))) == ["a", 'b"c']
+
+    def test_raises_for_truncated_document(self):
+        with pytest.raises(json.JSONDecodeError):
+            list(iter_json_array(['{"results": [{"a": 1}, {"b"'], ("results",)))
+
+    def test_reads_chunks_lazily(self):
+        consumed = []
+
+        def chunks():
+            for chunk in ['{"results": [{"a": 1},', ' {"b": 2}', "]}"]:
+                consumed.append(chunk)
+                yield chunk
+
+        items = iter_json_array(chunks(), ("results",))
+        assert next(items) == {"a": 1}
+        assert len(consumed) == 1
 
-class TestFetchData:
-    @patch("src.lambda_function.requests")
-    def test_api_called_with_url(self, mock_requests):
-        _fetch_data("test_url")
-        called_with = mock_requests.get.call_args_list[0][0][0]
-        assert called_with == "test_url"
 
-    @patch("src.lambda_function.requests")
-    def test_returns_list(self, mock_requests, api_200_response):
-        mock_requests.get.return_value = api_200_response
-        assert isinstance(_fetch_data("test_url"), list)
+class TestFetchResults:
+    def test_streams_response_with_gzip(self, mock_session, api_200_response):
+        mock_session.get.return_value = api_200_response
+        list(_fetch_results("test_url", {}))
+        assert mock_session.get.call_args.kwargs["stream"] is True
+        api_200_response.iter_content.assert_called_once()
 
-    @patch("src.lambda_function.requests")
-    def test_logs_results(self, mock_requests, api_200_response, caplog):
-        mock_requests.get.return_value = api_200_response
+    def test_session_requests_gzip(self):
+        assert _get_http_session().headers["Accept-Encoding"] == "gzip"
+
+    def test_writes_page_metadata_to_meta(self, mock_session, api_200_response):
+        mock_session.get.return_value = api_200_response
+        meta = {}
+        list(_fetch_results("test_url", meta))
+        assert meta["pages"] == 17820
+        assert "results" not in meta
+
+    def test_closes_response(self, mock_session, api_200_response):
+        mock_session.get.return_value = api_200_response
+        list(_fetch_results("test_url", {}))
+        api_200_response.__exit__.assert_called_once()
+
+    def test_logs_results(self, mock_session, api_200_response, caplog):
+        mock_session.get.return_value = api_200_response
         with caplog.at_level(logging.INFO):
-            _fetch_data("test_url")
+            list(_fetch_results("test_url", {}))
             assert any("1 result(s) collected" in m for m in caplog.messages)
 
-    @patch("src.lambda_function.requests.get")
     def test_handles_malformed_response(
-        self, mock_requests, caplog, api_200_malformed_payload
+        self, mock_session, caplog, api_200_malformed_payload
     ):
-        mock_requests.return_value = api_200_malformed_payload
+        mock_session.get.return_value = api_200_malformed_payload
         with caplog.at_level(logging.ERROR):
             with pytest.raises(KeyError):
-                _fetch_data("test_url")
+                list(_fetch_results("test_url", {}))
             assert any(
                 "Error while fetching data:" in m
                 and "KeyError" in m
@@ -271,23 +494,21 @@ class TestFetchData:
                 for m in caplog.messages
             )
 
-    @patch("src.lambda_function.requests.get")
-    def test_logs_error(self, mock_requests, caplog, api_401_response):
-        mock_requests.return_value = api_401_response
+    def test_logs_error(self, mock_session, caplog, api_401_response):
+        mock_session.get.return_value = api_401_response
         with caplog.at_level(logging.ERROR):
             with pytest.raises(requests.exceptions.HTTPError):
-                _fetch_data("test_url")
+                list(_fetch_results("test_url", {}))
             assert any(
                 "HTTP Error while fetching data:" in m and "401 Unauthorized" in m
                 for m in caplog.messages
             )
 
-    @patch("src.lambda_function.requests.get")
-    def test_handles_timeout(self, mock_requests, caplog):
-        mock_requests.side_effect = requests.exceptions.Timeout("Request timed out")
+    def test_handles_timeout(self, mock_session, caplog):
+        mock_session.get.side_effect = requests.exceptions.Timeout("Request timed out")
         with caplog.at_level(logging.ERROR):
             with pytest.raises(requests.exceptions.Timeout):
-                _fetch_data("test_url")
+                list(_fetch_results("test_url", {}))
             assert any(
                 "Timeout occurred while fetching data:" in m
                 and "Request timed out" in m
@@ -295,150 +516,1996 @@ class TestFetchData:
             )
 
 
-class TestGetSqsClient:
-    @mock_aws
-    def test_returns_boto3_client(self):
-        client = _get_sqs_client()
-        assert client.__class__.__name__ == "SQS"
+class TestHandlerMetrics:
+    def test_returns_stage_durations_and_counters(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = paged_responses(2)
+        event = {"q": "test", "ref": "test_ref", "paginate": True}
+        metrics = lambda_handler(event, {})["metrics"]
+        assert set(metrics["durationsMs"]) == {
+            "validate",
+            "fetch",
+            "parse",
+            "filter",
+            "publish",
+            "total",
+        }
+        assert all(ms >= 0 for ms in metrics["durationsMs"].values())
+        stages = sum(v for k, v in metrics["durationsMs"].items() if k != "total")
+        assert stages <= metrics["durationsMs"]["total"]
+        assert metrics["apiRequests"] == 2
+        assert metrics["apiRetries"] == 0
+        assert metrics["sqsRetries"] == 0
+        assert metrics["bytesFetched"] > 0
+        assert metrics["bytesPublished"] > 0
+
+    def test_fetch_time_includes_slow_responses(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        [response] = paged_responses(1)
+        body = response.iter_content.return_value
 
+        def slow_chunks(**kwargs):
+            time.sleep(0.05)
+            yield from body
 
-class TestSendToSQS:
-    def test_calls_client_with_send_message_url_and_message(
-        self, mock_sqs_client, message
+        response.iter_content.side_effect = slow_chunks
+        mock_session.get.return_value = response
+        metrics = lambda_handler({"q": "test", "ref": "test_ref"}, {})["metrics"]
+        assert metrics["durationsMs"]["fetch"] >= 50
+        assert metrics["durationsMs"]["publish"] < metrics["durationsMs"]["total"]
+
+    def test_counts_sqs_retries(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_client
     ):
-        _send_to_SQS(message, "test_ref", mock_sqs_client, "test_url")
-        mock_sqs_client.send_message.assert_called_with(
-            QueueUrl="test_url",
-            MessageBody=json.dumps(message),
-            MessageGroupId="test_ref",
-        )
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("sqs_queue_url", "test_queue.fifo")
+        mock_session.get.side_effect = paged_responses(1)
+        error = ClientError({"Error": {"Code": "Throttling", "Message": "slow"}}, "op")
+        send = mock_sqs_client.send_message_batch.side_effect
+        attempts = iter([error])
 
-    def test_logs_message_sent_and_returns_true(self, caplog, mock_sqs_client, message):
-        with caplog.at_level(logging.INFO):
-            output = _send_to_SQS(message, "test_ref", mock_sqs_client, "test_url")
+        def throttled_once(**kwargs):
+            for e in attempts:
+                raise e
+            return send(**kwargs)
 
-            assert any("Message sent. ID: test_id" in m for m in caplog.messages)
-        assert output
+        mock_sqs_client.send_message_batch.side_effect = throttled_once
+        with (
+            patch("src.lambda_function._get_sqs_client", return_value=mock_sqs_client),
+            patch("src.lambda_function.time.sleep"),
+        ):
+            response = lambda_handler({"q": "test", "ref": "test_ref"}, {})
+        assert response["messagesSent"] == 2
+        assert response["metrics"]["sqsRetries"] == 1
 
-    def test_logs_client_error_and_returns_false(self, caplog, message):
-        sqs_client_error = Mock()
-        error_response = {"Error": {"Code": "AccessDenied", "Message": "test_message"}}
-        sqs_client_error.send_message.side_effect = ClientError(
-            error_response, "SendMessage"
-        )
+    def test_prints_embedded_metric_format_line(
+        self,
+        mock_session,
+        paged_responses,
+        monkeypatch,
+        mock_sqs_moto_and_url_in_env,
+        capsys,
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "test_lambda")
+        mock_session.get.side_effect = paged_responses(1)
+        response = lambda_handler({"q": "test", "ref": "test_ref"}, {})
+        [line] = capsys.readouterr().out.splitlines()
+        emf = json.loads(line)
+        [directive] = emf["_aws"]["CloudWatchMetrics"]
+        assert directive["Namespace"] == "GuardianStreaming"
+        assert directive["Dimensions"] == [["FunctionName"]]
+        assert emf["FunctionName"] == "test_lambda"
+        for metric in directive["Metrics"]:
+            assert metric["Name"] in emf
+        assert emf["FetchDuration"] == response["metrics"]["durationsMs"]["fetch"]
+        assert emf["MessagesSent"] == 2
+        assert emf["BytesPublished"] == response["metrics"]["bytesPublished"]
 
-        with caplog.at_level(logging.ERROR):
-            output = _send_to_SQS(message, "test_ref", sqs_client_error, "test_url")
-            assert any(
-                "Failed to send message: test_message" in m for m in caplog.messages
-            )
-        assert not output
+    def test_embedded_metrics_can_be_disabled(
+        self,
+        mock_session,
+        paged_responses,
+        monkeypatch,
+        mock_sqs_moto_and_url_in_env,
+        capsys,
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("METRICS_EMF", "0")
+        mock_session.get.side_effect = paged_responses(1)
+        response = lambda_handler({"q": "test", "ref": "test_ref"}, {})
+        assert "metrics" in response
+        assert capsys.readouterr().out == ""
 
-    def test_handles_unexpected_error(self, caplog, message):
-        sqs_client_error = Mock()
-        sqs_client_error.send_message.return_value = "unexpected_value"
-        with caplog.at_level(logging.ERROR):
-            output = _send_to_SQS(message, "test_ref", sqs_client_error, "test_url")
-            assert any(
-                "Unexpected error when sending message" in m for m in caplog.messages
+
+class TestHandlerProfiling:
+    def test_event_flag_returns_profile_and_writes_files(
+        self,
+        mock_session,
+        paged_responses,
+        monkeypatch,
+        tmp_path,
+        mock_sqs_moto_and_url_in_env,
+        caplog,
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+        monkeypatch.setenv("PROFILE_TOP", "5")
+        mock_session.get.side_effect = paged_responses(1)
+        context = Mock(
+            aws_request_id="test_request",
+            get_remaining_time_in_millis=Mock(return_value=60_000),
+        )
+        with caplog.at_level(logging.INFO):
+            response = lambda_handler(
+                {"q": "test", "ref": "test_ref", "profile": True}, context
             )
-        assert not output
+        profile = response["profile"]
+        assert response["messagesSent"] == 2
+        assert profile["peakMemoryBytes"] > 0
+        assert len(profile["hotspots"]) == 5
+        assert any("_handle" in spot["function"] for spot in profile["hotspots"])
+        assert len(profile["allocations"]) <= 5
+        assert profile["file"] == str(tmp_path / "profile-test_request.txt")
+        assert (tmp_path / "profile-test_request.prof").exists()
+        assert (
+            "Peak traced memory" in (tmp_path / "profile-test_request.txt").read_text()
+        )
+        assert any(m.startswith("Profile:") for m in caplog.messages)
+
+    def test_enabled_by_environment(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("PROFILE", "1")
+        monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+        response = lambda_handler({}, {})
+        assert response["statusCode"] == 400
+        assert "hotspots" in response["profile"]
+
+    def test_not_profiled_by_default(self):
+        with patch("src.lambda_function._profiled") as mock_profiled:
+            response = lambda_handler({}, {})
+        mock_profiled.assert_not_called()
+        assert "profile" not in response
+
+    def test_unwritable_directory_still_returns_profile(
+        self, monkeypatch, tmp_path, caplog
+    ):
+        monkeypatch.setenv("PROFILE_DIR", str(tmp_path / "missing"))
+        response = lambda_handler({"profile": True}, {})
+        assert "file" not in response["profile"]
+        assert any("Failed to write profile" in m for m in caplog.messages)
+
+
+class TestHandlerCorrelation:
+    def test_records_outcome_under_correlation_id(
+        self, mock_session, paged_responses, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        mock_session.get.side_effect = paged_responses(1)
+        event = {"q": "test", "ref": "test_ref", "correlation_id": "abc-123"}
+        response = lambda_handler(event, {})
+        assert response["correlationId"] == "abc-123"
+        record = json.loads(_get_state_store().get("invocation#abc-123"))
+        assert record["status"] == "complete"
+        assert record["statusCode"] == 200
+        assert (record["messagesSent"], record["messagesFailed"]) == (2, 0)
+        assert "finishedAt" in record
+
+    def test_records_failed_invocation(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("STATE_FILE", str(tmp_path / "state.json"))
+        event = {"q": "test", "ref": "test_ref", "correlation_id": "abc"}
+        response = lambda_handler(event, {})
+        assert response["statusCode"] == 500
+        record = json.loads(_get_state_store().get("invocation#abc"))
+        assert record["statusCode"] == 500
+        assert "api_key" in record["error"]
+
+    def test_records_invocation_that_raised(
+        self, mock_session, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        mock_session.get.side_effect = requests.exceptions.Timeout("timed out")
+        event = {"q": "test", "ref": "test_ref", "correlation_id": "abc"}
+        with pytest.raises(requests.exceptions.Timeout):
+            lambda_handler(event, {})
+        record = json.loads(_get_state_store().get("invocation#abc"))
+        assert (record["status"], record["statusCode"]) == ("failed", 500)
+        assert record["error"] == "Timeout: timed out"
 
-    def test_message_sent_to_queue(self, message, mock_sqs_moto_and_url_in_env):
+    @pytest.mark.parametrize("correlation_id", ["", "a b", "x" * 129, 12])
+    def test_invalid_correlation_id_returns_400(
+        self, correlation_id, monkeypatch, tmp_path
+    ):
+        monkeypatch.setenv("STATE_FILE", str(tmp_path / "state.json"))
+        event = {"q": "test", "ref": "test_ref", "correlation_id": correlation_id}
+        response = lambda_handler(event, {})
+        assert response["statusCode"] == 400
+        assert "correlation_id" in response["message"]
+        assert not (tmp_path / "state.json").exists()
+
+    def test_recording_failure_is_logged(self, caplog):
+        store = Mock()
+        store.put.side_effect = Exception("unavailable")
+        with patch("src.lambda_function._get_state_store", return_value=store):
+            response = lambda_handler({"correlation_id": "abc"}, {})
+        assert response["statusCode"] == 400
+        assert any("Failed to record invocation abc" in m for m in caplog.messages)
+
+
+class TestHandlerPagination:
+    def test_publishes_every_page_when_paginating(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = paged_responses(3)
+        event = {"q": "test", "ref": "test_ref", "paginate": True, "page_size": 2}
+        response = lambda_handler(event, {})
+        assert response["messagesSent"] == 6
+        assert len(response["messages"]) == 6
+        assert mock_session.get.call_count == 3
+
+    def test_fetches_first_page_only_by_default(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = paged_responses(3)
+        response = lambda_handler({"q": "test", "ref": "test_ref"}, {})
+        assert response["messagesSent"] == 2
+        assert mock_session.get.call_count == 1
+
+    @pytest.mark.parametrize("page_size", [0, 201, "ten", True])
+    def test_returns_400_for_invalid_page_size(self, page_size):
+        event = {"q": "test", "ref": "test_ref", "page_size": page_size}
+        response = lambda_handler(event, {})
+        assert response["statusCode"] == 400
+        assert "page_size" in response["message"]
+
+
+class TestPrefetched:
+    def test_yields_items_in_order(self):
+        assert list(_prefetched(iter(range(50)), 4)) == list(range(50))
+
+    def test_reads_at_most_depth_ahead(self):
+        taken = []
+
+        def items():
+            for i in range(20):
+                taken.append(i)
+                yield i
+
+        prefetched = _prefetched(items(), 3)
+        assert next(prefetched) == 0
+        time.sleep(0.2)
+        # One waiting in the queue per slot, plus one the thread holds
+        assert len(taken) <= 5
+        prefetched.close()
+
+    def test_raises_error_from_items(self):
+        def items():
+            yield 1
+            raise ValueError("bad page")
+
+        prefetched = _prefetched(items(), 2)
+        assert next(prefetched) == 1
+        with pytest.raises(ValueError, match="bad page"):
+            next(prefetched)
+
+    def test_closing_stops_and_closes_items(self):
+        closed = threading.Event()
+
+        def items():
+            try:
+                yield from range(1000)
+            finally:
+                closed.set()
+
+        prefetched = _prefetched(items(), 2)
+        next(prefetched)
+        prefetched.close()
+        assert closed.wait(timeout=2)
+
+    def test_depth_zero_reads_in_callers_thread(self):
+        threads = []
+
+        def items():
+            threads.append(threading.current_thread())
+            yield 1
+
+        assert list(_prefetched(items(), 0)) == [1]
+        assert threads == [threading.current_thread()]
+
+
+class TestHandlerPipeline:
+    @pytest.fixture(autouse=True)
+    def two_pages(self, mock_session, paged_responses, monkeypatch):
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("sqs_queue_url", "test_queue.fifo")
+        responses = paged_responses(2, page_size=10)
+        self.page_two_requested = threading.Event()
+
+        def get(url, **kwargs):
+            if "page=2" in url:
+                self.page_two_requested.set()
+            return responses.pop(0)
+
+        mock_session.get.side_effect = get
+
+    def publisher(self, wait: float) -> Mock:
+        """SQS client noting whether page 2 was requested by each publish"""
+        sqs_client = Mock()
+        self.overlapped = []
+
+        def send_message_batch(QueueUrl, Entries, **kwargs):
+            self.overlapped.append(self.page_two_requested.wait(timeout=wait))
+            return {
+                "Successful": [{"Id": e["Id"], "MessageId": e["Id"]} for e in Entries]
+            }
+
+        sqs_client.send_message_batch.side_effect = send_message_batch
+        return sqs_client
+
+    def test_next_page_downloads_while_batch_publishes(self):
+        set_sqs_client(self.publisher(wait=5))
+        event = {"q": "test", "ref": "test_ref", "paginate": True, "page_size": 10}
+        response = lambda_handler(event, {})
+        assert response["messagesSent"] == 20
+        assert self.overlapped[0] is True
+
+    def test_depth_zero_runs_stages_in_sequence(self, monkeypatch):
+        monkeypatch.setenv("PIPELINE_DEPTH", "0")
+        set_sqs_client(self.publisher(wait=0))
+        event = {"q": "test", "ref": "test_ref", "paginate": True, "page_size": 10}
+        response = lambda_handler(event, {})
+        assert response["messagesSent"] == 20
+        assert self.overlapped == [False, True]
+
+
+class TestHandlerJobs:
+    def test_runs_each_job_under_its_own_reference(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        event = {
+            "jobs": [
+                {"q": "one", "ref": "ref_one"},
+                {"q": "two", "d": "1997-01-01", "ref": "ref_two"},
+            ]
+        }
+        response = lambda_handler(event, {})
+        assert response["statusCode"] == 200
+        assert response["messagesSent"] == 4
+        assert [job["ref"] for job in response["jobs"]] == ["ref_one", "ref_two"]
+        for job in response["jobs"]:
+            assert job["messagesSent"] == 2
+            assert all(m["reference"] == job["ref"] for m in job["messages"])
+        urls = sorted(c.args[0] for c in mock_session.get.call_args_list)
+        assert urls == [
+            f"{BASE_URL}q=one&api-key=test_key",
+            f"{BASE_URL}q=two&from-date=1997-01-01&api-key=test_key",
+        ]
+
+    def test_publishes_with_job_reference_as_group_id(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        sqs_client = mock_sqs_moto_and_url_in_env
         sqs_url = os.environ.get("sqs_queue_url")
-        assert os.environ.get("AWS_ACCESS_KEY_ID") == "FOOBARKEY"
+        event = {"jobs": [{"q": "one", "ref": "ref_one"}]}
+        lambda_handler(event, {})
+        response = sqs_client.receive_message(
+            QueueUrl=sqs_url, MessageSystemAttributeNames=["MessageGroupId"]
+        )
+        assert response["Messages"][0]["Attributes"]["MessageGroupId"] == "ref_one"
+
+    def test_same_article_published_under_each_reference(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
         sqs_client = mock_sqs_moto_and_url_in_env
-        output = _send_to_SQS(message, "test_ref", sqs_client, sqs_url)
-        assert output
-        response = sqs_client.receive_message(QueueUrl=sqs_url)
-        assert response["Messages"][0]["Body"] == json.dumps(message)
+        sqs_url = os.environ.get("sqs_queue_url")
+        event = {"jobs": [{"q": "brexit", "ref": "a"}, {"q": "brexit", "ref": "b"}]}
+        assert lambda_handler(event, {})["messagesSent"] == 4
+        groups = []
+        while messages := sqs_client.receive_message(
+            QueueUrl=sqs_url,
+            MaxNumberOfMessages=10,
+            MessageSystemAttributeNames=["MessageGroupId"],
+        ).get("Messages"):
+            groups += [m["Attributes"]["MessageGroupId"] for m in messages]
+            sqs_client.delete_message_batch(
+                QueueUrl=sqs_url,
+                Entries=[
+                    {"Id": m["MessageId"], "ReceiptHandle": m["ReceiptHandle"]}
+                    for m in messages
+                ],
+            )
+        assert sorted(groups) == ["a", "a", "b", "b"]
 
+    def test_failed_job_reported_without_failing_others(
+        self,
+        mock_session,
+        paged_responses,
+        api_401_response,
+        monkeypatch,
+        mock_sqs_moto_and_url_in_env,
+    ):
+        monkeypatch.setenv("api_key", "test_key")
 
-@pytest.fixture(scope="function")
-def event_no_date():
-    return {"q": "test%20query", "ref": "test_ref"}
+        def get(url, **kwargs):
+            return api_401_response if "q=bad" in url else paged_responses(1)[0]
 
+        mock_session.get.side_effect = get
+        event = {"jobs": [{"q": "bad", "ref": "bad"}, {"q": "good", "ref": "good"}]}
+        response = lambda_handler(event, {})
+        bad, good = response["jobs"]
+        assert bad["statusCode"] == 502
+        assert "401 Unauthorized" in bad["error"]
+        assert good["statusCode"] == 200
+        assert response["messagesSent"] == 2
 
-@pytest.fixture(scope="function")
-def event_with_date():
-    return {"q": "test%20query", "d": "1997-01-01", "ref": "test_ref"}
+    def test_job_failing_on_later_page_reports_what_it_sent(
+        self,
+        mock_session,
+        paged_responses,
+        api_401_response,
+        monkeypatch,
+        mock_sqs_moto_and_url_in_env,
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        first_page, _ = paged_responses(2, page_size=12)
+        mock_session.get.side_effect = [first_page, api_401_response]
+        event = {"jobs": [{"q": "test", "ref": "test_ref"}], "paginate": True}
+        response = lambda_handler({**event, "page_size": 12}, {})
+        [job] = response["jobs"]
+        assert job["statusCode"] == 502
+        assert "401 Unauthorized" in job["error"]
+        assert job["messagesSent"] == response["messagesSent"] == 10
+        assert len(job["messages"]) == 10
 
+    @patch("src.lambda_function.MAX_JOB_WORKERS", 2)
+    @patch("src.lambda_function.ThreadPoolExecutor")
+    def test_thread_pool_is_bounded(
+        self, mock_executor, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        event = {"jobs": [{"q": str(i), "ref": str(i)} for i in range(5)]}
+        lambda_handler(event, {})
+        mock_executor.assert_called_with(max_workers=2)
 
-@pytest.fixture(scope="function")
-def api_200_response(response_body):
-    response = Mock(spec=requests.Response)
-    response.status_code = 200
-    response.ok = True
-    response.json.return_value = response_body
-    return response
+    @pytest.mark.parametrize(
+        "jobs,missing",
+        [([{"q": "test"}], "jobs[0].ref"), ([{"ref": "r"}], "jobs[0].q"), ([], "jobs")],
+    )
+    def test_returns_400_for_malformed_jobs(self, jobs, missing):
+        response = lambda_handler({"jobs": jobs}, {})
+        assert response["statusCode"] == 400
+        assert f"Missing required event key: {missing}" in response["message"]
 
 
-@pytest.fixture(scope="function")
-def response_body():
-    return json.loads("""{
-	"response": {
-		"status": "ok",
-		"userTier": "developer",
-		"total": 178192,
-		"startIndex": 1,
-		"pageSize": 1,
-		"currentPage": 1,
-		"pages": 17820,
-		"orderBy": "relevance",
-		"results": [
-			{
-				"id": "society/2025/apr/09/at-home-saliva-test-for-prostate-cancer-better-than-blood-test-study-suggests",
-				"type": "article",
-				"sectionId": "society",
-				"sectionName": "Society",
-				"webPublicationDate": "2025-04-09T21:00:09Z",
-				"webTitle": "At-home saliva test for prostate cancer better than blood test, study suggests",
-				"webUrl": "https://www.theguardian.com/society/2025/apr/09/at-home-saliva-test-for-prostate-cancer-better-than-blood-test-study-suggests",
-				"apiUrl": "https://content.guardianapis.com/society/2025/apr/09/at-home-saliva-test-for-prostate-cancer-better-than-blood-test-study-suggests",
-				"isHosted": false,
-				"pillarId": "pillar/news",
-				"pillarName": "News"
-			}
-		]
-	}
-}""")
+class TestCacheKey:
+    def test_removes_api_key(self):
+        key = _cache_key(_build_url("test", "secret_key", "1997-01-01"))
+        assert "secret_key" not in key
+        assert "api-key" not in key
 
+    def test_same_key_for_reordered_parameters(self):
+        assert _cache_key(f"{BASE_URL}q=test&page=2&api-key=a") == _cache_key(
+            f"{BASE_URL}page=2&api-key=b&q=test"
+        )
 
-@pytest.fixture(scope="function")
-def api_401_response():
-    response = Mock(spec=requests.Response)
-    response.status_code = 401
-    response.raise_for_status.side_effect = requests.exceptions.HTTPError(
-        "401 Unauthorized"
-    )
-    response.ok = False
-    response.json.return_value = {"message": "Unauthorized"}
-    return response
+    def test_different_key_for_different_query(self):
+        assert _cache_key(_build_url("one", "key")) != _cache_key(
+            _build_url("two", "key")
+        )
 
 
-@pytest.fixture(scope="function")
-def api_200_malformed_payload():
-    response = Mock(spec=requests.Response)
-    response.status_code = 200
-    response.ok = True
-    response.json.return_value = {"message": "test"}
-    return response
+class TestResponseCache:
+    def test_returns_stored_body_and_counts_hit(self):
+        cache = _ResponseCache(60, 10)
+        cache.put("key", {"results": []})
+        assert cache.get("key") == {"results": []}
+        assert (cache.hits, cache.misses) == (1, 0)
 
+    def test_counts_miss_for_unknown_key(self):
+        cache = _ResponseCache(60, 10)
+        assert cache.get("key") is None
+        assert (cache.hits, cache.misses) == (0, 1)
 
-@pytest.fixture(scope="function")
-def mock_sqs_client():
-    response = {
-        "MD5OfMessageBody": "string",
-        "MD5OfMessageAttributes": "string",
-        "MD5OfMessageSystemAttributes": "string",
+    @patch("src.lambda_function.time.time")
+    def test_entry_expires_after_ttl(self, mock_time):
+        cache = _ResponseCache(60, 10)
+        mock_time.return_value = 1000
+        cache.put("key", {"results": []})
+        mock_time.return_value = 1059
+        assert cache.get("key") is not None
+        mock_time.return_value = 1060
+        assert cache.get("key") is None
+
+    def test_evicts_least_recently_used(self):
+        cache = _ResponseCache(60, 2)
+        cache.put("a", {"results": ["a"]})
+        cache.put("b", {"results": ["b"]})
+        cache.get("a")
+        cache.put("c", {"results": ["c"]})
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+
+    def test_disk_layer_survives_new_instance(self, tmp_path):
+        _ResponseCache(60, 10, str(tmp_path)).put("key", {"results": ["a"]})
+        cache = _ResponseCache(60, 10, str(tmp_path))
+        assert cache.get("key") == {"results": ["a"]}
+        assert cache.hits == 1
+
+    def test_disk_layer_bounded_by_max_entries(self, tmp_path):
+        cache = _ResponseCache(60, 2, str(tmp_path))
+        for key in ["a", "b", "c"]:
+            cache.put(key, {"results": [key]})
+        assert len(list(tmp_path.glob("*.json"))) == 2
+
+
+class TestHandlerCache:
+    def test_repeated_query_served_from_cache(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("CACHE_TTL", "300")
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        first = lambda_handler({"q": "test", "ref": "test_ref"}, {})
+        second = lambda_handler({"q": "test", "ref": "test_ref"}, {})
+        assert mock_session.get.call_count == 1
+        assert first["cache"] == {"hits": 0, "misses": 1}
+        assert second["cache"] == {"hits": 1, "misses": 0}
+        assert second["messages"] == first["messages"]
+
+    def test_cache_disabled_by_default(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        lambda_handler({"q": "test", "ref": "test_ref"}, {})
+        response = lambda_handler({"q": "test", "ref": "test_ref"}, {})
+        assert mock_session.get.call_count == 2
+        assert "cache" not in response
+
+    def test_returns_500_for_invalid_cache_setting(self, monkeypatch):
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("sqs_queue_url", "test_url.fifo")
+        monkeypatch.setenv("CACHE_TTL", "five")
+        response = lambda_handler({"q": "test", "ref": "test_ref"}, {})
+        assert response["statusCode"] == 500
+        assert "CACHE_TTL must be an integer" in response["message"]
+
+
+class TestFileStateStore:
+    def test_returns_none_for_unknown_key(self, tmp_path):
+        assert FileStateStore(str(tmp_path / "state.json")).get("key") is None
+
+    def test_value_persists_across_instances(self, tmp_path):
+        path = str(tmp_path / "state.json")
+        FileStateStore(path).put("key", "value")
+        FileStateStore(path).put("other", "other_value")
+        store = FileStateStore(path)
+        assert store.get("key") == "value"
+        assert store.get("other") == "other_value"
+
+    def test_increment_returns_running_count(self, tmp_path):
+        store = FileStateStore(str(tmp_path / "state.json"))
+        assert store.increment("calls") == 1
+        assert store.increment("calls", 2) == 3
+
+
+class TestDynamoDBStateStore:
+    def test_returns_none_for_unknown_key(self, mock_state_table):
+        assert DynamoDBStateStore("test_state").get("key") is None
+
+    def test_put_value_returned_by_get(self, mock_state_table):
+        store = DynamoDBStateStore("test_state")
+        store.put("key", "value")
+        store.put("key", "new_value")
+        assert store.get("key") == "new_value"
+
+    def test_put_with_ttl_sets_expiry(self, mock_state_table):
+        store = DynamoDBStateStore("test_state")
+        with patch("src.lambda_function.time.time", return_value=1000):
+            store.put("key", "value", ttl=60)
+        item = store.client.get_item(TableName="test_state", Key={"key": {"S": "key"}})
+        assert item["Item"]["expires"] == {"N": "1060"}
+
+    def test_increment_returns_running_count(self, mock_state_table):
+        store = DynamoDBStateStore("test_state")
+        with patch("src.lambda_function.time.time", return_value=1000):
+            assert store.increment("calls", ttl=60) == 1
+        assert store.increment("calls", 2) == 3
+        item = store.client.get_item(
+            TableName="test_state", Key={"key": {"S": "calls"}}
+        )
+        assert item["Item"]["expires"] == {"N": "1060"}
+
+
+class TestGetStateStore:
+    def test_file_backend_by_default(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("STATE_FILE", str(tmp_path / "state.json"))
+        store = _get_state_store()
+        assert isinstance(store, FileStateStore)
+        assert store.path == str(tmp_path / "state.json")
+
+    def test_dynamodb_backend(self, monkeypatch, mock_state_table):
+        monkeypatch.setenv("STATE_BACKEND", "dynamodb")
+        monkeypatch.setenv("STATE_TABLE", "test_state")
+        store = _get_state_store()
+        assert isinstance(store, DynamoDBStateStore)
+        assert store.table_name == "test_state"
+
+    def test_raises_for_missing_table_name(self, monkeypatch):
+        monkeypatch.setenv("STATE_BACKEND", "dynamodb")
+        with pytest.raises(KeyError, match="STATE_TABLE"):
+            _get_state_store()
+
+    def test_raises_for_unknown_backend(self, monkeypatch):
+        monkeypatch.setenv("STATE_BACKEND", "redis")
+        with pytest.raises(ValueError, match="STATE_BACKEND"):
+            _get_state_store()
+
+
+class TestHandlerIncremental:
+    def test_stores_newest_publication_date_as_watermark(
+        self, mock_session, paged_responses, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        mock_session.get.side_effect = paged_responses(1)
+        event = {"q": "test", "ref": "test_ref", "incremental": True}
+        response = lambda_handler(event, {})
+        assert response["watermark"] == "2025-04-01T00:00:01Z"
+        assert _get_state_store().get("watermark#test_ref") == "2025-04-01T00:00:01Z"
+
+    def test_queries_from_watermark_and_skips_older_articles(
+        self, mock_session, paged_responses, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        _get_state_store().put("watermark#test_ref", "2025-04-01T00:00:00Z")
+        mock_session.get.side_effect = paged_responses(1)
+        event = {"q": "test", "d": "1997-01-01", "ref": "test_ref"}
+        response = lambda_handler({**event, "incremental": True}, {})
+        url = mock_session.get.call_args.args[0]
+        assert "from-date=2025-04-01&" in url
+        assert response["messagesSent"] == 1
+        assert response["messages"][0]["webPublicationDate"] == "2025-04-01T00:00:01Z"
+
+    def test_fetches_oldest_first_so_later_pages_are_not_skipped(
+        self, mock_session, paged_responses, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        oldest_first = paged_responses(2)
+
+        def search(url, **kwargs):
+            # By relevance, the newest article comes first on page 1
+            pages = oldest_first if "order-by=oldest" in url else oldest_first[::-1]
+            return pages[1] if "page=2" in url else pages[0]
+
+        mock_session.get.side_effect = search
+        event = {"q": "test", "ref": "test_ref", "incremental": True}
+        first = lambda_handler(event, {})
+        assert first["watermark"] == "2025-04-01T00:00:01Z"
+        second = lambda_handler({**event, "paginate": True}, {})
+        assert [m["webUrl"][-3:] for m in second["messages"]] == ["2/0", "2/1"]
+        assert second["watermark"] == "2025-04-02T00:00:01Z"
+
+    def test_watermark_kept_when_messages_fail(
+        self, mock_session, paged_responses, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        mock_session.get.side_effect = paged_responses(1)
+        event = {"q": "test", "ref": "test_ref", "incremental": True}
+        with patch("src.lambda_function._send_batch_to_SQS", return_value=(1, 1)):
+            response = lambda_handler(event, {})
+        assert response["watermark"] is None
+        assert _get_state_store().get("watermark#test_ref") is None
+
+    def test_watermarks_kept_per_reference(
+        self, mock_session, paged_responses, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        _get_state_store().put("watermark#one", "2030-01-01T00:00:00Z")
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        event = {
+            "jobs": [{"q": "test", "ref": "one"}, {"q": "test", "ref": "two"}],
+            "incremental": True,
+        }
+        one, two = lambda_handler(event, {})["jobs"]
+        assert one["messagesSent"] == 0
+        assert one["watermark"] == "2030-01-01T00:00:00Z"
+        assert two["messagesSent"] == 2
+        assert two["watermark"] == "2025-04-01T00:00:01Z"
+
+    def test_watermark_stored_in_dynamodb(
+        self,
+        mock_session,
+        paged_responses,
+        monkeypatch,
+        mock_sqs_moto_and_url_in_env,
+        mock_state_table,
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        monkeypatch.setenv("STATE_BACKEND", "dynamodb")
+        monkeypatch.setenv("STATE_TABLE", "test_state")
+        mock_session.get.side_effect = paged_responses(1)
+        event = {"q": "test", "ref": "test_ref", "incremental": True}
+        lambda_handler(event, {})
+        item = mock_state_table.get_item(
+            TableName="test_state", Key={"key": {"S": "watermark#test_ref"}}
+        )
+        assert item["Item"]["value"]["S"] == "2025-04-01T00:00:01Z"
+
+
+class TestPublishedIndex:
+    @pytest.mark.parametrize("mode", ["set", "bloom"])
+    def test_contains_added_urls_only(self, mode):
+        index = _PublishedIndex(mode, capacity=100)
+        index.add("https://a")
+        assert "https://a" in index
+        assert "https://b" not in index
+
+    @pytest.mark.parametrize("mode", ["set", "bloom"])
+    def test_round_trips_through_dumps_and_loads(self, mode):
+        index = _PublishedIndex(mode, capacity=100)
+        index.add("https://a")
+        loaded = _PublishedIndex.loads(index.dumps())
+        assert loaded.mode == mode
+        assert "https://a" in loaded
+        assert "https://b" not in loaded
+
+    def test_set_mode_drops_oldest_past_capacity(self):
+        index = _PublishedIndex("set", capacity=2)
+        for url in ["https://a", "https://b", "https://c"]:
+            index.add(url)
+        assert "https://a" not in index
+        assert "https://c" in index
+
+    def test_set_mode_stores_short_hashes(self):
+        index = _PublishedIndex("set")
+        index.add("https://a")
+        assert list(index.hashes) == [_url_hash("https://a")[:16]]
+
+    def test_bloom_mode_size_bounded_by_capacity(self):
+        index = _PublishedIndex("bloom", capacity=1000, error_rate=0.01)
+        for i in range(5000):
+            index.add(f"https://{i}")
+        assert len(index.bits) == (index.size + 7) // 8
+        assert len(index.bits) < 1300
+
+    def test_bloom_mode_false_positive_rate_near_target(self):
+        index = _PublishedIndex("bloom", capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            index.add(f"https://seen/{i}")
+        false_positives = sum(f"https://new/{i}" in index for i in range(2000))
+        assert false_positives < 60
+
+    @pytest.mark.parametrize("mode", ["set", "bloom"])
+    def test_update_merges_other_index(self, mode):
+        index, other = _PublishedIndex(mode, 100), _PublishedIndex(mode, 100)
+        index.add("https://a")
+        other.add("https://b")
+        index.update(other)
+        assert "https://a" in index
+        assert "https://b" in index
+
+    def test_raises_for_unknown_mode(self):
+        with pytest.raises(ValueError, match="DEDUP_MODE"):
+            _PublishedIndex("list")
+
+
+class TestShardedPublishedIndex:
+    def test_shard_count_follows_capacity(self):
+        assert len(_ShardedPublishedIndex.create("set", 100_000).shards) == 10
+        assert len(_ShardedPublishedIndex.create("set", 100).shards) == 1
+
+    @pytest.mark.parametrize("mode", ["set", "bloom"])
+    def test_full_shards_fit_in_a_dynamodb_item(self, mode):
+        index = _ShardedPublishedIndex.create(mode, 100_000)
+        for i in range(100_000):
+            index.add(f"https://www.theguardian.com/world/2025/apr/01/article-{i}")
+        sizes = [len(shard.dumps(shards=10).encode()) for shard in index.shards]
+        assert max(sizes) < 400_000
+        assert "https://www.theguardian.com/world/2025/apr/01/article-99999" in index
+
+    def test_round_trips_through_the_store(self, tmp_path):
+        store = FileStateStore(str(tmp_path / "state.json"))
+        index = _ShardedPublishedIndex.create("set", 30_000)
+        index.add("https://a")
+        _save_published_index(store, index)
+        loaded = _load_published_index(store)
+        assert len(loaded.shards) == 3
+        assert "https://a" in loaded
+        assert "https://b" not in loaded
+
+    def test_writes_changed_shards_only(self, tmp_path):
+        store = FileStateStore(str(tmp_path / "state.json"))
+        _save_published_index(store, _ShardedPublishedIndex.create("set", 30_000))
+        index = _load_published_index(store)
+        index.add("https://a")
+        store.put = Mock()
+        _save_published_index(store, index)
+        [call] = store.put.call_args_list
+        assert call.args[0] == f"published_urls#{index._shard('https://a')}"
+
+    def test_failed_save_is_logged_not_raised(self, caplog):
+        store = Mock()
+        store.get.return_value = None
+        store.put.side_effect = ClientError(
+            {"Error": {"Code": "ValidationException", "Message": "Item too large"}},
+            "PutItem",
+        )
+        with caplog.at_level(logging.ERROR):
+            _save_published_index(store, _ShardedPublishedIndex.create("set", 100))
+        assert any("Item too large" in m for m in caplog.messages)
+
+
+class TestHandlerDedup:
+    def test_skips_articles_published_by_earlier_invocation(
+        self, mock_session, paged_responses, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        event = {"q": "test", "ref": "test_ref", "dedup": True}
+        first = lambda_handler(event, {})
+        second = lambda_handler(event, {})
+        assert (first["messagesSent"], first["messagesSkipped"]) == (2, 0)
+        assert (second["messagesSent"], second["messagesSkipped"]) == (0, 2)
+
+    def test_failed_articles_not_recorded(
+        self, mock_session, paged_responses, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        event = {"q": "test", "ref": "test_ref", "dedup": True}
+        with patch("src.lambda_function._send_batch_to_SQS", return_value=(0, 2)):
+            lambda_handler(event, {})
+        response = lambda_handler(event, {})
+        assert response["messagesSent"] == 2
+
+    def test_records_articles_published_before_job_raised(
+        self,
+        mock_session,
+        paged_responses,
+        api_401_response,
+        state_env,
+        mock_sqs_moto_and_url_in_env,
+    ):
+        first_page, _ = paged_responses(2, page_size=12)
+        mock_session.get.side_effect = [first_page, api_401_response, first_page]
+        event = {"q": "test", "ref": "test_ref", "dedup": True, "page_size": 12}
+        with pytest.raises(requests.exceptions.HTTPError):
+            lambda_handler({**event, "paginate": True}, {})
+        response = lambda_handler(event, {})
+        assert (response["messagesSent"], response["messagesSkipped"]) == (2, 10)
+
+    def test_reports_skipped_per_job(
+        self, mock_session, paged_responses, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        lambda_handler({"q": "test", "ref": "one", "dedup": True}, {})
+        event = {
+            "jobs": [{"q": "test", "ref": "one"}, {"q": "test", "ref": "two"}],
+            "dedup": True,
+        }
+        response = lambda_handler(event, {})
+        assert response["messagesSkipped"] == 2
+        one, two = response["jobs"]
+        assert (one["messagesSent"], one["messagesSkipped"]) == (0, 2)
+        assert (two["messagesSent"], two["messagesSkipped"]) == (2, 0)
+
+    def test_bloom_mode_from_environment(
+        self,
+        mock_session,
+        paged_responses,
+        state_env,
+        monkeypatch,
+        mock_sqs_moto_and_url_in_env,
+    ):
+        monkeypatch.setenv("DEDUP_MODE", "bloom")
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        event = {"q": "test", "ref": "test_ref", "dedup": True}
+        lambda_handler(event, {})
+        assert lambda_handler(event, {})["messagesSkipped"] == 2
+        stored = json.loads(_get_state_store().get("published_urls#0"))
+        assert stored["mode"] == "bloom"
+
+    def test_publish_succeeds_when_index_cannot_be_saved(
+        self, mock_session, paged_responses, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        event = {"q": "test", "ref": "test_ref", "dedup": True}
+        with patch.object(FileStateStore, "put", side_effect=OSError("disk full")):
+            response = lambda_handler(event, {})
+        assert response["statusCode"] == 200
+        assert response["messagesSent"] == 2
+
+    def test_not_reported_when_dedup_off(
+        self, mock_session, paged_responses, state_env, mock_sqs_moto_and_url_in_env
+    ):
+        mock_session.get.side_effect = paged_responses(1)
+        response = lambda_handler({"q": "test", "ref": "test_ref"}, {})
+        assert "messagesSkipped" not in response
+
+
+class TestRateLimiter:
+    @patch("src.lambda_function.time.sleep")
+    def test_allows_burst_up_to_rate_without_waiting(self, mock_sleep):
+        limiter = _RateLimiter(5, 100)
+        for _ in range(5):
+            limiter.acquire()
+        mock_sleep.assert_not_called()
+        assert limiter.throttled_seconds == 0
+
+    @patch("src.lambda_function.time.sleep")
+    def test_waits_when_bucket_empty(self, mock_sleep):
+        limiter = _RateLimiter(1, 100)
+        limiter.acquire()
+        limiter.acquire()
+        wait = mock_sleep.call_args.args[0]
+        assert 0.9 < wait <= 1
+        assert limiter.throttled_seconds == wait
+
+    def test_raises_when_daily_budget_used(self):
+        limiter = _RateLimiter(1000, 2)
+        limiter.acquire()
+        limiter.acquire()
+        with pytest.raises(RuntimeError, match="Daily Guardian API budget of 2"):
+            limiter.acquire()
+
+    def test_daily_budget_resets_on_new_day(self):
+        limiter = _RateLimiter(1000, 1)
+        limiter.acquire()
+        limiter.day = "1997-01-01"
+        limiter.acquire()
+        assert limiter.used_today == 1
+
+    def test_daily_budget_shared_through_store(self, tmp_path):
+        store = FileStateStore(str(tmp_path / "state.json"))
+        _RateLimiter(1000, 2, store).acquire()
+        limiter = _RateLimiter(1000, 2, store)
+        limiter.acquire()
+        with pytest.raises(RuntimeError, match="Daily Guardian API budget of 2"):
+            limiter.acquire()
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        assert store.get(f"api_calls#{today}") == "3"
+
+    def test_slows_down_and_recovers(self):
+        limiter = _RateLimiter(8, 100)
+        limiter.slow_down()
+        limiter.slow_down()
+        assert limiter.rate == 2
+        for _ in range(10):
+            limiter.recover()
+        assert limiter.rate == 8
+
+    @patch("src.lambda_function.time.sleep")
+    def test_stops_rather_than_wait_past_time_left(self, mock_sleep):
+        limiter = _RateLimiter(1, 100)
+        limiter.acquire(lambda: 0.5)
+        with pytest.raises(_OutOfTime):
+            limiter.acquire(lambda: 0.5)
+        mock_sleep.assert_not_called()
+        assert limiter.used_today == 1
+        limiter.acquire(lambda: 5)
+        mock_sleep.assert_called_once()
+
+    def test_sleeps_without_holding_lock(self):
+        limiter = _RateLimiter(1, 100)
+        held = []
+
+        def sleep(seconds):
+            held.append(limiter._lock.locked())
+
+        with patch("src.lambda_function.time.sleep", sleep):
+            for _ in range(3):
+                limiter.acquire()
+        assert held == [False, False]
+
+    @patch("src.lambda_function.time.sleep")
+    def test_backoff_past_time_left_raises(self, mock_sleep):
+        with pytest.raises(_OutOfTime):
+            _RateLimiter(1, 100).backoff(10, lambda: 3)
+        mock_sleep.assert_not_called()
+
+    @patch("src.lambda_function.time.sleep")
+    def test_backoff_records_time_and_retries(self, mock_sleep):
+        limiter = _RateLimiter(1, 100)
+        limiter.backoff(1.5)
+        mock_sleep.assert_called_with(1.5)
+        assert (limiter.throttled_seconds, limiter.retries) == (1.5, 1)
+
+
+class TestGetRateLimiter:
+    def test_fractional_rate_from_environment(self, monkeypatch):
+        monkeypatch.setenv("GUARDIAN_RATE_PER_SECOND", "0.5")
+        assert _get_rate_limiter().max_rate == 0.5
+
+    def test_invalid_rate_raises(self, monkeypatch):
+        monkeypatch.setenv("GUARDIAN_RATE_PER_SECOND", "fast")
+        with pytest.raises(ValueError, match="GUARDIAN_RATE_PER_SECOND"):
+            _get_rate_limiter()
+
+    def test_counts_in_memory_with_file_backend(self, monkeypatch):
+        monkeypatch.delenv("STATE_BACKEND", raising=False)
+        assert _get_rate_limiter().store is None
+
+    def test_counts_in_table_with_dynamodb_backend(self, monkeypatch, mock_state_table):
+        monkeypatch.setenv("STATE_BACKEND", "dynamodb")
+        monkeypatch.setenv("STATE_TABLE", "test_state")
+        limiter = _get_rate_limiter()
+        assert isinstance(limiter.store, DynamoDBStateStore)
+        limiter.acquire()
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        item = mock_state_table.get_item(
+            TableName="test_state", Key={"key": {"S": f"api_calls#{today}"}}
+        )
+        assert item["Item"]["count"] == {"N": "1"}
+
+
+class TestRetryAfter:
+    def test_reads_delta_seconds(self):
+        assert _retry_after("3") == 3
+
+    @patch("src.lambda_function.time.time")
+    def test_reads_http_date(self, mock_time):
+        mock_time.return_value = 784111778
+        assert _retry_after("Sun, 06 Nov 1994 08:49:40 GMT") == 2
+
+    @pytest.mark.parametrize("value", [None, "", "soon"])
+    def test_returns_none_for_missing_or_invalid(self, value):
+        assert _retry_after(value) is None
+
+
+@patch("src.lambda_function.time.sleep")
+class TestGetWithBackoff:
+    def test_retries_429_honouring_retry_after(
+        self, mock_sleep, mock_session, api_200_response, status_response
+    ):
+        mock_session.get.side_effect = [
+            status_response(429, {"Retry-After": "2"}),
+            api_200_response,
+        ]
+        assert _get_with_backoff("test_url") is api_200_response
+        mock_sleep.assert_called_with(2.0)
+
+    @patch("src.lambda_function.random.uniform")
+    def test_retries_5xx_with_exponential_jittered_backoff(
+        self, mock_uniform, mock_sleep, mock_session, api_200_response, status_response
+    ):
+        mock_uniform.side_effect = lambda low, high: high
+        mock_session.get.side_effect = [
+            status_response(503),
+            status_response(500),
+            status_response(502),
+            api_200_response,
+        ]
+        _get_with_backoff("test_url")
+        delays = [c.args[0] for c in mock_sleep.call_args_list]
+        assert delays == [0.5, 1.0, 2.0]
+
+    def test_returns_last_response_after_max_retries(
+        self, mock_sleep, mock_session, status_response
+    ):
+        mock_session.get.side_effect = [status_response(503) for _ in range(5)]
+        response = _get_with_backoff("test_url")
+        assert response.status_code == 503
+        assert mock_session.get.call_count == 5
+
+    def test_gives_up_when_retry_after_too_long(
+        self, mock_sleep, mock_session, status_response
+    ):
+        mock_session.get.side_effect = [status_response(429, {"Retry-After": "3600"})]
+        assert _get_with_backoff("test_url").status_code == 429
+        mock_sleep.assert_not_called()
+
+    def test_does_not_retry_client_errors(
+        self, mock_sleep, mock_session, api_401_response
+    ):
+        mock_session.get.return_value = api_401_response
+        _get_with_backoff("test_url")
+        assert mock_session.get.call_count == 1
+
+    def test_handler_reports_throttle_metrics(
+        self,
+        mock_sleep,
+        mock_session,
+        paged_responses,
+        status_response,
+        monkeypatch,
+        mock_sqs_moto_and_url_in_env,
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = [
+            status_response(429, {"Retry-After": "1"}),
+            *paged_responses(1),
+        ]
+        response = lambda_handler({"q": "test", "ref": "test_ref"}, {})
+        assert response["messagesSent"] == 2
+        assert response["throttle"] == {"throttledSeconds": 1.0, "retries": 1}
+
+
+class TestTruncate:
+    def test_returns_short_text_unchanged(self):
+        assert _truncate("short text", 100) == "short text"
+
+    def test_cuts_at_word_boundary_within_limit(self):
+        output = _truncate("one two three four", 12)
+        assert output == "one two…"
+        assert len(output) <= 12
+
+    def test_cuts_mid_word_when_no_boundary(self):
+        output = _truncate("a" * 50, 10)
+        assert output == "a" * 9 + "…"
+
+
+class TestPreview:
+    def test_parse_results_adds_truncated_preview(self):
+        results = [
+            {
+                "webTitle": "t",
+                "webUrl": "u",
+                "webPublicationDate": "d",
+                "fields": {"bodyText": "word " * 1000},
+            }
+        ]
+        output = _parse_results(results, "test_ref", "bodyText", 100)
+        assert output[0]["content_preview"].startswith("word word")
+        assert len(output[0]["content_preview"]) <= 100
+
+    def test_parse_results_preview_empty_when_field_missing(self, response_body):
+        results = response_body["response"]["results"]
+        output = _parse_results(results, "test_ref", "trailText")
+        assert output[0]["content_preview"] == ""
+
+    def test_no_preview_by_default(self, response_body):
+        results = response_body["response"]["results"]
+        assert "content_preview" not in _parse_results(results, "test_ref")[0]
+
+    @pytest.mark.parametrize(
+        "preview,field", [(True, "bodyText"), ("trailText", "trailText")]
+    )
+    def test_handler_requests_field_in_search_call(
+        self,
+        preview,
+        field,
+        mock_session,
+        paged_responses,
+        monkeypatch,
+        mock_sqs_moto_and_url_in_env,
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = paged_responses(1)
+        event = {"q": "test", "ref": "test_ref", "preview": preview}
+        response = lambda_handler(event, {})
+        assert mock_session.get.call_count == 1
+        assert f"&show-fields={field}&" in mock_session.get.call_args.args[0]
+        assert all("content_preview" in m for m in response["messages"])
+
+    def test_handler_uses_preview_chars(
+        self, mock_session, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        body = {
+            "response": {
+                "pages": 1,
+                "results": [
+                    {
+                        "webTitle": "t",
+                        "webUrl": "u",
+                        "webPublicationDate": "d",
+                        "fields": {"bodyText": "x" * 100_000},
+                    }
+                ],
+            }
+        }
+        response = MagicMock(spec=requests.Response)
+        response.status_code = 200
+        response.iter_content.return_value = [json.dumps(body).encode()]
+        mock_session.get.return_value = response
+        event = {"q": "test", "ref": "r", "preview": True, "preview_chars": 250}
+        output = lambda_handler(event, {})
+        assert len(output["messages"][0]["content_preview"]) == 250
+        assert output["messagesSent"] == 1
+
+    @pytest.mark.parametrize(
+        "event_update",
+        [{"preview": "body"}, {"preview": True, "preview_chars": 40_001}],
+    )
+    def test_handler_returns_400_for_invalid_preview(self, event_update):
+        event = {"q": "test", "ref": "test_ref", **event_update}
+        assert lambda_handler(event, {})["statusCode"] == 400
+
+
+class TestParseResults:
+    def test_returns_list(self, response_body):
+        results = response_body["response"]["results"]
+        assert isinstance(_parse_results(results, "test_ref"), list)
+
+    def test_returns_mvp_keys_and_reference(self, response_body):
+        results = response_body["response"]["results"]
+        output = _parse_results(results, "test_ref")
+        expected_keys = ["webTitle", "webUrl", "webPublicationDate", "reference"]
+        assert len(output) > 0
+        for result in output:
+            for key in expected_keys:
+                assert key in list(result.keys())
+
+    def test_unwanted_keys_not_returned(self, response_body):
+        results = response_body["response"]["results"]
+        output = _parse_results(results, "test_ref")
+        unwanted_keys = [
+            "id",
+            "type",
+            "sectionId",
+            "sectionName",
+            "apiUrl",
+            "isHosted",
+            "pillarId",
+            "pillarName",
+        ]
+        assert len(output) > 0
+        for result in output:
+            for key in unwanted_keys:
+                assert key not in list(result.keys())
+
+
+class TestGetSqsClient:
+    @mock_aws
+    def test_returns_boto3_client(self):
+        client = _get_sqs_client()
+        assert client.__class__.__name__ == "SQS"
+
+    @mock_aws
+    def test_client_reused_between_calls(self):
+        assert _get_sqs_client() is _get_sqs_client()
+
+    def test_set_sqs_client_replaces_client(self):
+        sink = Mock()
+        set_sqs_client(sink)
+        assert _get_sqs_client() is sink
+
+    @mock_aws
+    def test_client_uses_tuned_config(self):
+        config = _get_sqs_client().meta.config
+        assert config.connect_timeout == 2
+        assert config.max_pool_connections >= 10
+
+
+class TestMessageGroup:
+    def test_reference_alone_when_not_sharded(self, message):
+        assert _message_group(message, "ref", None, 8) == ("ref", None)
+
+    def test_hash_shard_is_stable_and_in_range(self):
+        groups = {
+            _message_group({"webUrl": f"url_{i}"}, "ref", "hash", 4) for i in range(100)
+        }
+        assert {shard for _, shard in groups} == {"0", "1", "2", "3"}
+        assert all(group == f"ref#{shard}" for group, shard in groups)
+        message = {"webUrl": "url_0"}
+        assert _message_group(message, "ref", "hash", 4) == _message_group(
+            dict(message), "ref", "hash", 4
+        )
+
+    def test_day_shard_is_publication_date(self):
+        message = {"webUrl": "u", "webPublicationDate": "2025-04-01T10:00:00Z"}
+        assert _message_group(message, "ref", "day", 8) == (
+            "ref#2025-04-01",
+            "2025-04-01",
+        )
+
+
+class TestHandlerSharding:
+    def test_sharded_groups_and_shard_attribute(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = paged_responses(1)
+        event = {"q": "test", "ref": "test_ref", "shard": "day"}
+        assert lambda_handler(event, {})["messagesSent"] == 2
+        sqs = mock_sqs_moto_and_url_in_env
+        received = sqs.receive_message(
+            QueueUrl=os.environ["sqs_queue_url"],
+            MaxNumberOfMessages=10,
+            MessageSystemAttributeNames=["MessageGroupId"],
+            MessageAttributeNames=["All"],
+        )
+        message = received["Messages"][0]
+        assert message["Attributes"]["MessageGroupId"] == "test_ref#2025-04-01"
+        assert message["MessageAttributes"]["shard"]["StringValue"] == "2025-04-01"
+
+    @pytest.mark.parametrize(
+        "options",
+        [
+            {"shard": "reference"},
+            {"shard": "hash", "shards": 0},
+            {"shard": "hash", "envelope": True},
+        ],
+    )
+    def test_invalid_shard_options_return_400(self, options):
+        response = lambda_handler({"q": "test", "ref": "test_ref", **options}, {})
+        assert response["statusCode"] == 400
+
+
+@patch("src.lambda_function.time.sleep")
+class TestSendBatchToSQS:
+    def test_sends_messages_in_batches_of_ten(self, mock_sleep, mock_sqs_client):
+        messages = [{"webUrl": f"url_{i}"} for i in range(25)]
+        _send_batch_to_SQS(messages, "test_ref", mock_sqs_client, "test_url")
+        calls = mock_sqs_client.send_message_batch.call_args_list
+        assert [len(c.kwargs["Entries"]) for c in calls] == [10, 10, 5]
+        entry = calls[0].kwargs["Entries"][0]
+        assert calls[0].kwargs["QueueUrl"] == "test_url"
+        assert entry["MessageBody"] == json_dumps(messages[0])
+        assert entry["MessageGroupId"] == "test_ref"
+        assert entry["MessageDeduplicationId"] == _url_hash("test_ref|url_0")
+        assert "MessageAttributes" not in entry
+
+    def test_hash_sharded_entries_carry_their_shard(self, mock_sleep, mock_sqs_client):
+        messages = [{"webUrl": f"url_{i}"} for i in range(10)]
+        _send_batch_to_SQS(
+            messages, "test_ref", mock_sqs_client, "url", shard_by="hash", shards=3
+        )
+        [call] = mock_sqs_client.send_message_batch.call_args_list
+        for entry in call.kwargs["Entries"]:
+            shard = entry["MessageAttributes"]["shard"]["StringValue"]
+            assert shard in {"0", "1", "2"}
+            assert entry["MessageGroupId"] == f"test_ref#{shard}"
+
+    def test_calls_on_sent_with_message_and_id(self, mock_sleep, mock_sqs_client):
+        messages = [{"webUrl": f"url_{i}"} for i in range(12)]
+        sent = []
+        _send_batch_to_SQS(
+            messages,
+            "test_ref",
+            mock_sqs_client,
+            "url",
+            on_sent=lambda m, message_id: sent.append((m, message_id)),
+        )
+        assert sent[0] == (messages[0], "test_id_0")
+        assert sent[11] == (messages[11], "test_id_11")
+
+    def test_returns_sent_and_failed_counts(self, mock_sleep, mock_sqs_client):
+        messages = [{"webUrl": f"url_{i}"} for i in range(12)]
+        output = _send_batch_to_SQS(messages, "test_ref", mock_sqs_client, "url")
+        assert output == (12, 0)
+
+    def test_retries_only_failed_entries(self, mock_sleep, message):
+        sqs_client = Mock()
+        sqs_client.send_message_batch.side_effect = [
+            {
+                "Successful": [{"Id": "0", "MessageId": "a"}],
+                "Failed": [{"Id": "1", "Code": "InternalError", "SenderFault": False}],
+            },
+            {"Successful": [{"Id": "1", "MessageId": "b"}]},
+        ]
+        output = _send_batch_to_SQS(
+            [message, message], "test_ref", sqs_client, "test_url"
+        )
+        assert output == (2, 0)
+        retry_entries = sqs_client.send_message_batch.call_args_list[1].kwargs[
+            "Entries"
+        ]
+        assert [e["Id"] for e in retry_entries] == ["1"]
+
+    def test_does_not_retry_sender_faults(self, mock_sleep, message, caplog):
+        sqs_client = Mock()
+        sqs_client.send_message_batch.return_value = {
+            "Successful": [{"Id": "0", "MessageId": "a"}],
+            "Failed": [
+                {
+                    "Id": "1",
+                    "Code": "InvalidParameterValue",
+                    "Message": "test_message",
+                    "SenderFault": True,
+                }
+            ],
+        }
+        with caplog.at_level(logging.ERROR):
+            output = _send_batch_to_SQS(
+                [message, message], "test_ref", sqs_client, "test_url"
+            )
+            assert any(
+                "Failed to send message: test_message" in m for m in caplog.messages
+            )
+        assert output == (1, 1)
+        assert sqs_client.send_message_batch.call_count == 1
+
+    def test_counts_entries_failed_after_retries(self, mock_sleep, message, caplog):
+        sqs_client = Mock()
+        error_response = {"Error": {"Code": "Throttling", "Message": "test_message"}}
+        sqs_client.send_message_batch.side_effect = ClientError(
+            error_response, "SendMessageBatch"
+        )
+        with caplog.at_level(logging.ERROR):
+            output = _send_batch_to_SQS(
+                [message] * 3, "test_ref", sqs_client, "test_url"
+            )
+            assert any(
+                "Failed to send message batch: test_message" in m
+                for m in caplog.messages
+            )
+        assert output == (0, 3)
+        assert sqs_client.send_message_batch.call_count == 3
+
+    def test_handles_unexpected_error(self, mock_sleep, message, caplog):
+        sqs_client = Mock()
+        sqs_client.send_message_batch.return_value = "unexpected_value"
+        with caplog.at_level(logging.ERROR):
+            output = _send_batch_to_SQS([message], "test_ref", sqs_client, "url")
+            assert any(
+                "Unexpected error when sending message batch" in m
+                for m in caplog.messages
+            )
+        assert output == (0, 1)
+
+    def test_messages_sent_to_queue(self, mock_sleep, mock_sqs_moto_and_url_in_env):
+        sqs_url = os.environ.get("sqs_queue_url")
+        sqs_client = mock_sqs_moto_and_url_in_env
+        messages = [{"webUrl": f"url_{i}"} for i in range(15)]
+        output = _send_batch_to_SQS(messages, "test_ref", sqs_client, sqs_url)
+        assert output == (15, 0)
+        attributes = sqs_client.get_queue_attributes(
+            QueueUrl=sqs_url, AttributeNames=["ApproximateNumberOfMessages"]
+        )
+        assert attributes["Attributes"]["ApproximateNumberOfMessages"] == "15"
+
+    def test_splits_batches_by_total_size(self, mock_sleep, mock_sqs_client):
+        messages = [{"webUrl": f"url_{i}", "body": "x" * 100_000} for i in range(4)]
+        output = _send_batch_to_SQS(messages, "test_ref", mock_sqs_client, "url")
+        assert output == (4, 0)
+        calls = mock_sqs_client.send_message_batch.call_args_list
+        assert [len(c.kwargs["Entries"]) for c in calls] == [2, 2]
+        for call in calls:
+            size = sum(len(e["MessageBody"]) for e in call.kwargs["Entries"])
+            assert size <= SQS_MAX_BATCH_BYTES
+
+
+class TestEnvelopes:
+    def test_packs_articles_into_one_envelope(self):
+        articles = [{"webUrl": f"url_{i}"} for i in range(5)]
+        [(envelope, carried)] = list(_pack_envelopes(articles, 256 * 1024))
+        assert carried == articles
+        assert envelope == {
+            "envelope": 1,
+            "encoding": "json",
+            "count": 5,
+            "articles": articles,
+        }
+
+    def test_envelopes_stay_within_max_bytes(self):
+        articles = [{"webUrl": f"url_{i}", "body": "x" * 300} for i in range(20)]
+        packed = list(_pack_envelopes(articles, 1000))
+        assert len(packed) > 1
+        assert [a for _, carried in packed for a in carried] == articles
+        for envelope, carried in packed:
+            assert len(json.dumps(envelope)) <= 1000
+            assert envelope["count"] == len(carried)
+
+    def test_oversized_article_gets_own_envelope(self):
+        articles = [{"webUrl": "big", "body": "x" * 2000}, {"webUrl": "small"}]
+        packed = list(_pack_envelopes(articles, 1000))
+        assert [carried for _, carried in packed] == [[articles[0]], [articles[1]]]
+
+    def test_compressed_envelope_round_trips(self):
+        articles = [{"webUrl": f"url_{i}", "body": "text " * 200} for i in range(50)]
+        packed = list(_pack_envelopes(articles, 4096, compress=True))
+        unpacked = []
+        for envelope, carried in packed:
+            assert envelope["encoding"] == "gzip+base64"
+            assert len(json.dumps(envelope)) <= 4096
+            assert unpack_envelope(json.dumps(envelope)) == carried
+            unpacked.extend(carried)
+        assert unpacked == articles
+        assert len(packed) < len(list(_pack_envelopes(articles, 4096)))
+
+    def test_unpack_plain_message(self, message):
+        assert unpack_envelope(json.dumps(message)) == [message]
+
+    def test_unpack_rejects_newer_version(self):
+        body = {"envelope": 2, "encoding": "json", "count": 0, "articles": []}
+        with pytest.raises(ValueError, match="version"):
+            unpack_envelope(body)
+
+    def test_unpack_rejects_unknown_encoding(self):
+        body = {"envelope": 1, "encoding": "zstd", "count": 0, "articles": ""}
+        with pytest.raises(ValueError, match="encoding"):
+            unpack_envelope(body)
+
+
+class TestHandlerEnvelopes:
+    def test_sends_one_envelope_per_batch_of_articles(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        event = {"q": "test", "ref": "test_ref", "envelope": True, "compress": True}
+        response = lambda_handler(event, {})
+        assert response["messagesSent"] == 2
+        assert response["envelopesSent"] == 1
+        sqs = mock_sqs_moto_and_url_in_env
+        received = sqs.receive_message(QueueUrl=os.environ["sqs_queue_url"])
+        [body] = [m["Body"] for m in received["Messages"]]
+        assert unpack_envelope(body) == response["messages"]
+
+    def test_failed_envelope_counts_its_articles(
+        self, mock_session, paged_responses, monkeypatch, mock_sqs_moto_and_url_in_env
+    ):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = lambda url, **kwargs: paged_responses(1)[0]
+        event = {"q": "test", "ref": "test_ref", "envelope": True}
+        with patch("src.lambda_function._send_batch_to_SQS", return_value=(0, 1)):
+            response = lambda_handler(event, {})
+        assert (response["messagesSent"], response["messagesFailed"]) == (0, 2)
+        assert response["envelopesSent"] == 0
+
+    def test_invalid_envelope_max_bytes_returns_400(self):
+        event = {"q": "test", "ref": "test_ref", "envelope_max_bytes": 10**9}
+        response = lambda_handler(event, {})
+        assert response["statusCode"] == 400
+
+
+class TestHandlerResponseModes:
+    @pytest.fixture(autouse=True)
+    def six_articles(self, mock_session, paged_responses, monkeypatch):
+        monkeypatch.setenv("api_key", "test_key")
+        mock_session.get.side_effect = paged_responses(3)
+
+    def event(self, **options):
+        return {"q": "test", "ref": "test_ref", "paginate": True, **options}
+
+    def test_full_response_by_default(self, mock_sqs_moto_and_url_in_env):
+        response = lambda_handler(self.event(), {})
+        assert len(response["messages"]) == 6
+        assert "messagesOmitted" not in response
+
+    def test_summary_returns_counts_only(self, mock_sqs_moto_and_url_in_env):
+        response = lambda_handler(self.event(response="summary"), {})
+        assert response["messagesSent"] == 6
+        assert "messages" not in response
+
+    def test_ids_returns_web_urls(self, mock_sqs_moto_and_url_in_env):
+        response = lambda_handler(self.event(response="ids"), {})
+        assert response["messages"] == [
+            f"https://www.theguardian.com/{page}/{i}"
+            for page in range(1, 4)
+            for i in range(2)
+        ]
+
+    def test_sample_returns_first_messages_and_omitted_count(
+        self, mock_sqs_moto_and_url_in_env
+    ):
+        response = lambda_handler(self.event(response="sample", sample_size=3), {})
+        assert [m["webTitle"] for m in response["messages"]] == [
+            "title 1-0",
+            "title 1-1",
+            "title 2-0",
+        ]
+        assert response["messagesOmitted"] == 3
+        assert response["messagesSent"] == 6
+
+    def test_applies_to_each_job(self, mock_sqs_moto_and_url_in_env):
+        event = {"jobs": [{"q": "test", "ref": "test_ref"}], "response": "summary"}
+        response = lambda_handler(event, {})
+        assert response["jobs"][0]["messagesSent"] == 2
+        assert "messages" not in response["jobs"][0]
+
+    @pytest.mark.parametrize(
+        "options", [{"response": "all"}, {"response": "sample", "sample_size": 0}]
+    )
+    def test_invalid_response_options_return_400(self, options):
+        response = lambda_handler(self.event(**options), {})
+        assert response["statusCode"] == 400
+
+
+class TestHandlerContinuation:
+    @pytest.fixture(autouse=True)
+    def three_pages(self, mock_session, paged_responses, state_env):
+        responses = paged_responses(3)
+
+        def get(url, **kwargs):
+            page = dict(parse_qsl(urlsplit(url).query)).get("page", "1")
+            return responses[int(page) - 1]
+
+        mock_session.get.side_effect = get
+
+    def event(self, **options):
+        return {"q": "test", "ref": "test_ref", "paginate": True, **options}
+
+    def context(self, checks: int):
+        """Lambda context that runs out of time after a number of checks"""
+        remaining = iter([60_000] * checks)
+        return Mock(get_remaining_time_in_millis=lambda: next(remaining, 0))
+
+    def test_stops_before_timeout_and_resumes_from_token(
+        self, mock_session, mock_sqs_moto_and_url_in_env
+    ):
+        # Checked before each page and each result: page 1, 2 results, page 2, 1 result
+        first = lambda_handler(self.event(), self.context(5))
+        assert first["messagesSent"] == 3
+        assert first["continuation"]
+        second = lambda_handler(self.event(continuation=first["continuation"]), {})
+        assert "continuation" not in second
+        assert [m["webTitle"] for m in second["messages"]] == [
+            "title 2-1",
+            "title 3-0",
+            "title 3-1",
+        ]
+        assert "page=2" in mock_session.get.call_args_list[2].args[0]
+
+    def test_stops_before_requesting_next_page(
+        self, mock_session, mock_sqs_moto_and_url_in_env
+    ):
+        response = lambda_handler(self.event(), self.context(3))
+        assert response["messagesSent"] == 2
+        assert mock_session.get.call_count == 1
+
+    def test_watermark_advances_once_continuations_finish(
+        self, mock_sqs_moto_and_url_in_env
+    ):
+        event = self.event(incremental=True)
+        first = lambda_handler(event, self.context(5))
+        assert first["watermark"] is None
+        assert _get_state_store().get("watermark#test_ref") is None
+        second = lambda_handler({**event, "continuation": first["continuation"]}, {})
+        assert second["watermark"] == "2025-04-03T00:00:01Z"
+        assert _get_state_store().get("watermark#test_ref") == "2025-04-03T00:00:01Z"
+
+    def test_each_job_gets_its_own_token(self, mock_sqs_moto_and_url_in_env):
+        event = {"jobs": [{"q": "test", "ref": "test_ref"}], "paginate": True}
+        response = lambda_handler(event, self.context(5))
+        assert response["jobs"][0]["continuation"]
+
+    @patch("src.lambda_function.time.sleep")
+    def test_stops_rather_than_retry_past_deadline(
+        self,
+        mock_sleep,
+        mock_session,
+        paged_responses,
+        status_response,
+        mock_sqs_moto_and_url_in_env,
+    ):
+        mock_session.get.side_effect = [
+            status_response(503, {"Retry-After": "10"}),
+            *paged_responses(1),
+        ]
+        # 5s left, 3s of it before the margin
+        context = Mock(get_remaining_time_in_millis=lambda: 5000)
+        first = lambda_handler(self.event(), context)
+        assert first["messagesSent"] == 0
+        assert first["continuation"]
+        mock_sleep.assert_not_called()
+        second = lambda_handler(self.event(continuation=first["continuation"]), {})
+        assert second["messagesSent"] == 2
+
+    @pytest.mark.parametrize("token", ["not a token", 12])
+    def test_invalid_token_returns_400(self, token):
+        response = lambda_handler(self.event(continuation=token), {})
+        assert response["statusCode"] == 400
+        assert "continuation" in response["message"]
+
+    def test_token_for_another_job_returns_400(self, mock_sqs_moto_and_url_in_env):
+        first = lambda_handler(self.event(), self.context(5))
+        event = self.event(ref="other_ref", continuation=first["continuation"])
+        response = lambda_handler(event, {})
+        assert response["statusCode"] == 400
+        assert "other_ref" in response["message"]
+
+
+class TestRelevance:
+    def test_terms_drop_stopwords_and_plurals(self):
+        assert _terms("The Results of UK elections, 2025") == [
+            "result",
+            "uk",
+            "election",
+            "2025",
+        ]
+
+    def test_scores_matching_titles_above_others(self):
+        profile = _RelevanceProfile("climate%20change", ["emissions"])
+        scores = profile.score(
+            [
+                {"webTitle": "Climate change: global temperatures rise"},
+                {"webTitle": "Premier League results"},
+                {"webTitle": "UK emissions fall", "content_preview": "Coal use fell"},
+            ]
+        )
+        assert scores[0] > scores[2] > scores[1] == 0
+        assert all(0 <= score <= 1 for score in scores)
+
+    def test_long_unrelated_preview_lowers_score(self):
+        profile = _RelevanceProfile("climate")
+        title = {"webTitle": "Climate policy"}
+        padded = {**title, "content_preview": "cabinet reshuffle news " * 50}
+        assert profile.score([title, padded])[1] < profile.score([title])[0]
+
+    def test_empty_profile_keeps_everything(self):
+        assert _RelevanceProfile("the%20*").score([{"webTitle": "x"}]) == [1.0]
+
+    def test_weights_cached_per_query_and_keywords(self):
+        weights = _get_profile_weights("climate", ())
+        assert _get_profile_weights("climate", ()) is weights
+        assert _get_profile_weights("climate", ("coal",)) is not weights
+        assert _RelevanceProfile("climate").weights is weights
+
+    def test_document_frequencies_not_shared_between_profiles(self):
+        batch = [{"webTitle": "Climate policy"}, {"webTitle": "Policy review"}]
+        expected = _RelevanceProfile("climate").score(batch)
+        _RelevanceProfile("climate").score([{"webTitle": "Climate talks"}] * 50)
+        assert _RelevanceProfile("climate").score(batch) == expected
+
+
+class TestHandlerRelevance:
+    @pytest.fixture(autouse=True)
+    def search_results(self, mock_session, monkeypatch):
+        monkeypatch.setenv("api_key", "test_key")
+        titles = [
+            "Climate change report warns of rising seas",
+            "Premier League: five things we learned",
+            "Emissions targets missed again",
+        ]
+        body = {
+            "response": {
+                "pages": 1,
+                "results": [
+                    {
+                        "webTitle": title,
+                        "webUrl": f"https://www.theguardian.com/{i}",
+                        "webPublicationDate": f"2025-04-01T00:00:0{i}Z",
+                    }
+                    for i, title in enumerate(titles)
+                ],
+            }
+        }
+        response = MagicMock(spec=requests.Response)
+        response.status_code = 200
+        response.iter_content.return_value = [json.dumps(body).encode()]
+        mock_session.get.return_value = response
+
+    def test_discards_articles_below_threshold(self, mock_sqs_moto_and_url_in_env):
+        event = {"q": "climate%20change", "ref": "test_ref", "relevance": True}
+        response = lambda_handler(event, {})
+        assert [m["webTitle"] for m in response["messages"]] == [
+            "Climate change report warns of rising seas"
+        ]
+        assert response["messagesSent"] == 1
+        assert response["messagesDiscarded"] == 2
+
+    def test_keywords_widen_the_profile(self, mock_sqs_moto_and_url_in_env):
+        event = {
+            "jobs": [{"q": "climate", "ref": "test_ref", "keywords": ["emissions"]}],
+            "relevance": 0.1,
+        }
+        response = lambda_handler(event, {})
+        assert response["messagesSent"] == 2
+        assert response["messagesDiscarded"] == 1
+
+    def test_publishes_everything_without_relevance(self, mock_sqs_moto_and_url_in_env):
+        response = lambda_handler({"q": "climate", "ref": "test_ref"}, {})
+        assert response["messagesSent"] == 3
+        assert "messagesDiscarded" not in response
+
+    @pytest.mark.parametrize(
+        "options", [{"relevance": 2}, {"relevance": "high"}, {"keywords": "coal"}]
+    )
+    def test_invalid_relevance_options_return_400(self, options):
+        response = lambda_handler({"q": "q", "ref": "test_ref", **options}, {})
+        assert response["statusCode"] == 400
+
+
+class TestJsonBackend:
+    @pytest.mark.parametrize("backend", ["orjson", "ujson"])
+    def test_output_byte_identical_to_stdlib(self, backend, json_documents):
+        pytest.importorskip(backend)
+        name, dumps, loads = _load_json_backend(backend)
+        _, stdlib_dumps, _ = _load_json_backend("json")
+        assert name == backend
+        for document in json_documents:
+            assert dumps(document).encode() == stdlib_dumps(document).encode()
+            assert loads(dumps(document)) == document
+
+    def test_stdlib_output_is_compact_utf8(self):
+        _, dumps, _ = _load_json_backend("json")
+        assert dumps({"a": ["é", "/"], "b": 1}) == '{"a":["é","/"],"b":1}'
+
+    def test_missing_backend_falls_back_to_stdlib(self, caplog):
+        with patch(
+            "src.lambda_function.importlib.import_module", side_effect=ImportError
+        ):
+            name, _, loads = _load_json_backend("orjson")
+        assert name == "json"
+        assert loads is json.loads
+        assert "JSON backend orjson not installed" in caplog.text
+
+    def test_unknown_backend_chosen_automatically(self, caplog):
+        name, _, _ = _load_json_backend("simplejson")
+        assert name in ("orjson", "ujson", "json")
+        assert "Unknown JSON_BACKEND simplejson" in caplog.text
+
+
+@pytest.fixture(autouse=True)
+def reset_resources():
+    _reset_resources()
+    yield
+    _reset_resources()
+
+
+@pytest.fixture(autouse=True)
+def unthrottled_api(monkeypatch):
+    monkeypatch.setenv("GUARDIAN_RATE_PER_SECOND", "1000")
+
+
+@pytest.fixture(scope="function")
+def mock_session():
+    with patch("src.lambda_function._get_http_session") as mock_get_session:
+        yield mock_get_session.return_value
+
+
+@pytest.fixture(scope="function")
+def paged_responses():
+    def make_responses(pages, page_size=2):
+        responses = []
+        for page in range(1, pages + 1):
+            results = [
+                {
+                    "webTitle": f"title {page}-{i}",
+                    "webUrl": f"https://www.theguardian.com/{page}/{i}",
+                    "webPublicationDate": f"2025-04-{page:02}T00:00:0{i}Z",
+                }
+                for i in range(page_size)
+            ]
+            body = {
+                "response": {"currentPage": page, "pages": pages, "results": results}
+            }
+            response = MagicMock(spec=requests.Response)
+            response.status_code = 200
+            response.json.return_value = body
+            response.iter_content.return_value = [json.dumps(body).encode()]
+            responses.append(response)
+        return responses
+
+    return make_responses
+
+
+@pytest.fixture(scope="function")
+def state_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("api_key", "test_key")
+    monkeypatch.setenv("STATE_FILE", str(tmp_path / "state.json"))
+
+
+@pytest.fixture(scope="function")
+def mock_state_table():
+    with mock_aws():
+        conn = boto3.client("dynamodb")
+        conn.create_table(
+            TableName="test_state",
+            KeySchema=[{"AttributeName": "key", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "key", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield conn
+
+
+@pytest.fixture(scope="function")
+def event_no_date():
+    return {"q": "test%20query", "ref": "test_ref"}
+
+
+@pytest.fixture(scope="function")
+def event_with_date():
+    return {"q": "test%20query", "d": "1997-01-01", "ref": "test_ref"}
+
+
+@pytest.fixture(scope="function")
+def api_200_response(response_body):
+    response = MagicMock(spec=requests.Response)
+    response.status_code = 200
+    response.ok = True
+    response.json.return_value = response_body
+    response.iter_content.return_value = [json.dumps(response_body).encode()]
+    return response
+
+
+@pytest.fixture(scope="function")
+def response_body():
+    return json.loads("""{
+	"response": {
+		"status": "ok",
+		"userTier": "developer",
+		"total": 178192,
+		"startIndex": 1,
+		"pageSize": 1,
+		"currentPage": 1,
+		"pages": 17820,
+		"orderBy": "relevance",
+		"results": [
+			{
+				"id": "society/2025/apr/09/at-home-saliva-test-for-prostate-cancer-better-than-blood-test-study-suggests",
+				"type": "article",
+				"sectionId": "society",
+				"sectionName": "Society",
+				"webPublicationDate": "2025-04-09T21:00:09Z",
+				"webTitle": "At-home saliva test for prostate cancer better than blood test, study suggests",
+				"webUrl": "https://www.theguardian.com/society/2025/apr/09/at-home-saliva-test-for-prostate-cancer-better-than-blood-test-study-suggests",
+				"apiUrl": "https://content.guardianapis.com/society/2025/apr/09/at-home-saliva-test-for-prostate-cancer-better-than-blood-test-study-suggests",
+				"isHosted": false,
+				"pillarId": "pillar/news",
+				"pillarName": "News"
+			}
+		]
+	}
+}""")
+
+
+@pytest.fixture(scope="function")
+def api_401_response():
+    response = MagicMock(spec=requests.Response)
+    response.status_code = 401
+    response.raise_for_status.side_effect = requests.exceptions.HTTPError(
+        "401 Unauthorized"
+    )
+    response.ok = False
+    response.json.return_value = {"message": "Unauthorized"}
+    return response
+
+
+@pytest.fixture(scope="function")
+def status_response():
+    def make_response(status_code, headers=None):
+        response = MagicMock(spec=requests.Response)
+        response.status_code = status_code
+        response.headers = headers or {}
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(
+            f"{status_code} Error"
+        )
+        return response
+
+    return make_response
+
+
+@pytest.fixture(scope="function")
+def api_200_malformed_payload():
+    response = MagicMock(spec=requests.Response)
+    response.status_code = 200
+    response.ok = True
+    response.json.return_value = {"message": "test"}
+    response.iter_content.return_value = [b'{"message": "test"}']
+    return response
+
+
+@pytest.fixture(scope="function")
+def mock_sqs_client():
+    response = {
+        "MD5OfMessageBody": "string",
+        "MD5OfMessageAttributes": "string",
+        "MD5OfMessageSystemAttributes": "string",
         "MessageId": "test_id",
         "SequenceNumber": "string",
     }
     sqs_client = Mock()
     sqs_client.send_message.return_value = response
+
+    def send_message_batch(QueueUrl, Entries):
+        return {
+            "Successful": [
+                {"Id": e["Id"], "MessageId": f"test_id_{e['Id']}"} for e in Entries
+            ],
+            "Failed": [],
+        }
+
+    sqs_client.send_message_batch.side_effect = send_message_batch
     return sqs_client
 
 
+@pytest.fixture(scope="function")
+def json_documents(response_body):
+    parsed = _parse_results(response_body["response"]["results"], "test_ref")
+    return [
+        *parsed,
+        {"text": 'café ☃ \u2028 "quoted" \\ / \n\t\x00', "emoji": "🗞"},
+        {"nested": [{"a": [1, -2, 3.5, 0.0, 0.125]}, None, True, False, ""]},
+        {"statusCode": 200, "throttle": {"throttledSeconds": 0.125, "retries": 0}},
+    ]
+
+
 @pytest.fixture(scope="function")
 def message():
     return {"WebURL": "test", "reference": "test_ref"}
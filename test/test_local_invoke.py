@@ -7,9 +7,24 @@ from src.local_invoke import (
     lambda_name,
     get_args,
     handle_lambda_response,
+    continuation_event,
+    invoke_until_finished,
     get_lambda_client,
+    batch_options,
+    read_jobs,
+    invoke_job,
+    percentile,
+    run_batch,
+    run_jobs,
+    wait_for_completion,
+    make_sink,
+    MemorySink,
+    JsonlSink,
+    MotoSink,
+    LocalLambdaClient,
     main,
 )
+from src.lambda_function import FileStateStore
 from unittest.mock import patch, Mock
 from botocore.response import StreamingBody
 from botocore.exceptions import ClientError
@@ -18,6 +33,11 @@ import pytest
 import json
 import base64
 import io
+import os
+import subprocess
+import sys
+import threading
+import time
 
 
 class TestParseArgs:
@@ -27,6 +47,52 @@ class TestParseArgs:
     def test_returns_none_if_no_args(self):
         assert parse_args([]) is None
 
+    def test_profile_flag_adds_profile_key(self):
+        output = parse_args(shlex.split("-q q -ref ref --profile"))
+        assert output == {"q": "q", "ref": "ref", "profile": True}
+
+    def test_relevance_options(self):
+        output = parse_args(
+            shlex.split("-q q -ref ref --relevance 0.2 --keywords coal wind")
+        )
+        assert output == {
+            "q": "q",
+            "ref": "ref",
+            "relevance": 0.2,
+            "keywords": ["coal", "wind"],
+        }
+
+    def test_shard_options(self):
+        output = parse_args(shlex.split("-q q -ref ref --shard hash --shards 4"))
+        assert output == {"q": "q", "ref": "ref", "shard": "hash", "shards": 4}
+
+    def test_response_mode_options(self):
+        output = parse_args(
+            shlex.split("-q q -ref ref --response sample --sample-size 3")
+        )
+        assert output == {
+            "q": "q",
+            "ref": "ref",
+            "response": "sample",
+            "sample_size": 3,
+        }
+
+    def test_parsing_does_not_import_boto3_or_dotenv(self):
+        code = (
+            "import sys\n"
+            "from src.local_invoke import parse_args\n"
+            "parse_args(['-q', 'q', '-ref', 'ref'])\n"
+            "print(sorted({'boto3', 'botocore', 'dotenv'} & set(sys.modules)))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.dirname(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert result.stdout.strip() == "[]"
+
     def test_returns_dict_with_query_and_reference_keys(self):
         test_input = shlex.split("-q test -r ref")
         output = parse_args(test_input)
@@ -276,15 +342,23 @@ class TestInvokeLambda:
         with pytest.raises(RuntimeError, match="Failed to invoke Lambda"):
             invoke_lambda(mock_lambda_raises_exc, "test", args)
 
+    def test_async_invocation_uses_event_type_without_log_tail(self, args):
+        mock_lambda_client = Mock()
+        invoke_lambda(mock_lambda_client, "test", args, asynchronous=True)
+        kwargs = mock_lambda_client.invoke.call_args.kwargs
+        assert kwargs["InvocationType"] == "Event"
+        assert "LogType" not in kwargs
+        assert json.loads(kwargs["Payload"]) == args
+
 
 class TestLambdaName:
-    @patch("src.local_invoke.load_dotenv")
+    @patch("dotenv.load_dotenv")
     def test_loads_name_from_env(self, mock_load, monkeypatch):
         monkeypatch.setenv("LAMBDA_NAME", "test_name")
         assert lambda_name() == "test_name"
         assert mock_load.call_count == 1
 
-    @patch("src.local_invoke.load_dotenv")
+    @patch("dotenv.load_dotenv")
     def test_raises_error_if_not_found(self, mock_load):
         with pytest.raises(EnvironmentError) as e:
             lambda_name()
@@ -320,6 +394,106 @@ class TestHandleLambdaResponse:
         assert captured[4] == str({"example": "message1"})
         assert captured[5] == str({"example": "message2"})
 
+    def test_prints_job_summaries_for_multi_job_payload(
+        self, lambda_jobs_response, capsys
+    ):
+        handle_lambda_response(lambda_jobs_response)
+        captured = capsys.readouterr().out.split("\n")
+        assert captured[0] == "Successful response"
+        assert captured[1] == "1 message(s) sent"
+        assert captured[3] == "Job ref_one: 1 sent, 0 failed"
+        assert captured[4] == str({"example": "message1"})
+        assert captured[5] == "Job ref_two failed: 401 Unauthorized"
+
+    def test_streams_job_summaries_when_event_has_jobs(
+        self, lambda_jobs_response, capsys
+    ):
+        stream = lambda_jobs_response["Payload"]
+        reads = []
+
+        def read(amt=None):
+            chunk = StreamingBody.read(stream, 8)
+            reads.append(chunk)
+            return chunk
+
+        stream.read = read
+        printed = []
+        with patch("builtins.print", lambda line: printed.append((line, len(reads)))):
+            payload = handle_lambda_response(lambda_jobs_response, jobs=True)
+        assert [line for line, _ in printed][3:6] == [
+            "Job ref_one: 1 sent, 0 failed",
+            {"example": "message1"},
+            "Job ref_two failed: 401 Unauthorized",
+        ]
+        # The first job is printed before the second is read
+        assert printed[3][1] < len(reads)
+        assert [job["ref"] for job in payload["jobs"]] == ["ref_one", "ref_two"]
+        assert all("messages" not in job for job in payload["jobs"])
+
+    def test_prints_messages_while_payload_is_streamed(self, capsys):
+        payload = {
+            "statusCode": 200,
+            "messagesSent": 3,
+            "messagesFailed": 0,
+            "messages": ["https://a", "https://b", "https://c"],
+        }
+        payload_bytes = json.dumps(payload).encode("utf-8")
+        stream = StreamingBody(io.BytesIO(payload_bytes), len(payload_bytes))
+        reads = []
+
+        def read(amt=None):
+            chunk = StreamingBody.read(stream, 8)
+            reads.append(chunk)
+            return chunk
+
+        stream.read = read
+        printed = []
+        with patch("builtins.print", lambda line: printed.append((line, len(reads)))):
+            handle_lambda_response({"StatusCode": 200, "Payload": stream})
+        assert [line for line, _ in printed][3:5] == ["Messages sent:", "https://a"]
+        # The first message is printed before the rest of the payload is read
+        assert printed[4][1] < len(reads)
+
+    def test_prints_counts_only_for_summary_payload(self, capsys):
+        payload = {"statusCode": 200, "messagesSent": 2, "messagesFailed": 1}
+        handle_lambda_response(batch_response(payload=payload))
+        captured = capsys.readouterr().out.split("\n")
+        assert captured == [
+            "Successful response",
+            "2 message(s) sent",
+            "1 message(s) failed",
+            "",
+        ]
+
+    def test_prints_omitted_count_for_sample_payload(self, capsys):
+        payload = {
+            "statusCode": 200,
+            "messagesSent": 5,
+            "messagesFailed": 0,
+            "messages": [{"example": "message1"}],
+            "messagesOmitted": 4,
+        }
+        handle_lambda_response(batch_response(payload=payload))
+        captured = capsys.readouterr().out.split("\n")
+        assert captured[3] == "Messages sent:"
+        assert captured[4] == str({"example": "message1"})
+        assert captured[5] == "... and 4 more"
+
+    def test_prints_nothing_for_unsuccessful_payload(self, capsys):
+        payload = {"statusCode": 400, "error": "Bad request", "message": "bad"}
+        handle_lambda_response(batch_response(payload=payload))
+        assert capsys.readouterr().out == ""
+
+    def test_prints_profile_summary_if_present(self, lambda_profile_response, capsys):
+        handle_lambda_response(lambda_profile_response)
+        captured = capsys.readouterr().out.split("\n")
+        assert "Peak memory: 2.0 KiB" in captured
+        assert "Full profile: /tmp/profile-test.txt" in captured
+        assert any("12.5" in line and "lambda_handler" in line for line in captured)
+        assert any(
+            "512" in line and "lambda_function.py:10" in line for line in captured
+        )
+
     def test_prints_error_details_if_present(self, lambda_response_with_error, capsys):
         handle_lambda_response(lambda_response_with_error)
         captured = capsys.readouterr().out.split("\n")
@@ -342,11 +516,55 @@ class TestHandleLambdaResponse:
         assert captured[2] == "Handled Lambda Function Error"
 
 
+class TestContinuation:
+    def test_single_job_event_gets_token(self):
+        event = {"q": "q", "ref": "r"}
+        payload = {"statusCode": 200, "continuation": "token"}
+        assert continuation_event(event, payload) == {**event, "continuation": "token"}
+
+    def test_only_unfinished_jobs_are_resumed(self):
+        event = {
+            "jobs": [{"q": "a", "ref": "a"}, {"q": "b", "ref": "b"}],
+            "dedup": True,
+        }
+        payload = {"jobs": [{"ref": "a"}, {"ref": "b", "continuation": "token"}]}
+        assert continuation_event(event, payload) == {
+            "jobs": [{"q": "b", "ref": "b", "continuation": "token"}],
+            "dedup": True,
+        }
+
+    @pytest.mark.parametrize(
+        "payload", [None, {"statusCode": 200}, {"jobs": [{"ref": "a"}]}]
+    )
+    def test_none_once_finished(self, payload):
+        assert continuation_event({"jobs": [{"q": "a", "ref": "a"}]}, payload) is None
+
+    @patch("src.local_invoke.handle_lambda_response")
+    @patch("src.local_invoke.invoke_lambda")
+    def test_invokes_until_finished(self, mock_invoke_lambda, mock_handle, capsys):
+        mock_handle.side_effect = [{"continuation": "token"}, {"statusCode": 200}]
+        invoke_until_finished("client", "name", {"q": "q", "ref": "r"})
+        assert mock_invoke_lambda.call_args_list[1].args[2] == {
+            "q": "q",
+            "ref": "r",
+            "continuation": "token",
+        }
+        assert "continuing" in capsys.readouterr().out
+
+    @patch("src.local_invoke.handle_lambda_response")
+    @patch("src.local_invoke.invoke_lambda")
+    def test_stops_without_progress(self, mock_invoke_lambda, mock_handle, capsys):
+        mock_handle.return_value = {"continuation": "token"}
+        invoke_until_finished("client", "name", {"q": "q", "ref": "r"})
+        assert mock_invoke_lambda.call_count == 2
+        assert "without making progress" in capsys.readouterr().out
+
+
 class TestGetLambdaClient:
-    @patch("src.local_invoke.boto3")
-    def test_boto3_client_invoked_with_lambda(self, mock_boto3):
+    @patch("boto3.client")
+    def test_boto3_client_invoked_with_lambda(self, mock_client):
         get_lambda_client()
-        mock_boto3.client.assert_called_with("lambda")
+        mock_client.assert_called_with("lambda")
 
 
 class TestMain:
@@ -367,12 +585,427 @@ class TestMain:
         mock_get_lambda_client.return_value = "test client"
         mock_lambda_name.return_value = "test name"
         mock_invoke_lambda.return_value = "test response"
+        mock_handle_lambda_response.return_value = {"statusCode": 200}
         main()
         mock_get_args.assert_called_once()
         mock_get_lambda_client.assert_called_once()
         mock_lambda_name.assert_called_once()
         mock_invoke_lambda.assert_called_with("test client", "test name", "test args")
-        mock_handle_lambda_response.assert_called_with("test response")
+        mock_handle_lambda_response.assert_called_with("test response", jobs=False)
+
+    @patch("src.local_invoke.run_batch")
+    @patch("src.local_invoke.get_args")
+    def test_batch_option_runs_batch_instead(self, mock_get_args, mock_run_batch):
+        main(["--batch", "jobs.jsonl", "--workers", "3"])
+        mock_run_batch.assert_called_once_with(
+            "jobs.jsonl", 3, False, False, 900, lambda_client=None
+        )
+        mock_get_args.assert_not_called()
+
+    @patch("src.local_invoke.run_jobs")
+    @patch("src.local_invoke.get_lambda_client")
+    @patch("src.local_invoke.get_args")
+    def test_async_option_submits_single_job(
+        self, mock_get_args, mock_get_lambda_client, mock_run_jobs
+    ):
+        mock_get_args.return_value = {"q": "q", "ref": "ref"}
+        main(["-q", "q", "-ref", "ref", "--async", "--wait", "--timeout", "60"])
+        mock_get_args.assert_called_once_with(["-q", "q", "-ref", "ref"])
+        mock_run_jobs.assert_called_once_with(
+            [{"q": "q", "ref": "ref"}], 1, True, True, 60
+        )
+
+
+class TestBatchOptions:
+    def test_separates_batch_options_from_invocation_args(self):
+        options, remaining = batch_options(
+            shlex.split("-q q --batch jobs.csv -ref ref --workers 4")
+        )
+        assert (options.batch, options.workers) == ("jobs.csv", 4)
+        assert remaining == ["-q", "q", "-ref", "ref"]
+
+    def test_defaults_to_single_invocation(self):
+        options, remaining = batch_options(["-q", "q"])
+        assert options.batch is None
+        assert options.workers == 8
+
+
+class TestReadJobs:
+    def test_reads_jsonl_skipping_blank_lines(self, tmp_path):
+        path = tmp_path / "jobs.jsonl"
+        path.write_text(
+            '{"q": "one", "ref": "a"}\n\n{"q": "two", "ref": "b", "paginate": true}\n'
+        )
+        assert read_jobs(str(path)) == [
+            {"q": "one", "ref": "a"},
+            {"q": "two", "ref": "b", "paginate": True},
+        ]
+
+    def test_reads_csv_dropping_empty_cells(self, tmp_path):
+        path = tmp_path / "jobs.csv"
+        path.write_text("q,ref,d\none,a,2025-01-01\ntwo words,b,\n")
+        assert read_jobs(str(path)) == [
+            {"q": "one", "ref": "a", "d": "2025-01-01"},
+            {"q": "two words", "ref": "b"},
+        ]
+
+    def test_raises_for_job_without_reference(self, tmp_path):
+        path = tmp_path / "jobs.jsonl"
+        path.write_text('{"q": "one", "ref": "a"}\n{"q": "two"}\n')
+        with pytest.raises(ValueError, match="Job 2"):
+            read_jobs(str(path))
+
+
+class TestPercentile:
+    def test_nearest_rank(self):
+        values = [float(v) for v in range(1, 101)]
+        assert percentile(values, 50) == 50
+        assert percentile(values, 90) == 90
+        assert percentile(values, 99) == 99
+
+    def test_single_value(self):
+        assert percentile([2.5], 99) == 2.5
+
+
+class TestInvokeJob:
+    def test_returns_payload_and_latency(self):
+        lambda_client = Mock()
+        lambda_client.invoke.return_value = batch_response({"q": "q", "ref": "r"})
+        result = invoke_job(lambda_client, "test", {"q": "q", "ref": "r"})
+        assert result["payload"]["messagesSent"] == 1
+        assert result["seconds"] >= 0
+        assert "error" not in result
+
+    def test_asks_for_summary_unless_job_sets_response(self):
+        lambda_client = Mock()
+        lambda_client.invoke.return_value = batch_response({"q": "q", "ref": "r"})
+        invoke_job(lambda_client, "test", {"q": "q", "ref": "r"})
+        invoke_job(lambda_client, "test", {"q": "q", "ref": "r", "response": "ids"})
+        payloads = [
+            json.loads(c.kwargs["Payload"]) for c in lambda_client.invoke.call_args_list
+        ]
+        assert [p["response"] for p in payloads] == ["summary", "ids"]
+
+    def test_reinvokes_with_continuation_and_sums_counts(self):
+        lambda_client = Mock()
+        partial = {"statusCode": 200, "messagesSent": 3, "messagesFailed": 1}
+        lambda_client.invoke.side_effect = [
+            batch_response(payload={**partial, "continuation": "token"}),
+            batch_response(payload=partial),
+        ]
+        result = invoke_job(lambda_client, "test", {"q": "q", "ref": "r"})
+        assert result["payload"]["messagesSent"] == 6
+        assert result["payload"]["messagesFailed"] == 2
+        second = json.loads(lambda_client.invoke.call_args.kwargs["Payload"])
+        assert second["continuation"] == "token"
+
+    def test_reports_continuation_without_progress(self):
+        lambda_client = Mock()
+        payload = {"statusCode": 200, "messagesSent": 0, "messagesFailed": 0}
+        lambda_client.invoke.side_effect = lambda **kwargs: batch_response(
+            payload={**payload, "continuation": "token"}
+        )
+        result = invoke_job(lambda_client, "test", {"q": "q", "ref": "r"})
+        assert result["error"] == "Stopped at its timeout without making progress"
+        assert lambda_client.invoke.call_count == 2
+
+    def test_reports_function_error(self):
+        lambda_client = Mock()
+        lambda_client.invoke.return_value = {
+            "StatusCode": 200,
+            "FunctionError": "Unhandled",
+        }
+        result = invoke_job(lambda_client, "test", {"q": "q", "ref": "r"})
+        assert result["error"] == "Unhandled Lambda Function Error"
+
+    def test_reports_unsuccessful_payload(self):
+        lambda_client = Mock()
+        payload = {"statusCode": 500, "message": "Missing env"}
+        lambda_client.invoke.return_value = batch_response(payload=payload)
+        result = invoke_job(lambda_client, "test", {"q": "q", "ref": "r"})
+        assert result["error"] == "Missing env"
+
+    def test_async_job_sent_with_correlation_id(self):
+        lambda_client = Mock()
+        lambda_client.invoke.return_value = {"StatusCode": 202}
+        result = invoke_job(lambda_client, "test", {"q": "q", "ref": "r"}, True)
+        payload = json.loads(lambda_client.invoke.call_args.kwargs["Payload"])
+        assert payload["correlation_id"] == result["correlation_id"]
+        assert len(result["correlation_id"]) == 32
+        assert "error" not in result and "payload" not in result
+
+    def test_async_job_not_accepted(self):
+        lambda_client = Mock()
+        lambda_client.invoke.return_value = {"StatusCode": 500}
+        result = invoke_job(lambda_client, "test", {"q": "q", "ref": "r"}, True)
+        assert result["error"] == "Invocation not accepted: 500"
+
+    def test_reports_invoke_failure(self):
+        lambda_client = Mock()
+        lambda_client.invoke.side_effect = Exception("no network")
+        result = invoke_job(lambda_client, "test", {"q": "q", "ref": "r"})
+        assert result["error"] == "Failed to invoke Lambda: no network"
+
+
+class TestRunBatch:
+    @patch("src.local_invoke.lambda_name", return_value="test")
+    @patch("src.local_invoke.get_lambda_client")
+    def test_invokes_every_job_with_bounded_concurrency(
+        self, mock_get_client, mock_lambda_name, tmp_path, capsys
+    ):
+        path = tmp_path / "jobs.jsonl"
+        path.write_text(
+            "\n".join(json.dumps({"q": "q", "ref": f"ref{i}"}) for i in range(6))
+        )
+        running, peak, lock = 0, 0, threading.Lock()
+
+        def invoke(FunctionName, InvocationType, LogType, Payload):
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+            return batch_response(json.loads(Payload))
+
+        mock_get_client.return_value.invoke.side_effect = invoke
+        results = run_batch(str(path), workers=2)
+        mock_get_client.assert_called_once_with(max_pool_connections=2)
+        assert sorted(r["job"]["ref"] for r in results) == [f"ref{i}" for i in range(6)]
+        assert peak <= 2
+        captured = capsys.readouterr().out.split("\n")
+        assert sum(line.startswith("[") for line in captured) == 6
+        assert captured[6].startswith("6 job(s) in ")
+        assert captured[6].endswith("0 failed")
+        assert captured[7] == "6 message(s) sent, 0 message(s) failed"
+        assert captured[8].startswith("Latency p50 ")
+
+    @patch("src.local_invoke.lambda_name", return_value="test")
+    @patch("src.local_invoke.get_lambda_client")
+    def test_failures_streamed_and_counted(
+        self, mock_get_client, mock_lambda_name, tmp_path, capsys
+    ):
+        path = tmp_path / "jobs.csv"
+        path.write_text("q,ref\nq,good\nq,bad\n")
+
+        def invoke(FunctionName, InvocationType, LogType, Payload):
+            job = json.loads(Payload)
+            if job["ref"] == "bad":
+                raise Exception("denied")
+            return batch_response(job)
+
+        mock_get_client.return_value.invoke.side_effect = invoke
+        run_batch(str(path), workers=4)
+        captured = capsys.readouterr().out
+        assert (
+            "bad (" in captured
+            and "failed: Failed to invoke Lambda: denied" in captured
+        )
+        assert "2 job(s) in " in captured and "1 failed" in captured
+
+    @patch("src.local_invoke.completion_store")
+    @patch("src.local_invoke.lambda_name", return_value="test")
+    @patch("src.local_invoke.get_lambda_client")
+    def test_async_jobs_submitted_then_awaited(
+        self, mock_get_client, mock_lambda_name, mock_store, tmp_path, capsys
+    ):
+        store = FileStateStore(str(tmp_path / "state.json"))
+        mock_store.return_value = store
+
+        def invoke(FunctionName, InvocationType, Payload):
+            job = json.loads(Payload)
+            record = {"statusCode": 200, "messagesSent": 3, "messagesFailed": 0}
+            store.put(f"invocation#{job['correlation_id']}", json.dumps(record))
+            return {"StatusCode": 202}
+
+        mock_get_client.return_value.invoke.side_effect = invoke
+        jobs = [{"q": "q", "ref": "one"}, {"q": "q", "ref": "two"}]
+        results = run_jobs(jobs, 2, asynchronous=True, wait=True, timeout=1)
+        assert all("correlation_id" in r for r in results)
+        captured = capsys.readouterr().out
+        assert captured.count("submitted as") == 2
+        assert "0 message(s) sent" not in captured
+        assert "Completed one: 3 sent, 0 failed" in captured
+        assert "2 of 2 invocation(s) completed, 6 message(s) sent" in captured
+
+
+class TestWaitForCompletion:
+    def test_reports_completed_failed_and_pending(self, tmp_path, capsys):
+        store = FileStateStore(str(tmp_path / "state.json"))
+        store.put(
+            "invocation#a",
+            json.dumps({"statusCode": 200, "messagesSent": 2, "messagesFailed": 1}),
+        )
+        store.put(
+            "invocation#b",
+            json.dumps(
+                {
+                    "statusCode": 500,
+                    "messagesSent": 0,
+                    "messagesFailed": 0,
+                    "error": "Missing env",
+                }
+            ),
+        )
+        results = [
+            {"correlation_id": cid, "job": {"ref": f"ref_{cid}"}} for cid in "abc"
+        ]
+        completed = wait_for_completion(results, store, timeout=0)
+        assert set(completed) == {"a", "b"}
+        captured = capsys.readouterr().out.split("\n")
+        assert "Completed ref_a: 2 sent, 1 failed" in captured
+        assert "Completed ref_b failed: Missing env" in captured
+        assert (
+            "2 of 3 invocation(s) completed, 2 message(s) sent, 1 message(s) failed"
+            in captured
+        )
+        assert "1 still running after 0s" in captured
+
+    @patch("src.local_invoke.time.sleep")
+    def test_polls_until_complete(self, mock_sleep, capsys):
+        store = Mock()
+        record = json.dumps({"statusCode": 200, "messagesSent": 1, "messagesFailed": 0})
+        store.get.side_effect = [None, None, record]
+        results = [{"correlation_id": "a", "job": {"ref": "ref_a"}}]
+        completed = wait_for_completion(results, store, timeout=60, interval=5)
+        assert list(completed) == ["a"]
+        assert mock_sleep.call_count == 2
+        mock_sleep.assert_called_with(5)
+        store.get.assert_called_with("invocation#a")
+
+
+class TestSinks:
+    def test_make_sink(self, tmp_path):
+        assert isinstance(make_sink("memory"), MemorySink)
+        sink = make_sink(f"jsonl:{tmp_path / 'out.jsonl'}")
+        assert isinstance(sink, JsonlSink)
+        assert sink.path == str(tmp_path / "out.jsonl")
+        with pytest.raises(ValueError, match="Unknown sink"):
+            make_sink("jsonl:")
+
+    def test_memory_sink_keeps_entries(self):
+        sink = MemorySink()
+        response = sink.send_message_batch(
+            QueueUrl="q", Entries=[{"Id": "0", "MessageBody": "{}"}]
+        )
+        assert [e["Id"] for e in response["Successful"]] == ["0"]
+        assert sink.entries == [{"Id": "0", "MessageBody": "{}"}]
+        assert sink.describe() == "1 message(s) kept in memory"
+
+    def test_jsonl_sink_appends_bodies(self, tmp_path):
+        sink = JsonlSink(str(tmp_path / "out.jsonl"))
+        entries = [{"Id": str(i), "MessageBody": f'{{"n":{i}}}'} for i in range(3)]
+        sink.send_message_batch(QueueUrl="q", Entries=entries[:2])
+        sink.send_message_batch(QueueUrl="q", Entries=entries[2:])
+        lines = (tmp_path / "out.jsonl").read_text().splitlines()
+        assert [json.loads(line)["n"] for line in lines] == [0, 1, 2]
+
+    def test_moto_sink_publishes_to_fifo_queue(self):
+        sink = MotoSink()
+        try:
+            sink.send_message_batch(
+                QueueUrl=sink.queue_url,
+                Entries=[{"Id": "0", "MessageBody": "{}", "MessageGroupId": "g"}],
+            )
+            assert sink.describe() == "1 message(s) in moto SQS"
+        finally:
+            sink.close()
+
+
+class TestLocalLambdaClient:
+    @patch("src.lambda_function._get_http_session")
+    def test_runs_handler_in_process_and_publishes_to_sink(
+        self, mock_session, local_env, capsys
+    ):
+        response = Mock()
+        response.status_code = 200
+        body = {
+            "response": {
+                "pages": 1,
+                "results": [
+                    {
+                        "webPublicationDate": "2025-01-01T00:00:00Z",
+                        "webTitle": "title",
+                        "webUrl": "https://www.theguardian.com/1",
+                    }
+                ],
+            }
+        }
+        response.iter_content.return_value = [json.dumps(body).encode()]
+        response.__enter__ = Mock(return_value=response)
+        response.__exit__ = Mock(return_value=False)
+        mock_session.return_value.get.return_value = response
+        sink = MemorySink()
+        client = LocalLambdaClient(sink)
+        handle_lambda_response(invoke_lambda(client, "local", {"q": "q", "ref": "ref"}))
+        captured = capsys.readouterr().out.split("\n")
+        assert captured[0] == "Successful response"
+        assert captured[1] == "1 message(s) sent"
+        assert json.loads(sink.entries[0]["MessageBody"])["webTitle"] == "title"
+
+    def test_handler_exception_reported_as_function_error(self, local_env):
+        client = LocalLambdaClient(MemorySink())
+        with patch("src.local_invoke.lambda_handler", side_effect=TypeError("bad")):
+            response = client.invoke(
+                FunctionName="local", InvocationType="RequestResponse", Payload="{}"
+            )
+        assert response["FunctionError"] == "Unhandled"
+        assert json.loads(response["Payload"].read())["errorMessage"] == "bad"
+
+    def test_event_invocation_returns_202(self, local_env):
+        client = LocalLambdaClient(MemorySink())
+        response = client.invoke(
+            FunctionName="local", InvocationType="Event", Payload="{}"
+        )
+        assert response["StatusCode"] == 202
+
+    @patch("src.local_invoke.make_sink")
+    @patch("src.local_invoke.get_lambda_client")
+    @patch("src.local_invoke.invoke_lambda")
+    def test_main_local_uses_in_process_client(
+        self, mock_invoke, mock_get_lambda_client, mock_make_sink, local_env, capsys
+    ):
+        mock_make_sink.return_value = MemorySink()
+        mock_invoke.return_value = {"StatusCode": 500}
+        main(["-q", "q", "-ref", "ref", "--local", "--sink", "memory"])
+        mock_get_lambda_client.assert_not_called()
+        client, name, args = mock_invoke.call_args.args
+        assert isinstance(client, LocalLambdaClient)
+        assert (name, args) == ("local", {"q": "q", "ref": "ref"})
+        assert "Sink: 0 message(s) kept in memory" in capsys.readouterr().out
+
+    def test_main_local_rejects_async(self, capsys):
+        main(["-q", "q", "-ref", "ref", "--local", "--async"])
+        assert "cannot be used with --local" in capsys.readouterr().out
+
+
+@pytest.fixture(scope="function")
+def local_env(monkeypatch):
+    from src.lambda_function import _reset_resources
+
+    monkeypatch.setenv("api_key", "test_key")
+    monkeypatch.setenv("sqs_queue_url", "https://local/test.fifo")
+    monkeypatch.setenv("GUARDIAN_RATE_PER_SECOND", "1000")
+    monkeypatch.setenv("METRICS_EMF", "0")
+    monkeypatch.setattr("dotenv.load_dotenv", Mock())
+    _reset_resources()
+    yield
+    _reset_resources()
+
+
+def batch_response(job: dict | None = None, payload: dict | None = None) -> dict:
+    payload = payload or {
+        "statusCode": 200,
+        "messagesSent": 1,
+        "messagesFailed": 0,
+        "messages": [{"ref": job["ref"]}],
+    }
+    payload_bytes = json.dumps(payload).encode("utf-8")
+    return {
+        "StatusCode": 200,
+        "Payload": StreamingBody(io.BytesIO(payload_bytes), len(payload_bytes)),
+    }
 
 
 @pytest.fixture(scope="function")
@@ -419,6 +1052,69 @@ def lambda_200_response():
     }
 
 
+@pytest.fixture(scope="function")
+def lambda_jobs_response():
+    payload = {
+        "statusCode": 200,
+        "messagesSent": 1,
+        "messagesFailed": 0,
+        "jobs": [
+            {
+                "ref": "ref_one",
+                "q": "one",
+                "statusCode": 200,
+                "messagesSent": 1,
+                "messagesFailed": 0,
+                "messages": [{"example": "message1"}],
+            },
+            {
+                "ref": "ref_two",
+                "q": "two",
+                "statusCode": 502,
+                "error": "401 Unauthorized",
+                "messagesSent": 0,
+                "messagesFailed": 0,
+                "messages": [],
+            },
+        ],
+    }
+    payload_bytes = json.dumps(payload).encode("utf-8")
+    return {
+        "StatusCode": 200,
+        "Payload": StreamingBody(io.BytesIO(payload_bytes), len(payload_bytes)),
+    }
+
+
 @pytest.fixture(scope="function")
 def args():
     return {"q": "test", "d": "1997-01-01", "ref": "ref"}
+
+
+@pytest.fixture(scope="function")
+def lambda_profile_response():
+    payload = {
+        "statusCode": 200,
+        "messagesSent": 0,
+        "messagesFailed": 0,
+        "messages": [],
+        "profile": {
+            "peakMemoryBytes": 2048,
+            "file": "/tmp/profile-test.txt",
+            "hotspots": [
+                {
+                    "function": "lambda_function.py:1(lambda_handler)",
+                    "calls": 1,
+                    "totalMs": 0.5,
+                    "cumulativeMs": 12.5,
+                }
+            ],
+            "allocations": [
+                {"location": "lambda_function.py:10", "sizeBytes": 512, "count": 3}
+            ],
+        },
+    }
+    payload_bytes = json.dumps(payload).encode("utf-8")
+    return {
+        "StatusCode": 200,
+        "Payload": StreamingBody(io.BytesIO(payload_bytes), len(payload_bytes)),
+    }
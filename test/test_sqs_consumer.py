@@ -0,0 +1,353 @@
+from src.sqs_consumer import (
+    Consumer,
+    MemorySink,
+    JsonlSink,
+    RotatingFileSink,
+    ParquetSink,
+    make_sink,
+    main,
+)
+from src.lambda_function import _build_envelope, json_dumps
+from unittest.mock import patch, Mock
+from moto import mock_aws
+import boto3
+import json
+import pytest
+
+
+class TestConsumer:
+    def test_drains_queue_across_groups(self, queue, send_articles):
+        send_articles(articles(30), groups=5)
+        sink = MemorySink()
+        stats = Consumer(
+            queue, sink, boto3.client("sqs"), workers=4, wait_seconds=0
+        ).run(drain=True)
+        # Delivery is at least once, and moto's queue can hand concurrent
+        # receivers the same message
+        assert stats["received"] == stats["deleted"] >= 30
+        assert stats["articles"] == stats["received"] and stats["failed"] == 0
+        assert {a["webUrl"] for a in sink.articles} == {
+            a["webUrl"] for a in articles(30)
+        }
+        assert queue_depth(queue) == (0, 0)
+
+    def test_writes_each_group_in_order(self, queue, send_articles):
+        send_articles(articles(25), groups=2)
+        sink = MemorySink()
+        Consumer(queue, sink, boto3.client("sqs"), workers=1, wait_seconds=0).run(
+            drain=True
+        )
+        for group in (0, 1):
+            urls = [a["webUrl"] for a in sink.articles if index(a) % 2 == group]
+            expected = [a["webUrl"] for a in articles(25) if index(a) % 2 == group]
+            assert urls == expected
+
+    def test_unpacks_envelopes(self, queue):
+        envelope = _build_envelope(articles(3), compress=True)
+        boto3.client("sqs").send_message(
+            QueueUrl=queue, MessageBody=json_dumps(envelope), MessageGroupId="ref"
+        )
+        sink = MemorySink()
+        stats = Consumer(queue, sink, boto3.client("sqs"), wait_seconds=0).run(
+            drain=True
+        )
+        assert sink.articles == articles(3)
+        assert stats["deleted"] == 1 and stats["articles"] == 3
+
+    def test_failed_write_leaves_messages_to_be_received_again(
+        self, queue, send_articles
+    ):
+        send_articles(articles(4), groups=1)
+        sink = MemorySink()
+        sink.write = Mock(side_effect=failing_once(sink.write))
+        consumer = Consumer(
+            queue,
+            sink,
+            boto3.client("sqs"),
+            workers=1,
+            wait_seconds=0,
+            visibility_timeout=0,
+        )
+        stats = consumer.run(drain=True)
+        assert stats["failed"] == 4
+        assert stats["deleted"] == 4
+        assert len(sink.articles) == 4
+
+    def test_undecodable_message_is_not_deleted(self, queue):
+        sqs = boto3.client("sqs")
+        sqs.send_message(QueueUrl=queue, MessageBody="not json", MessageGroupId="a")
+        stats = Consumer(queue, MemorySink(), sqs, wait_seconds=0).run(drain=True)
+        assert stats["failed"] == 1 and stats["deleted"] == 0
+        assert queue_depth(queue) == (0, 1)
+
+    def test_undecodable_message_holds_back_rest_of_its_group(self):
+        sqs_client = Mock()
+        batch = [
+            message("0", json.dumps(articles(1)[0]), "a"),
+            message("1", "not json", "a"),
+            message("2", json.dumps(articles(3)[2]), "a"),
+            message("3", json.dumps(articles(4)[3]), "b"),
+        ]
+        sqs_client.receive_message.side_effect = [{"Messages": batch}, {}]
+        sqs_client.delete_message_batch.return_value = {
+            "Successful": [{"Id": "0"}, {"Id": "1"}]
+        }
+        sink = MemorySink()
+        stats = Consumer("url", sink, sqs_client, workers=1).run(drain=True)
+        assert [index(a) for a in sink.articles] == [0, 3]
+        sqs_client.delete_message_batch.assert_called_once_with(
+            QueueUrl="url",
+            Entries=[
+                {"Id": "0", "ReceiptHandle": "r0"},
+                {"Id": "1", "ReceiptHandle": "r3"},
+            ],
+        )
+        assert stats["failed"] == 1 and stats["heldBack"] == 1
+
+    def test_dead_letters_message_received_max_receives_times(self):
+        sqs_client = Mock()
+        batch = [
+            message("0", "not json", "a", receives=3),
+            message("1", json.dumps(articles(2)[1]), "a"),
+        ]
+        sqs_client.receive_message.side_effect = [{"Messages": batch}, {}]
+        sqs_client.delete_message_batch.return_value = {
+            "Successful": [{"Id": "0"}, {"Id": "1"}]
+        }
+        sink, dead_letter = MemorySink(), MemorySink()
+        stats = Consumer(
+            "url", sink, sqs_client, workers=1, dead_letter=dead_letter, max_receives=3
+        ).run(drain=True)
+        assert [index(a) for a in sink.articles] == [1]
+        [record] = dead_letter.articles
+        assert record.pop("error")
+        assert record == {
+            "messageId": "0",
+            "messageGroupId": "a",
+            "receiveCount": 3,
+            "body": "not json",
+        }
+        assert stats["deadLettered"] == 1 and stats["deleted"] == 2
+        request = sqs_client.receive_message.call_args.kwargs
+        assert "ApproximateReceiveCount" in request["MessageSystemAttributeNames"]
+
+    def test_keeps_message_below_max_receives(self):
+        sqs_client = Mock()
+        batch = [message("0", "not json", "a", receives=2)]
+        sqs_client.receive_message.side_effect = [{"Messages": batch}, {}]
+        dead_letter = MemorySink()
+        stats = Consumer(
+            "url",
+            MemorySink(),
+            sqs_client,
+            workers=1,
+            dead_letter=dead_letter,
+            max_receives=3,
+        ).run(drain=True)
+        assert dead_letter.articles == []
+        assert stats["failed"] == 1 and stats["deleted"] == 0
+
+    def test_receives_ten_and_deletes_in_one_batch(self):
+        sqs_client = Mock()
+        messages = [
+            {"MessageId": str(i), "ReceiptHandle": f"r{i}", "Body": json.dumps(a)}
+            for i, a in enumerate(articles(3))
+        ]
+        sqs_client.receive_message.side_effect = [{"Messages": messages}, {}]
+        sqs_client.delete_message_batch.return_value = {
+            "Successful": [{"Id": str(i)} for i in range(3)]
+        }
+        Consumer("url", MemorySink(), sqs_client, workers=1, wait_seconds=5).run(
+            drain=True
+        )
+        request = sqs_client.receive_message.call_args.kwargs
+        assert request["MaxNumberOfMessages"] == 10
+        assert request["WaitTimeSeconds"] == 5
+        sqs_client.delete_message_batch.assert_called_once_with(
+            QueueUrl="url",
+            Entries=[{"Id": str(i), "ReceiptHandle": f"r{i}"} for i in range(3)],
+        )
+
+    def test_stop_ends_workers(self):
+        sqs_client = Mock()
+        sqs_client.receive_message.return_value = {}
+        consumer = Consumer("url", MemorySink(), sqs_client, workers=2)
+        sqs_client.receive_message.side_effect = lambda **kwargs: consumer.stop() or {}
+        stats = consumer.run()
+        assert stats["received"] == 0
+
+
+class TestSinks:
+    def test_jsonl_sink_appends_lines(self, tmp_path):
+        sink = JsonlSink(str(tmp_path / "out.jsonl"))
+        sink.write(articles(2))
+        sink.write(articles(1))
+        sink.close()
+        lines = (tmp_path / "out.jsonl").read_text().splitlines()
+        assert [json.loads(line) for line in lines] == articles(2) + articles(1)
+        assert sink.describe() == f"3 article(s) written to {tmp_path / 'out.jsonl'}"
+
+    def test_rotating_sink_starts_new_file_past_max_bytes(self, tmp_path):
+        sink = RotatingFileSink(str(tmp_path / "out"), max_bytes=100)
+        for article in articles(3):
+            sink.write([article])
+        sink.close()
+        files = sorted((tmp_path / "out").iterdir())
+        assert [f.name for f in files] == [
+            "articles-00001.jsonl",
+            "articles-00002.jsonl",
+            "articles-00003.jsonl",
+        ]
+        assert json.loads(files[2].read_text()) == articles(3)[2]
+
+    def test_parquet_sink_writes_row_groups_of_files(self, tmp_path):
+        parquet = pytest.importorskip("pyarrow.parquet")
+        sink = ParquetSink(str(tmp_path), rows_per_file=2)
+        sink.write(articles(3))
+        sink.close()
+        assert len(sink.paths) == 2
+        assert parquet.read_table(sink.paths[0]).to_pylist() == articles(2)
+
+    def test_parquet_sink_needs_pyarrow(self, tmp_path):
+        modules = patch.dict("sys.modules", {"pyarrow": None})
+        with modules, pytest.raises(ImportError, match="pyarrow"):
+            ParquetSink(str(tmp_path))
+
+    @pytest.mark.parametrize(
+        "spec,sink_type",
+        [("memory", MemorySink), ("jsonl:a.jsonl", JsonlSink)],
+    )
+    def test_make_sink(self, spec, sink_type):
+        assert isinstance(make_sink(spec), sink_type)
+
+    @pytest.mark.parametrize("spec", ["jsonl", "kafka:topic"])
+    def test_make_sink_rejects_unknown_spec(self, spec):
+        with pytest.raises(ValueError, match="Unknown sink"):
+            make_sink(spec)
+
+
+@patch("dotenv.load_dotenv", Mock())
+class TestMain:
+    def test_drains_queue_into_sink(self, queue, send_articles, tmp_path, capsys):
+        send_articles(articles(5), groups=2)
+        path = tmp_path / "out.jsonl"
+        stats = main(
+            ["--queue-url", queue, "--sink", f"jsonl:{path}", "--wait", "0", "--drain"]
+        )
+        assert stats["deleted"] == 5
+        assert len(path.read_text().splitlines()) == 5
+        assert "5 message(s) consumed" in capsys.readouterr().out
+
+    def test_dead_letters_into_sink(self, queue, tmp_path, capsys):
+        sqs = boto3.client("sqs")
+        sqs.send_message(QueueUrl=queue, MessageBody="not json", MessageGroupId="a")
+        path = tmp_path / "dead-letter.jsonl"
+        stats = main(
+            [
+                "--queue-url",
+                queue,
+                "--sink",
+                f"jsonl:{tmp_path / 'out.jsonl'}",
+                "--dead-letter",
+                f"jsonl:{path}",
+                "--max-receives",
+                "1",
+                "--wait",
+                "0",
+                "--drain",
+            ]
+        )
+        assert stats["deadLettered"] == 1
+        assert json.loads(path.read_text())["body"] == "not json"
+        assert queue_depth(queue) == (0, 0)
+        assert "1 dead-lettered" in capsys.readouterr().out
+
+    def test_needs_queue_url(self, monkeypatch, capsys):
+        monkeypatch.delenv("sqs_queue_url", raising=False)
+        assert main([]) is None
+        assert "No queue" in capsys.readouterr().out
+
+
+def articles(count: int) -> list[dict]:
+    return [
+        {
+            "webTitle": f"title {i}",
+            "webUrl": f"https://www.theguardian.com/{i}",
+            "webPublicationDate": f"2025-04-01T00:00:{i:02}Z",
+            "reference": "ref",
+        }
+        for i in range(count)
+    ]
+
+
+def message(id: str, body: str, group: str, receives: int = 1) -> dict:
+    return {
+        "MessageId": id,
+        "ReceiptHandle": f"r{id}",
+        "Body": body,
+        "Attributes": {
+            "MessageGroupId": group,
+            "ApproximateReceiveCount": str(receives),
+        },
+    }
+
+
+def index(article: dict) -> int:
+    return int(article["webUrl"].rsplit("/", 1)[1])
+
+
+def failing_once(write):
+    calls = []
+
+    def side_effect(batch):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return write(batch)
+
+    return side_effect
+
+
+def queue_depth(queue_url: str) -> tuple[int, int]:
+    attributes = boto3.client("sqs").get_queue_attributes(
+        QueueUrl=queue_url,
+        AttributeNames=[
+            "ApproximateNumberOfMessages",
+            "ApproximateNumberOfMessagesNotVisible",
+        ],
+    )["Attributes"]
+    return (
+        int(attributes["ApproximateNumberOfMessages"]),
+        int(attributes["ApproximateNumberOfMessagesNotVisible"]),
+    )
+
+
+@pytest.fixture(scope="function")
+def queue(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    with mock_aws():
+        response = boto3.client("sqs").create_queue(
+            QueueName="test_queue.fifo",
+            Attributes={"FifoQueue": "true", "ContentBasedDeduplication": "true"},
+        )
+        yield response["QueueUrl"]
+
+
+@pytest.fixture(scope="function")
+def send_articles(queue):
+    def send(batch: list[dict], groups: int) -> None:
+        sqs = boto3.client("sqs")
+        for start in range(0, len(batch), 10):
+            sqs.send_message_batch(
+                QueueUrl=queue,
+                Entries=[
+                    {
+                        "Id": str(i),
+                        "MessageBody": json_dumps(article),
+                        "MessageGroupId": f"ref#{(start + i) % groups}",
+                    }
+                    for i, article in enumerate(batch[start : start + 10])
+                ],
+            )
+
+    return send